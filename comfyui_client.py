@@ -0,0 +1,273 @@
+"""
+Cliente HTTP do ComfyUI para uso em processo (interface web v4.2+)
+
+Mantém uma requests.Session com pool de conexões, evitando abrir uma conexão
+(e um interpretador Python) por job. Todas as chamadas retornam dicts com o
+resultado estruturado da API do ComfyUI.
+
+PromptTracker consome as mensagens do WebSocket (`executed`, `executing`,
+`execution_*`) e sinaliza o término de cada prompt com o nome exato dos
+arquivos gerados, sem varrer o diretório de saída.
+"""
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+COMFYUI_URL = "http://127.0.0.1:8188"
+VIDEO_EXTENSIONS = (".mp4", ".webm", ".mov", ".mkv", ".gif")
+
+
+class ComfyUIError(Exception):
+    """Erro retornado pelo ComfyUI (rede, HTTP ou validação do workflow)"""
+
+
+class ComfyUIClient:
+    """Cliente com sessão persistente para a API HTTP do ComfyUI"""
+
+    def __init__(self, base_url: str = COMFYUI_URL, client_id: Optional[str] = None,
+                 timeout: float = 30):
+        """
+        Args:
+            base_url: URL do servidor ComfyUI
+            client_id: clientId usado nas submissões (o ComfyUI envia os eventos
+                       de progresso/execução para o WebSocket com este id)
+            timeout: timeout padrão das requisições em segundos
+        """
+        self.base_url = base_url.rstrip("/")
+        self.client_id = client_id or str(uuid.uuid4())
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=8)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def ws_url(self) -> str:
+        return self.base_url.replace("http", "ws", 1) + f"/ws?clientId={self.client_id}"
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        try:
+            return self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        except requests.exceptions.RequestException as e:
+            raise ComfyUIError(f"Erro ao conectar com ComfyUI: {e}") from e
+
+    def submit(self, workflow: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Submete um workflow (formato API) para a fila do ComfyUI
+        Returns:
+            Dict com prompt_id, number (posição na fila do ComfyUI) e node_errors
+        """
+        r = self._request("POST", "/prompt",
+                          json={"prompt": workflow, "client_id": self.client_id})
+        try:
+            data = r.json()
+        except ValueError:
+            data = {}
+
+        if r.status_code != 200 or "prompt_id" not in data:
+            detail = data.get("error") or data.get("node_errors") or r.text[:500]
+            raise ComfyUIError(f"Submissão rejeitada ({r.status_code}): {detail}")
+
+        return {
+            "prompt_id":   data["prompt_id"],
+            "number":      data.get("number"),
+            "node_errors": data.get("node_errors") or {},
+        }
+
+    def upload_image(self, image_path: str) -> str:
+        """Faz upload de uma imagem para o ComfyUI e retorna o nome do arquivo."""
+        p = Path(image_path)
+        with open(p, "rb") as f:
+            files = {"image": (p.name, f, "image/png")}
+            r = self._request("POST", "/upload/image", files=files)
+        if r.status_code != 200:
+            raise ComfyUIError(f"Upload rejeitado ({r.status_code}): {r.text[:200]}")
+        return r.json()["name"]
+
+    def history(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        """Entrada de /history/{prompt_id} (None se o prompt ainda não terminou)"""
+        r = self._request("GET", f"/history/{prompt_id}")
+        if r.status_code != 200:
+            raise ComfyUIError(f"Erro ao consultar histórico ({r.status_code})")
+        return r.json().get(prompt_id)
+
+    def system_stats(self) -> Dict[str, Any]:
+        """Conteúdo de /system_stats (RAM do sistema e memória dos devices)"""
+        r = self._request("GET", "/system_stats", timeout=5)
+        if r.status_code != 200:
+            raise ComfyUIError(f"Erro ao consultar /system_stats ({r.status_code})")
+        return r.json()
+
+    def device_memory_gb(self) -> Optional[Dict[str, float]]:
+        """Memória total/livre/usada do device principal em GB (None se indisponível)"""
+        try:
+            devices = self.system_stats().get("devices") or []
+        except ComfyUIError:
+            return None
+        if not devices or "vram_free" not in devices[0]:
+            return None
+        total = devices[0].get("vram_total", 0) / 1024**3
+        free = devices[0]["vram_free"] / 1024**3
+        return {"total": total, "free": free, "used": max(0.0, total - free)}
+
+    def free_memory_gb(self) -> Optional[float]:
+        """Memória livre do device principal em GB (None se indisponível)"""
+        mem = self.device_memory_gb()
+        return mem["free"] if mem else None
+
+    def queue(self) -> Dict[str, Any]:
+        """Conteúdo de /queue (queue_running e queue_pending)"""
+        r = self._request("GET", "/queue", timeout=5)
+        if r.status_code != 200:
+            raise ComfyUIError(f"Erro ao consultar /queue ({r.status_code})")
+        return r.json()
+
+    def cancel(self, prompt_id: str) -> str:
+        """
+        Cancela um prompt: retira da fila do ComfyUI (POST /queue delete) e, se
+        já está executando, interrompe no próximo step (POST /interrupt). Só
+        interrompe quando o prompt em execução é este, para não derrubar o de
+        outro cliente.
+        Returns:
+            "interrupted", "dequeued" ou "not_found" (já terminou)
+        """
+        queue = self.queue()
+        pending = {item[1] for item in queue.get("queue_pending", [])}
+        self._request("POST", "/queue", json={"delete": [prompt_id]})
+        if prompt_id in pending:
+            # Pode ter começado entre a consulta e a remoção: conferir de novo
+            queue = self.queue()
+
+        running = {item[1] for item in queue.get("queue_running", [])}
+        if prompt_id in running:
+            r = self._request("POST", "/interrupt", json={"prompt_id": prompt_id})
+            if r.status_code != 200:
+                raise ComfyUIError(f"Erro ao interromper ({r.status_code})")
+            return "interrupted"
+        return "dequeued" if prompt_id in pending else "not_found"
+
+    def free(self, unload_models: bool = True, free_memory: bool = True):
+        """Descarrega modelos e libera o cache de memória do ComfyUI (POST /free)"""
+        r = self._request("POST", "/free",
+                          json={"unload_models": unload_models, "free_memory": free_memory})
+        if r.status_code != 200:
+            raise ComfyUIError(f"Erro ao liberar memória ({r.status_code})")
+
+    def wait_ready(self, timeout: float = 60) -> bool:
+        """Aguarda o servidor responder (ex: após reinício)"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                self.system_stats()
+                return True
+            except ComfyUIError:
+                time.sleep(1)
+        return False
+
+
+def video_outputs(outputs: Dict[str, Any]) -> List[str]:
+    """
+    Extrai os vídeos de saída de `outputs` (mensagens `executed` ou /history)
+    Returns:
+        Caminhos relativos ao diretório de saída do ComfyUI (subfolder/filename)
+    """
+    files = []
+    for node_output in outputs.values():
+        # VHS_VideoCombine usa "gifs"; SaveVideo/CreateVideo usa "images"/"videos"
+        for key in ("gifs", "videos", "images"):
+            for item in node_output.get(key) or []:
+                if not isinstance(item, dict) or item.get("type", "output") != "output":
+                    continue
+                filename = item.get("filename", "")
+                if filename.lower().endswith(VIDEO_EXTENSIONS):
+                    subfolder = item.get("subfolder") or ""
+                    files.append(f"{subfolder}/{filename}" if subfolder else filename)
+    return files
+
+
+class PromptTracker:
+    """
+    Acompanha prompts submetidos a partir das mensagens do WebSocket do ComfyUI.
+    Thread-safe: handle_message() roda na thread do watcher, wait() no worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prompts: Dict[str, Dict[str, Any]] = {}
+
+    def _state(self, prompt_id: str) -> Dict[str, Any]:
+        # Chamado com o lock adquirido; cria o estado mesmo se a mensagem
+        # chegar antes de register() (prompts servidos do cache terminam rápido)
+        return self._prompts.setdefault(prompt_id, {
+            "done": threading.Event(), "outputs": {}, "error": None,
+        })
+
+    def register(self, prompt_id: str):
+        with self._lock:
+            self._state(prompt_id)
+
+    def discard(self, prompt_id: str):
+        with self._lock:
+            self._prompts.pop(prompt_id, None)
+
+    def handle_message(self, message: Dict[str, Any]):
+        """Processa uma mensagem JSON do WebSocket"""
+        kind = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+
+        with self._lock:
+            if kind == "executed":
+                self._state(prompt_id)["outputs"][data.get("node")] = data.get("output") or {}
+            elif kind == "execution_error":
+                state = self._state(prompt_id)
+                state["error"] = data.get("exception_message") or "Erro na execução do ComfyUI"
+                state["done"].set()
+            elif kind == "execution_interrupted":
+                state = self._state(prompt_id)
+                state["error"] = "Execução interrompida no ComfyUI"
+                state["done"].set()
+            elif kind == "execution_success" or (kind == "executing" and data.get("node") is None):
+                self._state(prompt_id)["done"].set()
+
+    def finish_from_history(self, prompt_id: str, entry: Dict[str, Any]) -> bool:
+        """
+        Marca o término a partir de uma entrada de /history (rede de segurança
+        quando o WebSocket perdeu mensagens). Retorna True se o prompt terminou.
+        """
+        status = entry.get("status") or {}
+        if not status.get("completed") and status.get("status_str") not in ("success", "error"):
+            return False
+
+        with self._lock:
+            state = self._state(prompt_id)
+            state["outputs"].update(entry.get("outputs") or {})
+            if status.get("status_str") == "error":
+                state["error"] = "Erro na execução do ComfyUI"
+                for msg_type, msg in status.get("messages") or []:
+                    if msg_type == "execution_error":
+                        state["error"] = msg.get("exception_message") or state["error"]
+            state["done"].set()
+        return True
+
+    def wait(self, prompt_id: str, timeout: float) -> bool:
+        with self._lock:
+            event = self._state(prompt_id)["done"]
+        return event.wait(timeout)
+
+    def result(self, prompt_id: str) -> Dict[str, Any]:
+        """Dict com outputs, videos (relativos ao diretório de saída) e error"""
+        with self._lock:
+            state = self._state(prompt_id)
+            outputs = dict(state["outputs"])
+            error = state["error"]
+        return {"outputs": outputs, "videos": video_outputs(outputs), "error": error}
@@ -1,29 +1,47 @@
 """
 Framework base para APIs FastAPI dos modelos de vídeo
 """
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable
+from collections import deque
+from concurrent.futures import Future
+from contextlib import nullcontext
+import hashlib
+import json
+import os
 import uuid
 import asyncio
 from datetime import datetime
 from pathlib import Path
 import time
+import torch
 from enum import Enum
 
-from utils import get_logger, get_system_info, MetricsCollector, validate_video_params
+from utils import get_logger, MetricsCollector, SystemSampler, validate_video_params
 from model_loader import ModelLoader
+from video_writer import EncodePool, PROFILES, DEFAULT_PROFILE, deferred_encoding
+from tracing import Trace, GenerationCancelled
 
 logger = get_logger(__name__)
 
+# Incrementar ao mudar parâmetros fixos da geração (steps, codec...): pedidos
+# idênticos passam a gerar um vídeo novo em vez de reaproveitar o anterior
+GENERATION_VERSION = 1
+
+SSE_KEEPALIVE = 15    # segundos entre comentários keep-alive no /events
+PRELOAD_RETRY_SECONDS = (30, 60, 120, 300)   # espera entre tentativas de preload (a última se repete)
+WARMUP_STEPS = 2      # steps de denoising do warmup (PRELOAD): compila e aloca sem gerar de verdade
+
 class JobStatus(str, Enum):
     """Status de um job de geração"""
     QUEUED = "queued"
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
 
 class GenerateRequest(BaseModel):
     """Request para geração de vídeo"""
@@ -34,6 +52,8 @@ class GenerateRequest(BaseModel):
     seed: Optional[int] = Field(None, description="Seed para reprodutibilidade")
     negative_prompt: Optional[str] = Field(None, description="Negative prompt")
     guidance_scale: float = Field(7.5, ge=1.0, le=20.0, description="Guidance scale")
+    num_inference_steps: Optional[int] = Field(None, ge=1, le=200, description="Steps do denoising (None = padrão do modelo)")
+    encode_profile: Optional[str] = Field(None, description="Perfil de codificação: preview, archive ou web")
 
 class Job:
     """Representa um job de geração de vídeo"""
@@ -49,6 +69,14 @@ class Job:
         self.output_path = None
         self.error = None
         self.progress = 0
+        self.step = None           # steps de denoising concluídos / total (callback do pipeline)
+        self.total_steps = None
+        self.eta_seconds = None
+        self.worker = None
+        self.request_hash = None
+        self.deduplicated_from = None
+        self.coalesced_into = None
+        self.trace: Optional[Trace] = None   # spans da geração (compartilhado pelo lote)
 
     def to_dict(self) -> Dict[str, Any]:
         """Converte para dict"""
@@ -63,9 +91,118 @@ class Job:
             "completed_at": self.completed_at.isoformat() if self.completed_at else None,
             "output_path": str(self.output_path) if self.output_path else None,
             "error": self.error,
-            "progress": self.progress
+            "progress": self.progress,
+            "step": self.step,
+            "total_steps": self.total_steps,
+            "eta_seconds": self.eta_seconds,
+            "worker": self.worker,
+            "request_hash": self.request_hash,
+            "deduplicated_from": self.deduplicated_from,
+            "coalesced_into": self.coalesced_into
         }
 
+class JobQueue:
+    """
+    Fila FIFO assíncrona de jobs que também permite retirar, sem respeitar a
+    ordem, os jobs compatíveis com um lote em formação (micro-batching)
+    """
+
+    def __init__(self):
+        self._jobs: deque = deque()
+        self._cond = asyncio.Condition()
+
+    def qsize(self) -> int:
+        return len(self._jobs)
+
+    async def put(self, job: Job):
+        async with self._cond:
+            self._jobs.append(job)
+            self._cond.notify_all()
+
+    async def get(self) -> Job:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._jobs)
+            return self._jobs.popleft()
+
+    def take_matching(self, predicate: Callable[[Job], bool], limit: int) -> List[Job]:
+        """Remove e retorna até `limit` jobs que satisfazem `predicate`, em ordem de chegada"""
+        taken = [job for job in self._jobs if predicate(job)][:limit]
+        for job in taken:
+            self._jobs.remove(job)
+        return taken
+
+    async def wait_put(self, timeout: float):
+        """Aguarda um novo job entrar na fila (ou o timeout)"""
+        async with self._cond:
+            try:
+                await asyncio.wait_for(self._cond.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+def request_hash(model_name: str, quantization: str, request: GenerateRequest) -> Optional[str]:
+    """
+    Hash canônico do pedido: mesmo hash = mesmo vídeo
+    Returns:
+        sha256 hex, ou None sem seed fixa (resultado não reproduzível)
+    """
+    if request.seed is None:
+        return None
+    canonical = {
+        "version": GENERATION_VERSION,
+        "model": model_name,
+        "quantization": quantization,
+        **request.model_dump()
+    }
+    raw = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def batch_key(request: GenerateRequest) -> tuple:
+    """Jobs com a mesma chave podem ser gerados na mesma chamada do pipeline"""
+    return (request.resolution, request.duration, request.fps, request.guidance_scale,
+            request.num_inference_steps)
+
+
+class EventBroker:
+    """
+    Distribui eventos de jobs para os clientes conectados em /events.
+    publish() pode ser chamado de qualquer thread; a entrega acontece no event loop.
+    """
+
+    def __init__(self, max_pending: int = 256):
+        self.max_pending = max_pending
+        self._subscribers = set()
+        self._loop = None
+
+    def bind_loop(self, loop):
+        self._loop = loop
+
+    def subscribe(self) -> asyncio.Queue:
+        q = asyncio.Queue(maxsize=self.max_pending)
+        self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue):
+        self._subscribers.discard(q)
+
+    def publish(self, event: dict):
+        if self._loop is None or not self._subscribers:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._fanout, event)
+        except RuntimeError:
+            pass  # loop encerrado
+
+    def _fanout(self, event: dict):
+        for q in list(self._subscribers):
+            try:
+                q.put_nowait(event)
+            except asyncio.QueueFull:
+                # Cliente lento: descarta; ele ressincroniza via /jobs/{id}
+                pass
+
+
 class VideoModelAPI:
     """
     Classe base para APIs de modelos de vídeo
@@ -76,21 +213,71 @@ class VideoModelAPI:
         model_name: str,
         model_loader: ModelLoader,
         generate_function: callable,
-        output_dir: str = "/outputs"
+        output_dir: str = "/outputs",
+        devices: Optional[List[str]] = None,
+        batch_function: Optional[callable] = None,
+        max_batch_size: int = 1,
+        batch_window_ms: int = 200,
+        preload: bool = False,
+        warmup: bool = True,
+        encode_profile: str = DEFAULT_PROFILE,
+        encode_workers: int = 2,
+        system_sample_seconds: float = 5.0
     ):
         """
         Args:
             model_name: Nome do modelo
             model_loader: Instância do ModelLoader
-            generate_function: Função que gera vídeo
+            generate_function: Função que gera vídeo (pipeline, request, output_path, trace=, num_inference_steps=)
             output_dir: Diretório para salvar vídeos
+            devices: Um worker por item, cada um com seu pipeline (ex: ["cuda:0", "cuda:1"];
+                     repetir o device cria mais slots na mesma GPU). None = um worker
+            batch_function: batch_function(pipeline, requests, output_paths) gera vários
+                            vídeos compatíveis (ver batch_key) numa chamada do pipeline
+            max_batch_size: Máximo de jobs por lote (1 = sem micro-batching)
+            batch_window_ms: Espera máxima por jobs compatíveis antes de gerar o lote
+            preload: Carregar o modelo de cada worker no startup; /ready responde 503 até terminar
+            warmup: Com preload, gerar um vídeo mínimo (compila kernels, aquece o alocador)
+            encode_profile: Perfil de codificação dos pedidos que não escolhem um
+            encode_workers: Codificações simultâneas fora do worker (0 = no próprio worker)
+            system_sample_seconds: Intervalo da amostragem de CPU/RAM/GPU servida pelo /info
         """
         self.model_name = model_name
         self.model_loader = model_loader
+        # Um ModelLoader (e uma instância do pipeline) por worker
+        if devices:
+            model_loader.device = devices[0]
+            self.loaders = [model_loader] + [model_loader.clone(d) for d in devices[1:]]
+        else:
+            self.loaders = [model_loader]
+        self.busy: Dict[int, str] = {}   # índice do worker -> job_id em execução
+        # job_id -> (trace, lote) enquanto o pipeline roda (cancelamento interrompe pelo trace)
+        self._running: Dict[str, tuple] = {}
+
+        # Deduplicação: request_hash -> job mais recente; job primário -> jobs idênticos aguardando
+        self.by_hash: Dict[str, str] = {}
+        self.followers: Dict[str, List[Job]] = {}
         self.generate_function = generate_function
+        self.batch_function = batch_function
+        self.max_batch_size = max_batch_size if batch_function else 1
+        self.batch_window = batch_window_ms / 1000
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
+        # Preload: "pending" -> "loading" -> "warming" -> "ready"; "failed" volta a
+        # "loading" na próxima tentativa (PRELOAD_RETRY_SECONDS)
+        self.preload = preload
+        self.warmup = warmup
+        self.preload_phase = "pending" if preload else "ready"
+        self.preload_attempts = 0
+
+        # Codificação em paralelo: o worker segue para o próximo job enquanto o ffmpeg codifica
+        self.encode_profile = encode_profile
+        self.encode_pool = EncodePool(encode_workers, max_pending=2 * encode_workers) if encode_workers > 0 else None
+        self._finishing: set = set()
+        self.preload_error = None
+        self.warmup_seconds = None
+
         self.app = FastAPI(
             title=f"{model_name} Video Generation API",
             description=f"API para geração de vídeos usando {model_name}",
@@ -107,14 +294,29 @@ class VideoModelAPI:
         )
 
         self.jobs: Dict[str, Job] = {}
-        self.job_queue: asyncio.Queue = asyncio.Queue()
+        self.job_queue = JobQueue()
         self.metrics = MetricsCollector()
+        # Mudanças de estado e progresso dos jobs para clientes SSE (/events)
+        self.events = EventBroker()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # /info responde com o último snapshot, sem medir na requisição (o estado
+        # do reaper lê o registro em arquivo e a memória livre da GPU)
+        self.system_sampler = SystemSampler(system_sample_seconds,
+                                            extras={"reaper": self.model_loader.reaper.info})
 
         # Registrar rotas
         self._register_routes()
 
-        # Iniciar worker de processamento
-        asyncio.create_task(self._process_queue())
+        # Workers iniciam com o event loop do servidor (não há loop rodando no __init__)
+        @self.app.on_event("startup")
+        async def start_workers():
+            self._loop = asyncio.get_running_loop()
+            self.events.bind_loop(self._loop)
+            self.system_sampler.start()
+            for index in range(len(self.loaders)):
+                asyncio.create_task(self._process_queue(index))
+            if self.preload:
+                asyncio.create_task(self._preload())
 
     def _register_routes(self):
         """Registra endpoints da API"""
@@ -129,11 +331,16 @@ class VideoModelAPI:
                     "/health",
                     "/ready",
                     "/info",
+                    "/info/history",
                     "/unload",
                     "/queue/status",
                     "/jobs/{job_id}",
                     "/jobs/{job_id}/download",
-                    "/metrics"
+                    "/jobs/{job_id}/trace",
+                    "/jobs/{job_id}/cancel",
+                    "/events",
+                    "/metrics",
+                    "/metrics/json"
                 ]
             }
 
@@ -148,33 +355,72 @@ class VideoModelAPI:
 
         @self.app.get("/ready")
         async def ready():
-            """Verifica se modelo está carregado"""
-            is_ready = self.model_loader.is_loaded()
-            return {
+            """
+            Pronto para receber tráfego. Com preload, 503 até o modelo estar
+            carregado e aquecido; sem preload, carrega sob demanda (sempre pronto)
+            """
+            is_ready = self.preload_phase == "ready"
+            body = {
                 "ready": is_ready,
                 "model": self.model_name,
-                "loaded": is_ready
+                "loaded": any(loader.is_loaded() for loader in self.loaders),
+                "preload": self.preload,
+                "phase": self.preload_phase,
+                "attempts": self.preload_attempts,
+                "warmup_seconds": self.warmup_seconds,
+                "error": self.preload_error
             }
+            return JSONResponse(body, status_code=200 if is_ready else 503)
 
         @self.app.get("/info")
         async def info():
             """Informações do modelo e sistema"""
+            system = self.system_sampler.snapshot()
             return {
                 "model": self.model_loader.get_info(),
-                "system": get_system_info(),
+                "workers": self._workers_info(),
+                # Prontidão por modelo para o frontend (que não depende do /ready)
+                "ready": {
+                    "ready": self.preload_phase == "ready",
+                    "phase": self.preload_phase,
+                    "error": self.preload_error
+                },
+                "reaper": system.pop("reaper", None),
+                "encoding": self.encode_pool.info() if self.encode_pool else None,
+                "system": system,
                 "queue_size": self.job_queue.qsize(),
                 "total_jobs": len(self.jobs)
             }
 
+        @self.app.get("/info/history")
+        async def info_history(limit: Optional[int] = None):
+            """Série temporal de CPU, RAM e GPU (uma amostra por intervalo)"""
+            return {
+                "model": self.model_name,
+                "interval_seconds": self.system_sampler.interval,
+                "samples": self.system_sampler.history(limit)
+            }
+
         @self.app.post("/unload")
-        async def unload():
-            """Descarrega modelo da memória"""
+        async def unload(park: bool = True):
+            """
+            Descarrega modelo da memória (todos os workers); park=false descarta também da RAM.
+            409 se algum worker está gerando (os ociosos são descarregados mesmo assim)
+            """
             try:
-                result = self.model_loader.unload()
-                return result
+                # Estacionar copia os pesos para a RAM: fora do event loop
+                results = await asyncio.to_thread(
+                    lambda: [loader.unload(park=park) for loader in self.loaders])
             except Exception as e:
                 raise HTTPException(status_code=500, detail=str(e))
 
+            result = results[0]
+            if len(results) > 1:
+                result["workers"] = [r["status"] for r in results]
+            if any(r["status"] == "busy" for r in results):
+                raise HTTPException(status_code=409, detail="Modelo em uso por uma geração em andamento")
+            return result
+
         @self.app.post("/generate")
         async def generate(request: GenerateRequest, background_tasks: BackgroundTasks):
             """Cria job de geração de vídeo"""
@@ -185,11 +431,24 @@ class VideoModelAPI:
                         status_code=400,
                         detail="Parâmetros inválidos"
                     )
+                if request.encode_profile and request.encode_profile not in PROFILES:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Perfil de codificação inválido (use {', '.join(sorted(PROFILES))})"
+                    )
+                request.encode_profile = request.encode_profile or self.encode_profile
 
                 # Criar job
                 job = Job(request, self.model_name)
+                job.request_hash = request_hash(self.model_name, self.model_loader.quantization, request)
                 self.jobs[job.id] = job
 
+                # Pedido idêntico já gerado ou em andamento
+                duplicate = self._deduplicate(job)
+                self._publish(job)
+                if duplicate:
+                    return duplicate
+
                 # Adicionar à fila
                 await self.job_queue.put(job)
 
@@ -197,7 +456,7 @@ class VideoModelAPI:
 
                 # Estimar tempo
                 queue_size = self.job_queue.qsize()
-                estimated_time = queue_size * 60  # Estimativa simples: 60s por job
+                estimated_time = -(-queue_size // len(self.loaders)) * 60  # Estimativa simples: 60s por job
 
                 return {
                     "job_id": job.id,
@@ -236,6 +495,94 @@ class VideoModelAPI:
                 raise HTTPException(status_code=404, detail="Job não encontrado")
             return job.to_dict()
 
+        @self.app.get("/jobs/{job_id}/trace")
+        async def job_trace(job_id: str):
+            """Spans da geração: tempos por etapa, latência de cada step e pico de memória"""
+            job = self.jobs.get(job_id)
+            if not job:
+                raise HTTPException(status_code=404, detail="Job não encontrado")
+            # Pedidos deduplicados mostram a geração do job de origem
+            source = self.jobs.get(job.coalesced_into or job.deduplicated_from) or job
+            if source.trace is None:
+                raise HTTPException(status_code=404, detail=f"Job ainda sem trace (status: {job.status.value})")
+            return {"job_id": job.id, "trace_job_id": source.id, **source.trace.to_dict()}
+
+        @self.app.post("/jobs/{job_id}/cancel")
+        async def cancel_job(job_id: str):
+            """
+            Cancela um job: na fila, sai na hora; gerando, o denoising para no
+            próximo step e a GPU fica livre para o próximo job
+            """
+            job = self.jobs.get(job_id)
+            if not job:
+                raise HTTPException(status_code=404, detail="Job não encontrado")
+            if job.status not in (JobStatus.QUEUED, JobStatus.PROCESSING):
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Job em status '{job.status.value}' não pode ser cancelado"
+                )
+
+            job.status = JobStatus.CANCELLED
+            job.error = "Cancelado pelo usuário"
+            job.completed_at = datetime.now()
+            job.eta_seconds = None
+            self._publish(job)
+
+            # Acompanhava um job idêntico: só se desliga dele (e o primário pode
+            # ter ficado sem ninguém interessado)
+            target = job
+            if job.coalesced_into:
+                waiting = self.followers.get(job.coalesced_into, [])
+                if job in waiting:
+                    waiting.remove(job)
+                target = self.jobs.get(job.coalesced_into, job)
+
+            action = self._abandon(target)
+            logger.info(f"Job {job_id} cancelado ({action})")
+            return {"job_id": job_id, "status": job.status.value, "cancellation": action}
+
+        @self.app.get("/events")
+        async def events(request: Request, job_id: Optional[str] = None):
+            """
+            Server-Sent Events: transições de estado (`job`) e progresso por step
+            (`progress`). Cada (re)conexão recebe `hello` e o estado atual dos jobs
+            ativos. Com job_id, só esse job e o stream termina junto com ele.
+            """
+            if job_id and job_id not in self.jobs:
+                raise HTTPException(status_code=404, detail="Job não encontrado")
+            q = self.events.subscribe()
+
+            async def stream():
+                try:
+                    yield f"retry: 3000\nevent: hello\ndata: {json.dumps({'model': self.model_name})}\n\n"
+                    current = [self.jobs[job_id]] if job_id else [
+                        job for job in self.jobs.values()
+                        if job.status in (JobStatus.QUEUED, JobStatus.PROCESSING)
+                    ]
+                    for job in current:
+                        yield f"event: job\ndata: {json.dumps(self._job_event(job))}\n\n"
+                    if job_id and self._finished(self.jobs[job_id]):
+                        return
+                    while not await request.is_disconnected():
+                        try:
+                            event = await asyncio.wait_for(q.get(), timeout=SSE_KEEPALIVE)
+                        except asyncio.TimeoutError:
+                            yield ": keepalive\n\n"
+                            continue
+                        if job_id and event["job_id"] != job_id:
+                            continue
+                        yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                        if job_id and event["type"] == "job" and self._finished(self.jobs[job_id]):
+                            return
+                finally:
+                    self.events.unsubscribe(q)
+
+            return StreamingResponse(
+                stream(),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+
         @self.app.get("/jobs/{job_id}/download")
         async def download_job(job_id: str):
             """Download do vídeo gerado"""
@@ -258,71 +605,409 @@ class VideoModelAPI:
                 filename=f"{job.id}.mp4"
             )
 
-        @self.app.get("/metrics")
+        @self.app.get("/metrics", response_class=PlainTextResponse)
         async def metrics():
-            """Métricas de performance"""
-            return self.metrics.get_stats()
-
-    async def _process_queue(self):
-        """Worker que processa jobs da fila"""
-        logger.info(f"{self.model_name}: Worker de processamento iniciado")
+            """Métricas no formato texto do Prometheus (custo independe do histórico)"""
+            return PlainTextResponse(self._prometheus_metrics(),
+                                     media_type="text/plain; version=0.0.4; charset=utf-8")
+
+        @self.app.get("/metrics/json")
+        async def metrics_json():
+            """Métricas de performance: janela recente e percentis por etapa"""
+            stats = self.metrics.get_stats()
+            stats["load_wait"] = [loader.get_load_wait_stats() for loader in self.loaders]
+            return stats
+
+    @staticmethod
+    def _finished(job: Job) -> bool:
+        return job.status in (JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED)
+
+    def _wanted(self, job: Job) -> bool:
+        """Alguém ainda espera o vídeo deste job (ele mesmo ou pedidos idênticos)"""
+        return job.status != JobStatus.CANCELLED or bool(self.followers.get(job.id))
+
+    def _abandon(self, job: Job) -> str:
+        """
+        Libera o trabalho de um job que ninguém mais espera
+        Returns:
+            "dequeued" (saiu da fila), "interrupting" (pipeline para no próximo step),
+            "continuing" (o lote ou pedidos idênticos ainda precisam da geração) ou
+            "discarded" (já codificando ou formando lote: o resultado é descartado)
+        """
+        if self._wanted(job):
+            return "continuing"
+        if self.job_queue.take_matching(lambda queued: queued is job, 1):
+            return "dequeued"
+        running = self._running.get(job.id)
+        if running is None:
+            return "discarded"
+        trace, batch = running
+        if any(self._wanted(other) for other in batch):
+            return "continuing"
+        trace.cancel()
+        return "interrupting"
+
+    @staticmethod
+    def _job_event(job: Job) -> Dict[str, Any]:
+        return {"type": "job", "job_id": job.id, "job": job.to_dict()}
+
+    def _publish(self, job: Job):
+        """Notifica os clientes de /events da mudança de estado do job"""
+        self.events.publish(self._job_event(job))
+
+    def _track_progress(self, trace: Trace, batch: List[Job]):
+        """Leva os steps do pipeline (thread do worker) ao progresso dos jobs, no event loop"""
+        loop = self._loop
+
+        def on_step(done: int, total: Optional[int], step_seconds: float):
+            if loop is not None:
+                loop.call_soon_threadsafe(self._update_progress, batch, done, total, step_seconds)
+
+        trace.on_step(on_step)
+
+    def _update_progress(self, batch: List[Job], done: int, total: Optional[int], step_seconds: float):
+        """Progresso real (steps concluídos) e ETA pela taxa de steps; roda no event loop"""
+        jobs = [j for job in batch for j in [job] + self.followers.get(job.id, [])]
+        for job in jobs:
+            if job.status != JobStatus.PROCESSING:
+                continue
+            job.step, job.total_steps = done, total
+            if total:
+                # 100 só quando o vídeo estiver salvo (ainda há decode e codificação)
+                job.progress = min(99, done * 100 // total)
+                job.eta_seconds = round(max(total - done, 0) * step_seconds, 1)
+            self.events.publish({
+                "type": "progress", "job_id": job.id, "progress": job.progress,
+                "step": job.step, "total_steps": job.total_steps, "eta_seconds": job.eta_seconds
+            })
+
+    def _prometheus_metrics(self) -> str:
+        """Histogramas do MetricsCollector mais o estado atual da fila e dos workers"""
+        model = f'model="{self.model_name}"'
+        lines = [
+            "# HELP video_queue_size Jobs aguardando na fila",
+            "# TYPE video_queue_size gauge",
+            f"video_queue_size{{{model}}} {self.job_queue.qsize()}",
+            "# HELP video_worker_busy Worker gerando (1) ou livre (0)",
+            "# TYPE video_worker_busy gauge",
+            *(f'video_worker_busy{{{model},worker="{index}"}} {int(index in self.busy)}'
+              for index in range(len(self.loaders))),
+            "# HELP video_model_loaded Pipeline do worker carregado no device",
+            "# TYPE video_model_loaded gauge",
+            *(f'video_model_loaded{{{model},worker="{index}"}} {int(loader.is_loaded())}'
+              for index, loader in enumerate(self.loaders)),
+            "# HELP video_load_wait_seconds_total Tempo esperando carga do modelo em get_model()",
+            "# TYPE video_load_wait_seconds_total counter",
+            *(f'video_load_wait_seconds_total{{{model},worker="{index}"}} {loader.load_wait_total:.3f}'
+              for index, loader in enumerate(self.loaders)),
+        ]
+        return "\n".join(lines) + "\n" + self.metrics.prometheus()
+
+    def _workers_info(self) -> List[Dict[str, Any]]:
+        """Device, estado do pipeline e job atual de cada worker"""
+        return [
+            {
+                "worker": index,
+                "device": loader.device,
+                "loaded": loader.is_loaded(),
+                "tier": loader.tier(),
+                "job_id": self.busy.get(index)
+            }
+            for index, loader in enumerate(self.loaders)
+        ]
 
-        while True:
+    async def _preload(self):
+        """
+        Carrega e aquece o pipeline de cada worker antes de liberar o /ready;
+        uma falha (ex: volume de modelos ainda montando) é tentada de novo
+        """
+        while not await self._preload_attempt():
+            delay = PRELOAD_RETRY_SECONDS[min(self.preload_attempts, len(PRELOAD_RETRY_SECONDS)) - 1]
+            logger.info(f"{self.model_name}: Nova tentativa de preload em {delay}s")
+            await asyncio.sleep(delay)
+
+    async def _preload_attempt(self) -> bool:
+        """Uma tentativa de preload; False se a carga falhou"""
+        start_time = time.time()
+        self.preload_attempts += 1
+        try:
+            self.preload_phase = "loading"
+            self.preload_error = None
+            for loader in self.loaders:
+                await asyncio.to_thread(loader.get_model)
+
+            if self.warmup:
+                self.preload_phase = "warming"
+                try:
+                    await asyncio.gather(*(asyncio.to_thread(self._warmup, index)
+                                           for index in range(len(self.loaders))))
+                except Exception as e:
+                    # Modelo carregado: o aquecimento é só otimização
+                    self.preload_error = f"warmup: {e}"
+                    logger.warning(f"{self.model_name}: Falha no warmup - {e}")
+
+            self.warmup_seconds = round(time.time() - start_time, 2)
+            self.preload_phase = "ready"
+            logger.info(f"{self.model_name}: Pronto após preload em {self.warmup_seconds}s")
+            return True
+        except Exception as e:
+            self.preload_phase = "failed"
+            self.preload_error = str(e)
+            logger.error(f"{self.model_name}: Falha no preload (tentativa {self.preload_attempts}) - {e}")
+            return False
+
+    def _warmup(self, index: int):
+        """
+        Gera um vídeo mínimo com poucos steps no worker (roda em thread): o
+        suficiente para compilar kernels e alocar buffers; o arquivo é descartado
+        """
+        loader = self.loaders[index]
+        output_path = self.output_dir / f".warmup-{self.model_name}-{index}.mp4"
+        request = GenerateRequest(prompt="warmup", duration=1, fps=24, resolution="256x256", seed=0)
+        try:
+            with loader.device_context(), loader.using():
+                model, pipeline = loader.get_model()
+                self.generate_function(pipeline, request, output_path,
+                                       num_inference_steps=WARMUP_STEPS)
+        finally:
+            output_path.unlink(missing_ok=True)
+
+    def _deduplicate(self, job: Job) -> Optional[Dict[str, Any]]:
+        """
+        Conclui o job na hora com o vídeo de um pedido idêntico já gerado, ou
+        o associa ao job idêntico na fila/em execução
+        Returns:
+            Resposta do /generate, ou None se o job deve ir para a fila
+        """
+        if not job.request_hash:
+            return None
+
+        original = self.jobs.get(self.by_hash.get(job.request_hash))
+        if original and original.status == JobStatus.COMPLETED and self._complete_from(job, original):
+            logger.info(f"Job {job.id} reaproveitou o vídeo de {original.id}")
+            return {"job_id": job.id, "status": job.status.value,
+                    "deduplicated_from": original.id, "model_loaded": self.model_loader.is_loaded()}
+
+        if original and original.status in (JobStatus.QUEUED, JobStatus.PROCESSING):
+            job.coalesced_into = original.id
+            job.status = original.status
+            self.followers.setdefault(original.id, []).append(job)
+            logger.info(f"Job {job.id} acompanha o job idêntico {original.id}")
+            return {"job_id": job.id, "status": job.status.value,
+                    "coalesced_into": original.id, "model_loaded": self.model_loader.is_loaded()}
+
+        self.by_hash[job.request_hash] = job.id
+        return None
+
+    def _complete_from(self, job: Job, original: Job) -> bool:
+        """Hard link do vídeo original com o nome do novo job (sem copiar bytes)"""
+        if not original.output_path or not original.output_path.exists():
+            return False
+        output_path = self.output_dir / f"{job.id}.mp4"
+        try:
+            os.link(original.output_path, output_path)
+        except OSError:
+            output_path = original.output_path
+        job.status = JobStatus.COMPLETED
+        job.started_at = job.completed_at = datetime.now()
+        job.output_path = output_path
+        job.progress = 100
+        job.deduplicated_from = original.id
+        return True
+
+    def _settle_followers(self, job: Job):
+        """Propaga o resultado de um job aos pedidos idênticos que o acompanham"""
+        for follower in self.followers.pop(job.id, []):
+            if not (job.output_path is not None and self._complete_from(follower, job)):
+                follower.status = JobStatus.FAILED
+                follower.error = job.error or "Job idêntico terminou sem vídeo"
+                follower.completed_at = datetime.now()
+            self._publish(follower)
+
+    def _generate(self, loader: ModelLoader, batch: List[Job], output_paths: List[Path],
+                  trace: Trace) -> Dict[Path, Future]:
+        """
+        Executa a geração no device do worker (roda em thread)
+        Returns:
+            Codificações agendadas no EncodePool por arquivo de saída (vazio se já escritas)
+        """
+        encoding = deferred_encoding(self.encode_pool) if self.encode_pool else nullcontext([])
+        with loader.device_context(), loader.using(), trace.activate(), encoding as encodes:
             try:
-                # Pegar próximo job da fila
-                job = await self.job_queue.get()
+                # Garantir que modelo está carregado
+                was_loaded = loader.is_loaded()
+                start = time.monotonic()
+                with trace.span("load") if not was_loaded else nullcontext():
+                    model, pipeline = loader.get_model()
+                if not was_loaded:
+                    self._observe("load", time.monotonic() - start, batch)
+
+                # Cancelado durante a carga: nem começar
+                trace.raise_if_cancelled()
+                start = time.monotonic()
+                with trace.span("generate"):
+                    if len(batch) == 1:
+                        self.generate_function(pipeline, batch[0].request, output_paths[0], trace=trace)
+                    else:
+                        self.batch_function(pipeline, [job.request for job in batch], output_paths,
+                                            trace=trace)
+                self._observe("generate", time.monotonic() - start, batch)
+                for stage in ("denoise", "decode"):
+                    seconds = trace.seconds(stage)
+                    if seconds:
+                        self._observe(stage, seconds, batch)
+            except Exception as e:
+                # Não deixar codificações parciais concorrendo com uma nova tentativa
+                for _, future in encodes:
+                    future.exception()
+                if isinstance(e, GenerationCancelled) and torch.cuda.is_available():
+                    # Ativações do denoising interrompido voltam para os outros processos
+                    torch.cuda.empty_cache()
+                raise
+        return dict(encodes)
 
-                logger.info(f"Processando job {job.id}")
-                job.status = JobStatus.PROCESSING
-                job.started_at = datetime.now()
+    def _observe(self, stage: str, seconds: float, batch: List[Job]):
+        """Registra a duração de uma etapa para cada job do lote"""
+        for job in batch:
+            self.metrics.observe(stage, seconds, self.model_name, job.request.resolution)
 
-                start_time = time.time()
+    async def _collect_batch(self, job: Job) -> List[Job]:
+        """Agrupa jobs compatíveis que chegarem dentro da janela de micro-batching"""
+        batch = [job]
+        if self.max_batch_size <= 1:
+            return batch
 
+        key = batch_key(job.request)
+        deadline = time.monotonic() + self.batch_window
+        while True:
+            batch += self.job_queue.take_matching(
+                lambda other: batch_key(other.request) == key,
+                self.max_batch_size - len(batch)
+            )
+            remaining = deadline - time.monotonic()
+            if len(batch) >= self.max_batch_size or remaining <= 0:
+                return batch
+            await self.job_queue.wait_put(remaining)
+
+    async def _run_batch(self, loader: ModelLoader, batch: List[Job]):
+        """Gera um lote; se a chamada em lote falhar, tenta cada job isoladamente"""
+        start_time = time.time()
+        output_paths = [self.output_dir / f"{job.id}.mp4" for job in batch]
+        trace = Trace(batch_size=len(batch), worker=batch[0].worker)
+        self._track_progress(trace, batch)
+        for job in batch:
+            job.trace = trace
+            self._running[job.id] = (trace, batch)
+
+        try:
+            encodes = await asyncio.to_thread(self._generate, loader, batch, output_paths, trace)
+            error = None
+        except GenerationCancelled as e:
+            logger.info(f"Geração de {', '.join(job.id for job in batch)} interrompida")
+            error = e
+            encodes = {}
+        except Exception as e:
+            if len(batch) > 1:
+                logger.warning(f"Lote de {len(batch)} jobs falhou ({e}); gerando individualmente")
+                for job in batch:
+                    self._running.pop(job.id, None)
+                for job in batch:
+                    if self._wanted(job):
+                        await self._run_batch(loader, [job])
+                return
+            error = e
+            encodes = {}
+        finally:
+            for job in batch:
+                self._running.pop(job.id, None)
+
+        if encodes:
+            # O worker fica livre; os jobs terminam quando a codificação terminar
+            task = asyncio.create_task(self._finish_batch(batch, output_paths, encodes, start_time, error))
+            self._finishing.add(task)
+            task.add_done_callback(self._finishing.discard)
+        else:
+            await self._finish_batch(batch, output_paths, encodes, start_time, error)
+
+    async def _finish_batch(self, batch: List[Job], output_paths: List[Path], encodes: Dict[Path, Future],
+                            start_time: float, error: Optional[Exception]):
+        """Aguarda a codificação de cada job (se agendada) e registra o resultado"""
+        for job, output_path in zip(batch, output_paths):
+            job_error = error
+            if job_error is None and output_path in encodes:
                 try:
-                    # Garantir que modelo está carregado
-                    model, pipeline = self.model_loader.get_model()
-
-                    # Gerar vídeo
-                    output_path = self.output_dir / f"{job.id}.mp4"
-
-                    await asyncio.to_thread(
-                        self.generate_function,
-                        pipeline,
-                        job.request,
-                        output_path
-                    )
+                    _, encode_seconds = await asyncio.wrap_future(encodes[output_path])
+                    self._observe("encode", encode_seconds, [job])
+                except Exception as e:
+                    job_error = e
 
-                    # Job completado
-                    job.status = JobStatus.COMPLETED
-                    job.completed_at = datetime.now()
+            if job.status == JobStatus.CANCELLED:
+                # Cancelado com o lote em andamento: o vídeo só serve aos pedidos idênticos
+                if job_error is None and self.followers.get(job.id):
                     job.output_path = output_path
-                    job.progress = 100
-
-                    duration = time.time() - start_time
-                    self.metrics.record_inference(
-                        duration=duration,
-                        prompt_length=len(job.request.prompt),
-                        success=True
-                    )
+                else:
+                    output_path.unlink(missing_ok=True)
+                self._settle_followers(job)
+                continue
+
+            duration = time.time() - start_time
+            job.completed_at = datetime.now()
+            if job_error is None:
+                # Job completado
+                job.status = JobStatus.COMPLETED
+                job.output_path = output_path
+                job.progress = 100
+                job.eta_seconds = 0
+                logger.info(f"Job {job.id} completado em {duration:.2f}s (lote de {len(batch)})")
+            else:
+                logger.error(f"Erro ao processar job {job.id}: {str(job_error)}")
+                job.status = JobStatus.FAILED
+                job.error = str(job_error)
+
+            self.metrics.record_inference(
+                duration=duration,
+                prompt_length=len(job.request.prompt),
+                success=job_error is None,
+                error=str(job_error) if job_error else None,
+                model=self.model_name,
+                resolution=job.request.resolution
+            )
+            self._publish(job)
+            self._settle_followers(job)
 
-                    logger.info(f"Job {job.id} completado em {duration:.2f}s")
+    async def _process_queue(self, index: int = 0):
+        """Worker que processa jobs da fila; o primeiro worker livre pega o próximo job"""
+        loader = self.loaders[index]
+        logger.info(f"{self.model_name}: Worker {index} iniciado (device: {loader.device or 'padrão'})")
 
-                except Exception as e:
-                    logger.error(f"Erro ao processar job {job.id}: {str(e)}")
-                    job.status = JobStatus.FAILED
-                    job.error = str(e)
-                    job.completed_at = datetime.now()
-
-                    duration = time.time() - start_time
-                    self.metrics.record_inference(
-                        duration=duration,
-                        prompt_length=len(job.request.prompt),
-                        success=False,
-                        error=str(e)
-                    )
+        while True:
+            try:
+                # Pegar próximo job da fila e os compatíveis que chegarem na janela
+                job = await self.job_queue.get()
+                batch = await self._collect_batch(job)
+                # Cancelados enquanto o lote se formava (fora da fila, ainda não gerando)
+                batch = [job for job in batch if self._wanted(job)]
+                if not batch:
+                    continue
+
+                for job in batch:
+                    logger.info(f"Processando job {job.id} no worker {index}")
+                    if job.status != JobStatus.CANCELLED:
+                        job.status = JobStatus.PROCESSING
+                    job.started_at = datetime.now()
+                    job.worker = index
+                    self._observe("queue_wait", (job.started_at - job.created_at).total_seconds(), [job])
+                    self._publish(job)
+                    for follower in self.followers.get(job.id, []):
+                        follower.status = JobStatus.PROCESSING
+                        follower.started_at = job.started_at
+                        self._publish(follower)
+                self.busy[index] = ",".join(job.id for job in batch)
 
+                try:
+                    await self._run_batch(loader, batch)
                 finally:
-                    self.job_queue.task_done()
+                    self.busy.pop(index, None)
 
             except Exception as e:
                 logger.error(f"Erro no worker de processamento: {str(e)}")
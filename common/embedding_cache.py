@@ -0,0 +1,204 @@
+"""
+Cache de embeddings de prompt para os pipelines diffusers
+
+Usuários iteram seeds e resoluções com o mesmo prompt e negative prompt; o
+text encoder (T5/UMT5/Gemma) não precisa recodificá-los a cada job. Os
+embeddings são endereçados por conteúdo: sha256(encoder, prompt, max_length).
+Espaços em branco repetidos são normalizados (o tokenizer SentencePiece já os
+colapsa), então prompts que diferem só nisso compartilham a entrada.
+
+Camadas: LRU em memória e, opcionalmente, diretório em disco (sobrevive a
+reinícios e é compartilhável entre containers via volume).
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import torch
+
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Colapsa espaços em branco (não altera a tokenização do SentencePiece)"""
+    return " ".join((prompt or "").split())
+
+
+class EmbeddingCache:
+    """LRU de embeddings por prompt com camada opcional em disco"""
+
+    def __init__(self, max_entries: int = 64, disk_dir: Optional[str] = None):
+        """
+        Args:
+            max_entries: Entradas mantidas em memória
+            disk_dir: Diretório da camada em disco (None = só memória)
+        """
+        self.max_entries = max_entries
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(encoder: str, prompt: str, max_length: int) -> str:
+        raw = f"{encoder}\x00{max_length}\x00{normalize_prompt(prompt)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        if self.disk_dir:
+            path = self.disk_dir / f"{key}.pt"
+            if path.exists():
+                try:
+                    value = torch.load(path, map_location="cpu")
+                except Exception as e:
+                    logger.warning(f"Embedding em disco ilegível ({path.name}): {e}")
+                    value = None
+                if value is not None:
+                    self._remember(key, value)
+                    with self._lock:
+                        self.disk_hits += 1
+                    return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: Any):
+        self._remember(key, value)
+        if self.disk_dir:
+            # Escrita atômica: outro container pode estar lendo o mesmo diretório
+            path = self.disk_dir / f"{key}.pt"
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            try:
+                torch.save(_to_cpu(value), tmp)
+                os.replace(tmp, path)
+            except Exception as e:
+                logger.warning(f"Falha ao gravar embedding em disco: {e}")
+
+    def _remember(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "disk_dir": str(self.disk_dir) if self.disk_dir else None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else None
+            }
+
+
+def _to_cpu(value: Any) -> Any:
+    if isinstance(value, torch.Tensor):
+        return value.detach().cpu()
+    return tuple(_to_cpu(v) for v in value)
+
+
+def _to(value: Any, device: Any, dtype: Any) -> Any:
+    if isinstance(value, torch.Tensor):
+        # Máscaras de atenção mantêm o dtype inteiro/bool
+        if dtype is not None and value.is_floating_point():
+            return value.to(device=device, dtype=dtype)
+        return value.to(device=device)
+    return tuple(_to(v, device, dtype) for v in value)
+
+
+def _rows(value: Any, index: int) -> Any:
+    if isinstance(value, torch.Tensor):
+        return value[index:index + 1]
+    return tuple(_rows(v, index) for v in value)
+
+
+def _cat(values: list) -> Any:
+    if isinstance(values[0], torch.Tensor):
+        return torch.cat(values, dim=0)
+    return tuple(_cat([v[i] for v in values]) for i in range(len(values[0])))
+
+
+def _repeat(value: Any, times: int) -> Any:
+    if times == 1:
+        return value
+    if isinstance(value, torch.Tensor):
+        return value.repeat_interleave(times, dim=0)
+    return tuple(_repeat(v, times) for v in value)
+
+
+def install_embedding_cache(pipeline: Any, cache: EmbeddingCache, encoder: str,
+                            method: str = "_get_t5_prompt_embeds") -> bool:
+    """
+    Envolve o método de codificação por prompt do pipeline (LTX e Wan no
+    diffusers: `_get_t5_prompt_embeds(prompt, num_videos_per_prompt,
+    max_sequence_length, device, dtype)`) com o cache. Prompts em lote são
+    consultados um a um; só os ausentes vão ao text encoder, numa única chamada.
+
+    Args:
+        pipeline: Pipeline diffusers carregado
+        cache: Cache compartilhado
+        encoder: Identificador do text encoder (entra na chave)
+        method: Nome do método a envolver
+    Returns:
+        True se o pipeline expõe o método e foi envolvido
+    """
+    original: Optional[Callable] = getattr(pipeline, method, None)
+    if original is None or getattr(original, "_embedding_cache", None) is cache:
+        return False
+
+    def cached(prompt=None, num_videos_per_prompt: int = 1, max_sequence_length: int = 226,
+               device=None, dtype=None, **kwargs):
+        if kwargs:
+            # Assinatura diferente da esperada: não arriscar um resultado errado
+            return original(prompt=prompt, num_videos_per_prompt=num_videos_per_prompt,
+                            max_sequence_length=max_sequence_length, device=device,
+                            dtype=dtype, **kwargs)
+
+        prompts = [prompt] if isinstance(prompt, str) else list(prompt)
+        keys = [cache.key(encoder, p, max_sequence_length) for p in prompts]
+        found = [cache.get(k) for k in keys]
+
+        missing = [i for i, value in enumerate(found) if value is None]
+        if missing:
+            # Prompts repetidos no mesmo lote são codificados uma vez
+            unique = list(dict.fromkeys(keys[i] for i in missing))
+            texts = [prompts[keys.index(k)] for k in unique]
+            encoded = original(prompt=texts, num_videos_per_prompt=1,
+                               max_sequence_length=max_sequence_length,
+                               device=device, dtype=dtype)
+            fresh = {}
+            for row, k in enumerate(unique):
+                fresh[k] = _rows(encoded, row)
+                cache.put(k, fresh[k])
+            for i in missing:
+                found[i] = fresh[keys[i]]
+
+        value = _cat([_to(v, device, dtype) for v in found])
+        return _repeat(value, num_videos_per_prompt)
+
+    cached._embedding_cache = cache
+    setattr(pipeline, method, cached)
+    logger.info(f"Cache de embeddings instalado em {type(pipeline).__name__}.{method} ({encoder})")
+    return True
@@ -2,11 +2,18 @@
 Gerenciador de carregamento de modelos sob demanda
 """
 import torch
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
 from typing import Optional, Dict, Any, Callable
-from datetime import datetime, timedelta
+from datetime import datetime
 import threading
 import time
 from utils import get_logger, get_gpu_memory_info
+from embedding_cache import EmbeddingCache, install_embedding_cache
+from model_reaper import ModelReaper, default_reaper, free_memory_gb
+from weight_loading import LoadProfile, load_phase, resolve_load_mode
+from weight_parking import WeightParking
+from tracing import install_tracing
 
 logger = get_logger(__name__)
 
@@ -21,7 +28,12 @@ class ModelLoader:
         model_path: str,
         load_function: Callable,
         quantization: str = "fp16",
-        auto_unload_minutes: Optional[int] = None
+        auto_unload_minutes: Optional[int] = None,
+        device: Optional[str] = None,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        reaper: Optional[ModelReaper] = None,
+        load_mode: str = "standard",
+        parking: Optional[WeightParking] = None
     ):
         """
         Args:
@@ -30,21 +42,83 @@ class ModelLoader:
             load_function: Função que carrega o modelo
             quantization: Tipo de quantização (fp4, fp8, fp16)
             auto_unload_minutes: Minutos de inatividade antes de descarregar (None = nunca)
+            device: Device da instância (ex: "cuda:1"); None = padrão da função de carga
+            embedding_cache: Cache de embeddings de prompt instalado no pipeline após a carga
+            reaper: Reaper de ociosidade/memória compartilhado (None = o padrão do processo)
+            load_mode: "standard" ou "mmap" (safetensors direto no device, ver weight_loading)
+            parking: Estacionamento em RAM pinned usado por unload() (None = descartar os pesos)
         """
         self.model_name = model_name
         self.model_path = model_path
         self.load_function = load_function
         self.quantization = quantization
         self.auto_unload_minutes = auto_unload_minutes
+        self.device = device
+        self.embedding_cache = embedding_cache
+        self.load_mode = load_mode
+        self.parking = parking
 
         self.model = None
         self.pipeline = None
         self.loaded = False
         self.loading = False
         self.last_used = None
+        self.active = 0            # gerações em andamento (não descarregar)
+        self.memory_gb = None      # memória ocupada pela última carga
+        self.last_load = None      # resultado de load() (tempo e RSS por fase)
 
         self._lock = threading.Lock()
-        self._unload_timer = None
+        # Carga em andamento: chamadores concorrentes esperam o mesmo Future
+        self._load_future: Optional[Future] = None
+
+        # Tempo que chamadores de get_model() passaram esperando a carga
+        self.load_waits = 0
+        self.load_wait_total = 0.0
+        self.load_wait_max = 0.0
+
+        self.reaper = reaper or default_reaper()
+        self.reaper.register(self)
+
+    def clone(self, device: Optional[str] = None) -> "ModelLoader":
+        """Novo loader com a mesma configuração (instância própria do pipeline)"""
+        return ModelLoader(
+            model_name=self.model_name,
+            model_path=self.model_path,
+            load_function=self.load_function,
+            quantization=self.quantization,
+            auto_unload_minutes=self.auto_unload_minutes,
+            device=device,
+            embedding_cache=self.embedding_cache,
+            reaper=self.reaper,
+            load_mode=self.load_mode,
+            parking=self.parking
+        )
+
+    def device_context(self):
+        """Torna o device deste loader o device CUDA corrente (ex: torch.Generator("cuda"))"""
+        if self.device and self.device.startswith("cuda") and torch.cuda.is_available():
+            return torch.cuda.device(self.device)
+        return nullcontext()
+
+    @contextmanager
+    def using(self):
+        """Marca o loader como em uso durante uma geração (o reaper não o descarrega)"""
+        with self._lock:
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.last_used = datetime.now()
+
+    def tier(self) -> str:
+        """Onde estão os pesos: gpu (carregado), parked (RAM) ou disk"""
+        if self.is_loaded():
+            return "gpu"
+        if self.parking is not None and self.parking.has(self):
+            return "parked"
+        return "disk"
 
     def is_loaded(self) -> bool:
         """Verifica se modelo está carregado"""
@@ -52,7 +126,8 @@ class ModelLoader:
 
     def load(self) -> Dict[str, Any]:
         """
-        Carrega modelo em memória
+        Carrega modelo em memória (single-flight: chamadas concorrentes
+        esperam a carga em andamento em vez de falhar)
         Returns:
             Dict com informações do carregamento
         """
@@ -65,85 +140,160 @@ class ModelLoader:
                     "memory": get_gpu_memory_info()
                 }
 
-            if self.loading:
-                logger.warning(f"{self.model_name}: Carregamento já em andamento")
-                return {
-                    "status": "loading_in_progress",
-                    "model_name": self.model_name
-                }
+            future = self._load_future
+            owner = future is None
+            if owner:
+                future = self._load_future = Future()
+                self.loading = True
 
-            self.loading = True
+        if not owner:
+            logger.info(f"{self.model_name}: Aguardando carregamento em andamento")
+            return future.result()
 
         try:
-            logger.info(f"{self.model_name}: Iniciando carregamento...")
-            logger.info(f"Memória antes: {get_gpu_memory_info()}")
+            result = self._load()
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._load_future = None
+                self.loading = False
 
+    def _load(self) -> Dict[str, Any]:
+        """Executa a carga (apenas o primeiro chamador de load())"""
+        try:
+            logger.info(f"{self.model_name}: Iniciando carregamento...")
             start_time = time.time()
-
-            # Chama função de carregamento específica do modelo
-            self.model, self.pipeline = self.load_function(
-                self.model_path,
-                self.quantization
-            )
+            profile = LoadProfile()
+
+            with profile.activate():
+                # Liberar memória de modelos LRU (neste ou em outros containers)
+                with load_phase("make_room"):
+                    self.reaper.make_room(self)
+
+                logger.info(f"Memória antes: {get_gpu_memory_info()}")
+                free_before = free_memory_gb()
+
+                # Pesos estacionados na RAM: só copiar de volta ao device
+                restored = None
+                if self.parking is not None and self.parking.has(self):
+                    with load_phase("unpark"), self.device_context():
+                        restored = self.parking.restore(self)
+
+                if restored:
+                    source = "parked"
+                    model, pipeline = restored
+                else:
+                    # Chama função de carregamento específica do modelo; ela marca as
+                    # fases internas (from_pretrained, to_device, cpu_offload)
+                    source = "disk"
+                    kwargs = {"device": self.device} if self.device else {}
+                    if self.load_mode != "standard":
+                        # Diffusers antigo sem device_map por device: cair para "standard"
+                        self.load_mode = resolve_load_mode(self.load_mode)
+                    if self.load_mode != "standard":
+                        kwargs["load_mode"] = self.load_mode
+                    with load_phase("load_function"), self.device_context():
+                        model, pipeline = self.load_function(
+                            self.model_path,
+                            self.quantization,
+                            **kwargs
+                        )
+
+                # Prompts repetidos não passam de novo pelo text encoder
+                if self.embedding_cache is not None and source == "disk":
+                    with load_phase("embedding_cache"):
+                        install_embedding_cache(
+                            pipeline,
+                            self.embedding_cache,
+                            encoder=f"{self.model_name}:{self.model_path}:{self.quantization}"
+                        )
+
+                # Spans de encode_prompt e decode no trace de cada job
+                if source == "disk":
+                    install_tracing(pipeline)
 
             load_time = time.time() - start_time
+            phases = profile.result()
 
             with self._lock:
-                self.loaded = True
-                self.loading = False
+                self.model, self.pipeline = model, pipeline
                 self.last_used = datetime.now()
+                self.loaded = True
+            self.memory_gb = round(max(free_before - free_memory_gb(), 0.0), 2)
 
             memory_info = get_gpu_memory_info()
-            logger.info(f"{self.model_name}: Carregado em {load_time:.2f}s")
+            logger.info(f"{self.model_name}: Carregado de {source} em {load_time:.2f}s ({self.load_mode}): " +
+                        ", ".join(f"{p['phase']} {p['seconds']}s/{p['peak_rss_gb']}GB" for p in phases))
             logger.info(f"Memória depois: {memory_info}")
 
-            # Iniciar timer de auto-unload se configurado
-            if self.auto_unload_minutes:
-                self._start_unload_timer()
-
-            return {
+            self.last_load = {
                 "status": "loaded",
                 "model_name": self.model_name,
                 "load_time_seconds": round(load_time, 2),
+                "load_mode": self.load_mode,
+                "source": source,
+                "phases": phases,
+                "peak_rss_gb": max((p["peak_rss_gb"] for p in phases), default=None),
                 "memory": memory_info,
                 "quantization": self.quantization
             }
+            return self.last_load
 
         except Exception as e:
             logger.error(f"{self.model_name}: Erro ao carregar - {str(e)}")
-            with self._lock:
-                self.loading = False
             raise
 
-    def unload(self) -> Dict[str, Any]:
+    def unload(self, park: bool = True) -> Dict[str, Any]:
         """
-        Descarrega modelo da memória
+        Descarrega modelo da memória. Recusa ("busy") durante uma geração: a
+        checagem de `active` e a marcação como descarregado são atômicas, então
+        uma geração que comece depois recarrega o modelo
+        Args:
+            park: Com estacionamento configurado, manter os pesos na RAM (tier "parked")
         Returns:
             Dict com informações do descarregamento
         """
         with self._lock:
             if not self.loaded:
+                if not park and self.parking is not None and self.parking.has(self):
+                    self.parking.drop(self)
+                    logger.info(f"{self.model_name}: Pesos estacionados descartados")
+                    return {
+                        "status": "dropped",
+                        "model_name": self.model_name
+                    }
                 logger.info(f"{self.model_name}: Modelo não estava carregado")
                 return {
                     "status": "not_loaded",
                     "model_name": self.model_name
                 }
+            if self.active:
+                # Mover os módulos para a CPU quebraria o denoising em andamento
+                logger.info(f"{self.model_name}: Em uso por {self.active} geração(ões), não descarregado")
+                return {
+                    "status": "busy",
+                    "model_name": self.model_name,
+                    "active": self.active
+                }
 
-        logger.info(f"{self.model_name}: Descarregando modelo...")
-        memory_before = get_gpu_memory_info()
-
-        # Cancelar timer de auto-unload
-        if self._unload_timer:
-            self._unload_timer.cancel()
-            self._unload_timer = None
-
-        # Limpar referências
-        with self._lock:
+            # Limpar referências
+            logger.info(f"{self.model_name}: Descarregando modelo...")
+            memory_before = get_gpu_memory_info()
+            model, pipeline = self.model, self.pipeline
             self.model = None
             self.pipeline = None
             self.loaded = False
             self.last_used = None
 
+        parked = False
+        if self.parking is not None and park:
+            parked = self.parking.park(self, model, pipeline)
+        del model, pipeline
+
         # Forçar garbage collection
         import gc
         gc.collect()
@@ -155,7 +305,7 @@ class ModelLoader:
         logger.info(f"{self.model_name}: Descarregado. Memória liberada: {freed_gb:.2f}GB")
 
         return {
-            "status": "unloaded",
+            "status": "parked" if parked else "unloaded",
             "model_name": self.model_name,
             "memory_freed_gb": round(freed_gb, 2),
             "memory_after": memory_after
@@ -165,17 +315,34 @@ class ModelLoader:
         """
         Retorna modelo, carregando se necessário
         """
-        if not self.is_loaded():
-            self.load()
-
-        with self._lock:
+        # Caminho rápido sem lock: referências lidas uma vez (unload() pode zerá-las)
+        model, pipeline = self.model, self.pipeline
+        if self.loaded and pipeline is not None:
             self.last_used = datetime.now()
+            return model, pipeline
 
-        # Reiniciar timer de auto-unload
-        if self.auto_unload_minutes:
-            self._start_unload_timer()
-
-        return self.model, self.pipeline
+        wait_start = time.time()
+        while True:
+            self.load()
+            with self._lock:
+                # unload() entre a carga e aqui: carregar de novo
+                if self.loaded:
+                    self.last_used = datetime.now()
+                    model, pipeline = self.model, self.pipeline
+                    waited = time.time() - wait_start
+                    self.load_waits += 1
+                    self.load_wait_total += waited
+                    self.load_wait_max = max(self.load_wait_max, waited)
+                    return model, pipeline
+
+    def get_load_wait_stats(self) -> Dict[str, Any]:
+        """Chamadas de get_model() que esperaram carga e quanto tempo esperaram"""
+        return {
+            "waits": self.load_waits,
+            "total_seconds": round(self.load_wait_total, 2),
+            "avg_seconds": round(self.load_wait_total / self.load_waits, 2) if self.load_waits else 0,
+            "max_seconds": round(self.load_wait_max, 2)
+        }
 
     def get_info(self) -> Dict[str, Any]:
         """Retorna informações sobre o modelo"""
@@ -183,27 +350,17 @@ class ModelLoader:
             "model_name": self.model_name,
             "loaded": self.loaded,
             "loading": self.loading,
+            "tier": self.tier(),
+            "parking": self.parking.info() if self.parking else None,
             "quantization": self.quantization,
+            "load_mode": self.load_mode,
+            "last_load": self.last_load,
+            "device": self.device,
+            "embedding_cache": self.embedding_cache.get_stats() if self.embedding_cache else None,
             "last_used": self.last_used.isoformat() if self.last_used else None,
             "auto_unload_minutes": self.auto_unload_minutes,
+            "active": self.active,
+            "memory_gb": self.memory_gb,
+            "load_wait": self.get_load_wait_stats(),
             "memory": get_gpu_memory_info() if self.loaded else None
         }
-
-    def _start_unload_timer(self):
-        """Inicia timer para auto-unload"""
-        if self._unload_timer:
-            self._unload_timer.cancel()
-
-        def check_and_unload():
-            if self.loaded and self.last_used:
-                idle_time = datetime.now() - self.last_used
-                if idle_time > timedelta(minutes=self.auto_unload_minutes):
-                    logger.info(f"{self.model_name}: Auto-unload por inatividade")
-                    self.unload()
-
-        self._unload_timer = threading.Timer(
-            self.auto_unload_minutes * 60,
-            check_and_unload
-        )
-        self._unload_timer.daemon = True
-        self._unload_timer.start()
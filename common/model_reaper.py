@@ -0,0 +1,309 @@
+"""
+Descarregamento de modelos ociosos e coordenação de memória entre containers
+
+Um único ModelReaper por processo acompanha todos os ModelLoaders (um por
+worker) numa thread só, em vez de um threading.Timer recriado a cada job:
+- descarrega o modelo ocioso há mais de `auto_unload_minutes`;
+- sob pressão de memória (livre < `min_free_gb`), descarrega o usado há mais
+  tempo (LRU) entre os que não estão gerando.
+
+Opcionalmente, um FileRegistry num diretório compartilhado (ex: o volume
+/models) dá a cada container a visão dos modelos carregados pelos outros. Na
+memória unificada do DGX, um container que precisa carregar pede ao dono do
+modelo usado há mais tempo que o descarregue.
+"""
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import psutil
+import torch
+
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+
+def free_memory_gb() -> float:
+    """Memória livre do device (todos os processos); sem CUDA, RAM disponível"""
+    if torch.cuda.is_available():
+        try:
+            free, _ = torch.cuda.mem_get_info()
+            return free / 1024**3
+        except Exception:
+            pass
+    return psutil.virtual_memory().available / 1024**3
+
+
+class FileRegistry:
+    """
+    Registro de modelos carregados compartilhado entre containers via arquivos:
+    `<serviço>.json` com o estado de cada um e `<serviço>.evict` como pedido de
+    descarregamento. Leituras e escolhas da vítima acontecem sob flock.
+    """
+
+    def __init__(self, directory: str, service: str, stale_seconds: float = 120):
+        """
+        Args:
+            directory: Diretório compartilhado (volume montado em todos os containers)
+            service: Nome deste container no registro (ex: MODEL_NAME)
+            stale_seconds: Entradas sem atualização há mais tempo são ignoradas
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.service = service
+        self.stale_seconds = stale_seconds
+
+    @contextmanager
+    def _locked(self):
+        with open(self.directory / ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def publish(self, loaders: List[Dict[str, Any]]):
+        """Grava o estado dos loaders deste container (escrita atômica)"""
+        path = self.directory / f"{self.service}.json"
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        data = {"service": self.service, "host": socket.gethostname(),
+                "updated": time.time(), "loaders": loaders}
+        try:
+            tmp.write_text(json.dumps(data))
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Falha ao publicar no registro de modelos: {e}")
+
+    def peers(self) -> Dict[str, dict]:
+        """Estado publicado pelos outros containers (entradas recentes)"""
+        now = time.time()
+        result = {}
+        for path in self.directory.glob("*.json"):
+            if path.stem == self.service:
+                continue
+            try:
+                data = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            if now - data.get("updated", 0) <= self.stale_seconds:
+                result[path.stem] = data
+        return result
+
+    def request_eviction(self, need_gb: float) -> Optional[str]:
+        """
+        Pede ao container com o modelo usado há mais tempo (carregado e ocioso)
+        que o descarregue
+        Returns:
+            Serviço escolhido, ou None se não há candidato
+        """
+        with self._locked():
+            candidates = []
+            for service, data in self.peers().items():
+                if (self.directory / f"{service}.evict").exists():
+                    continue
+                for loader in data.get("loaders", []):
+                    if loader.get("loaded") and not loader.get("active"):
+                        candidates.append((loader.get("last_used") or "", service))
+            if not candidates:
+                return None
+            _, victim = min(candidates)
+            (self.directory / f"{victim}.evict").write_text(json.dumps({
+                "requested_by": self.service, "need_gb": round(need_gb, 1),
+                "at": datetime.now().isoformat()
+            }))
+            return victim
+
+    def take_eviction(self) -> bool:
+        """Consome um pedido de descarregamento endereçado a este container"""
+        path = self.directory / f"{self.service}.evict"
+        with self._locked():
+            if not path.exists():
+                return False
+            try:
+                request = json.loads(path.read_text())
+            except (OSError, ValueError):
+                request = {}
+            path.unlink(missing_ok=True)
+        logger.info(f"Registro: {request.get('requested_by', '?')} pediu memória "
+                    f"({request.get('need_gb', '?')}GB)")
+        return True
+
+
+def _unloaded(result: Dict[str, Any]) -> bool:
+    """unload() de fato liberou o modelo (não estava em uso nem já descarregado)"""
+    return result["status"] in ("unloaded", "parked")
+
+
+class ModelReaper:
+    """Thread única que descarrega modelos ociosos ou LRU sob pressão de memória"""
+
+    def __init__(self, interval: float = 10, min_free_gb: float = 0.0,
+                 registry: Optional[FileRegistry] = None, evict_timeout: float = 120):
+        """
+        Args:
+            interval: Segundos entre verificações
+            min_free_gb: Memória livre mínima; abaixo dela o modelo LRU é descarregado (0 = desligado)
+            registry: Registro compartilhado entre containers (None = só este processo)
+            evict_timeout: Segundos máximos esperando outros containers liberarem memória
+        """
+        self.interval = interval
+        self.min_free_gb = min_free_gb
+        self.registry = registry
+        self.evict_timeout = evict_timeout
+
+        self._loaders: List[Any] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.idle_unloads = 0
+        self.pressure_unloads = 0
+        self.remote_unloads = 0
+        self.evictions_requested = 0
+
+    def register(self, loader: Any):
+        """Acompanha um ModelLoader e inicia a thread na primeira chamada"""
+        with self._lock:
+            self._loaders.append(loader)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="model-reaper", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Erro no reaper de modelos: {e}")
+
+    def check(self):
+        """Uma rodada: ociosidade, pedidos de outros containers e pressão de memória"""
+        now = datetime.now()
+        for loader in self._loaded():
+            # `active` aqui é só um filtro: unload() confere de novo sob o lock do loader
+            if (loader.auto_unload_minutes and loader.last_used and not loader.active
+                    and (now - loader.last_used).total_seconds() > loader.auto_unload_minutes * 60):
+                if _unloaded(loader.unload()):
+                    logger.info(f"{loader.model_name}: Auto-unload por inatividade")
+                    self.idle_unloads += 1
+
+        if self.registry and self.registry.take_eviction():
+            if self.evict_lru() or self._evict_parked():
+                self.remote_unloads += 1
+
+        if self.min_free_gb:
+            while free_memory_gb() < self.min_free_gb and (self.evict_lru() or self._evict_parked()):
+                self.pressure_unloads += 1
+
+        if self.registry:
+            self.registry.publish(self._state())
+
+    def _loaded(self) -> List[Any]:
+        with self._lock:
+            return [loader for loader in self._loaders if loader.is_loaded()]
+
+    def evict_lru(self, exclude: Any = None) -> Optional[Any]:
+        """
+        Descarrega o loader usado há mais tempo que não está gerando
+        Returns:
+            Loader descarregado, ou None se não há candidato
+        """
+        candidates = [loader for loader in self._loaded()
+                      if loader is not exclude and not loader.active]
+        for victim in sorted(candidates, key=lambda loader: loader.last_used or datetime.min):
+            # Sob pressão não estacionar: na memória unificada a RAM é a mesma da GPU.
+            # "busy": uma geração começou depois da lista; tentar o próximo
+            if _unloaded(victim.unload(park=False)):
+                logger.info(f"{victim.model_name}: Descarregado por pressão de memória (LRU)")
+                return victim
+        return None
+
+    def _evict_parked(self) -> bool:
+        """Descarta pesos estacionados na RAM (LRU); False se não há nenhum"""
+        with self._lock:
+            parkings = {id(l.parking): l.parking for l in self._loaders if l.parking is not None}
+        return any(parking.evict_lru() for parking in parkings.values())
+
+    def make_room(self, loader: Any):
+        """
+        Antes de uma carga: libera a memória estimada do loader (medida na carga
+        anterior), primeiro neste processo e depois pedindo a outros containers
+        """
+        need = max(loader.memory_gb or 0.0, 0.0) + self.min_free_gb
+        if not need or free_memory_gb() >= need:
+            return
+
+        while free_memory_gb() < need and self.evict_lru(exclude=loader):
+            self.pressure_unloads += 1
+        # Pesos estacionados de outros modelos (os deste loader serão restaurados)
+        while (free_memory_gb() < need and loader.parking is not None
+               and not loader.parking.has(loader) and self._evict_parked()):
+            self.pressure_unloads += 1
+        if not self.registry:
+            return
+
+        deadline = time.time() + self.evict_timeout
+        while free_memory_gb() < need and time.time() < deadline:
+            victim = self.registry.request_eviction(need)
+            if victim is None:
+                break
+            self.evictions_requested += 1
+            logger.info(f"{loader.model_name}: Pedindo a {victim} que libere memória ({need:.1f}GB)")
+            # O reaper do outro container atende na próxima rodada
+            waited = time.time() + self.interval * 2
+            while free_memory_gb() < need and time.time() < min(waited, deadline):
+                time.sleep(1)
+
+    def _state(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            loaders = list(self._loaders)
+        return [
+            {
+                "model": loader.model_name,
+                "device": loader.device,
+                "loaded": loader.is_loaded(),
+                "tier": loader.tier(),
+                "active": loader.active,
+                "last_used": loader.last_used.isoformat() if loader.last_used else None,
+                "memory_gb": loader.memory_gb
+            }
+            for loader in loaders
+        ]
+
+    def info(self) -> Dict[str, Any]:
+        """Configuração, contadores e (com registro) modelos dos outros containers"""
+        return {
+            "interval_seconds": self.interval,
+            "min_free_gb": self.min_free_gb,
+            "free_gb": round(free_memory_gb(), 2),
+            "idle_unloads": self.idle_unloads,
+            "pressure_unloads": self.pressure_unloads,
+            "remote_unloads": self.remote_unloads,
+            "evictions_requested": self.evictions_requested,
+            "registry": None if not self.registry else {
+                "directory": str(self.registry.directory),
+                "service": self.registry.service,
+                "peers": {service: data.get("loaders", [])
+                          for service, data in self.registry.peers().items()}
+            }
+        }
+
+
+_default_reaper: Optional[ModelReaper] = None
+_default_lock = threading.Lock()
+
+
+def default_reaper() -> ModelReaper:
+    """Reaper do processo para loaders criados sem um reaper explícito"""
+    global _default_reaper
+    with _default_lock:
+        if _default_reaper is None:
+            _default_reaper = ModelReaper()
+        return _default_reaper
@@ -0,0 +1,266 @@
+"""
+Tracing por job: árvore de spans com tempo monotônico e pico de memória
+
+Um Trace é criado por lote, passado às funções generate_video_* e guardado
+em cada Job (GET /jobs/{id}/trace). Fontes de spans:
+- `trace.span(nome)` nas funções de geração (ex: "pipeline");
+- ganchos instalados no pipeline após a carga (`install_tracing`):
+  `encode_prompt` e `vae.decode` viram spans "encode_prompt" e "decode";
+- `trace.step_callback()` (callback_on_step_end do diffusers): cada step do
+  denoising entra no span "denoise" com sua latência;
+- `encode_video()` (video_writer) abre "encode", inclusive no EncodePool;
+  `stream_video()` abre "decode_and_encode" (decode da VAE em blocos) e a
+  espera final do ffmpeg no EncodePool vira "encode".
+
+O trace também carrega o cancelamento cooperativo do lote: após `cancel()`,
+o próximo step levanta GenerationCancelled de dentro do callback e o
+pipeline para sem terminar o denoising nem decodificar.
+
+Pico de memória: na thread que ativou o trace (o worker), pico de memória
+CUDA alocada no span (torch.cuda.max_memory_allocated, zerado ao abrir cada
+span e propagado ao span pai). Workers que dividem a mesma GPU se misturam
+nesse pico. Spans de outras threads (codificação) registram o RSS do processo.
+"""
+import inspect
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, List, Optional
+
+import psutil
+import torch
+
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+_active = threading.local()
+
+
+class GenerationCancelled(Exception):
+    """Geração interrompida por cancelamento (levantada no callback de step)"""
+
+
+def _gpu_peak_gb() -> float:
+    return torch.cuda.max_memory_allocated() / 1024**3
+
+
+class Trace:
+    """Spans de um job (ou lote); seguro para spans vindos de várias threads"""
+
+    def __init__(self, **attrs):
+        """
+        Args:
+            **attrs: Atributos do trace (ex: batch_size)
+        """
+        self.attrs = attrs
+        self.origin = time.monotonic()
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._stacks: Dict[int, List[Dict[str, Any]]] = {}   # thread -> spans abertos
+        self._owner: Optional[int] = None                     # thread que mede memória CUDA
+        self._denoise: Optional[Dict[str, Any]] = None
+        self._step_listeners: List[Callable[[int, Optional[int], float], None]] = []
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Pede a interrupção da geração no próximo step (qualquer thread)"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def raise_if_cancelled(self):
+        if self._cancelled.is_set():
+            raise GenerationCancelled("Cancelado pelo usuário")
+
+    def on_step(self, listener: Callable[[int, Optional[int], float], None]):
+        """
+        Chama listener(steps concluídos, total, segundos por step) a cada step,
+        na thread do pipeline
+        """
+        self._step_listeners.append(listener)
+
+    @contextmanager
+    def activate(self):
+        """
+        Torna este trace o ativo na thread atual: ganchos do pipeline e
+        encode_video() registram nele. A thread passa a medir memória CUDA.
+        """
+        previous = getattr(_active, "trace", None)
+        _active.trace = self
+        self._owner = threading.get_ident()
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        try:
+            yield self
+        finally:
+            _active.trace = previous
+
+    def _stack(self) -> List[Dict[str, Any]]:
+        return self._stacks.setdefault(threading.get_ident(), [])
+
+    def _measures_gpu(self) -> bool:
+        return threading.get_ident() == self._owner and torch.cuda.is_available()
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Mede o bloco como filho do span aberto nesta thread"""
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        gpu = self._measures_gpu()
+        entry = {"name": name, "start": time.monotonic(), "end": None, "attrs": attrs, "children": []}
+
+        if gpu:
+            # O pico até aqui pertence ao pai; zerar para medir só este span
+            if parent is not None:
+                parent["peak_gpu_gb"] = max(parent.get("peak_gpu_gb", 0.0), _gpu_peak_gb())
+            torch.cuda.reset_peak_memory_stats()
+
+        with self._lock:
+            (parent["children"] if parent else self.spans).append(entry)
+            self._denoise = None
+        stack.append(entry)
+        try:
+            yield entry
+        finally:
+            stack.pop()
+            entry["end"] = time.monotonic()
+            if gpu:
+                entry["peak_gpu_gb"] = max(entry.get("peak_gpu_gb", 0.0), _gpu_peak_gb())
+                if parent is not None:
+                    parent["peak_gpu_gb"] = max(parent.get("peak_gpu_gb", 0.0), entry["peak_gpu_gb"])
+            else:
+                entry["rss_gb"] = psutil.Process().memory_info().rss / 1024**3
+            with self._lock:
+                self._denoise = None
+
+    def step(self, step: int, total: Optional[int] = None):
+        """
+        Fim de um step do denoising. O span "denoise" começa no fim do irmão
+        anterior (ex: encode_prompt) e termina no último step.
+        """
+        now = time.monotonic()
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        with self._lock:
+            denoise = self._denoise
+            if denoise is None:
+                siblings = parent["children"] if parent else self.spans
+                if siblings and siblings[-1]["end"] is not None:
+                    start = siblings[-1]["end"]
+                else:
+                    start = parent["start"] if parent else now
+                denoise = self._denoise = {"name": "denoise", "start": start, "end": start,
+                                           "attrs": {}, "children": [], "steps": []}
+                siblings.append(denoise)
+            denoise["steps"].append(now - denoise["end"])
+            denoise["end"] = now
+            if total:
+                denoise["attrs"]["total_steps"] = total
+            # O primeiro step inclui o preparo dos latents: fora da média quando há outros
+            recent = denoise["steps"][1:][-10:] or denoise["steps"]
+            step_seconds = sum(recent) / len(recent)
+
+        for listener in self._step_listeners:
+            try:
+                listener(step + 1, total, step_seconds)
+            except Exception as e:
+                logger.warning(f"Erro no listener de step: {e}")
+        self.raise_if_cancelled()
+
+    def step_callback(self) -> Callable:
+        """callback_on_step_end do diffusers que registra cada step (e interrompe se cancelado)"""
+        def callback(pipe, step, timestep, callback_kwargs):
+            self.step(step, getattr(pipe, "num_timesteps", None))
+            return callback_kwargs
+        return callback
+
+    def callback_kwargs(self, pipeline: Any) -> Dict[str, Any]:
+        """{"callback_on_step_end": ...} se o pipeline aceita o parâmetro, senão {}"""
+        try:
+            accepted = "callback_on_step_end" in inspect.signature(pipeline.__call__).parameters
+        except (TypeError, ValueError):
+            accepted = False
+        return {"callback_on_step_end": self.step_callback()} if accepted else {}
+
+    def seconds(self, name: str) -> float:
+        """Soma da duração dos spans concluídos com esse nome (em toda a árvore)"""
+        def total(spans):
+            return sum((s["end"] - s["start"] if s["name"] == name and s["end"] is not None else 0.0)
+                       + total(s["children"]) for s in spans)
+        with self._lock:
+            return total(self.spans)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Árvore em milissegundos relativos ao início do trace (spans abertos até agora)"""
+        now = time.monotonic()
+
+        def convert(span):
+            end = span["end"] if span["end"] is not None else now
+            result = {
+                "name": span["name"],
+                "start_ms": round((span["start"] - self.origin) * 1000, 1),
+                "duration_ms": round((end - span["start"]) * 1000, 1),
+                **span["attrs"]
+            }
+            if span["end"] is None:
+                result["running"] = True
+            if "peak_gpu_gb" in span:
+                result["peak_gpu_gb"] = round(span["peak_gpu_gb"], 2)
+            if "rss_gb" in span:
+                result["rss_gb"] = round(span["rss_gb"], 2)
+            steps = span.get("steps")
+            if steps:
+                result["steps"] = len(steps)
+                result["step_ms"] = [round(s * 1000, 1) for s in steps]
+                result["step_mean_ms"] = round(sum(steps) / len(steps) * 1000, 1)
+            if span["children"]:
+                result["children"] = [convert(child) for child in span["children"]]
+            return result
+
+        with self._lock:
+            return {
+                **self.attrs,
+                "elapsed_ms": round((now - self.origin) * 1000, 1),
+                "spans": [convert(span) for span in self.spans]
+            }
+
+
+def current_trace() -> Optional[Trace]:
+    """Trace ativo na thread atual (ver Trace.activate)"""
+    return getattr(_active, "trace", None)
+
+
+def span(name: str, **attrs):
+    """Span no trace ativo (sem trace ativo, não faz nada)"""
+    trace = current_trace()
+    return trace.span(name, **attrs) if trace else nullcontext()
+
+
+def _traced(method: Callable, name: str) -> Callable:
+    def wrapper(*args, **kwargs):
+        with span(name):
+            return method(*args, **kwargs)
+    wrapper._traced = name
+    return wrapper
+
+
+def install_tracing(pipeline: Any) -> List[str]:
+    """
+    Envolve `encode_prompt` e `vae.decode` do pipeline com spans do trace ativo
+    Returns:
+        Spans instalados (vazio se o pipeline não expõe os métodos)
+    """
+    installed = []
+    for owner, method, name in ((pipeline, "encode_prompt", "encode_prompt"),
+                                (getattr(pipeline, "vae", None), "decode", "decode")):
+        original = getattr(owner, method, None) if owner is not None else None
+        if original is None or getattr(original, "_traced", None):
+            continue
+        setattr(owner, method, _traced(original, name))
+        installed.append(name)
+    if installed:
+        logger.info(f"Tracing instalado em {type(pipeline).__name__}: {', '.join(installed)}")
+    return installed
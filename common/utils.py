@@ -1,11 +1,15 @@
 """
 Utilidades compartilhadas entre os containers
 """
+import bisect
 import logging
+import threading
+import time
 import psutil
 import torch
+from collections import deque
 from datetime import datetime
-from typing import Dict, Any
+from typing import Callable, Dict, Any, Deque, List, Optional, Tuple
 import json
 
 # Configuração de logging
@@ -49,59 +53,250 @@ def get_cpu_memory_info() -> Dict[str, float]:
     }
 
 def get_system_info() -> Dict[str, Any]:
-    """Retorna informações completas do sistema"""
+    """
+    Retorna informações completas do sistema. Sem bloquear: cpu_percent é o
+    uso desde a chamada anterior (ver SystemSampler para leituras periódicas)
+    """
     return {
         "timestamp": datetime.now().isoformat(),
         "cpu_memory": get_cpu_memory_info(),
         "gpu_memory": get_gpu_memory_info(),
         "cpu_count": psutil.cpu_count(),
-        "cpu_percent": psutil.cpu_percent(interval=1),
+        "cpu_percent": psutil.cpu_percent(interval=None),
         "cuda_available": torch.cuda.is_available(),
         "cuda_device_count": torch.cuda.device_count() if torch.cuda.is_available() else 0,
         "cuda_device_name": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None
     }
 
+class SystemSampler:
+    """
+    Atualiza CPU, RAM e GPU em thread própria a cada `interval` segundos; o
+    /info lê o último snapshot em vez de medir (e esperar) a cada requisição
+    """
+
+    def __init__(self, interval: float = 5.0, history: int = 120,
+                 extras: Optional[Dict[str, Callable[[], Any]]] = None):
+        """
+        Args:
+            interval: Segundos entre amostras (também a janela do cpu_percent)
+            history: Amostras mantidas para /info/history
+            extras: Outras leituras lentas guardadas no snapshot (nome -> função)
+        """
+        self.interval = interval
+        self.extras = extras or {}
+        self._history: Deque[Dict[str, Any]] = deque(maxlen=history)
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Inicia a thread de amostragem (chamadas repetidas não criam outra)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="system-sampler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        psutil.cpu_percent(interval=None)   # primeira leitura só define a referência
+        delay = min(self.interval, 1.0)     # primeira amostra logo após o startup
+        while True:
+            time.sleep(delay)
+            delay = self.interval
+            try:
+                self.sample()
+            except Exception as e:
+                get_logger(__name__).warning(f"Falha ao amostrar o sistema: {e}")
+
+    def sample(self) -> Dict[str, Any]:
+        """Mede agora, atualiza o snapshot e acrescenta um ponto ao histórico"""
+        info = get_system_info()
+        for name, collect in self.extras.items():
+            try:
+                info[name] = collect()
+            except Exception as e:
+                info[name] = {"error": str(e)}
+        cpu, gpu = info["cpu_memory"], info["gpu_memory"]
+        point = {
+            "timestamp": info["timestamp"],
+            "cpu_percent": info["cpu_percent"],
+            "ram_used_gb": cpu["used_gb"],
+            "ram_percent": cpu["percent"],
+            "gpu_allocated_gb": gpu.get("allocated_gb"),
+            "gpu_reserved_gb": gpu.get("reserved_gb")
+        }
+        with self._lock:
+            self._snapshot = info
+            self._history.append(point)
+        return info
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Cópia do último snapshot (antes da primeira amostra, mede na hora)"""
+        with self._lock:
+            snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.sample()
+        return {**snapshot, "sample_interval_seconds": self.interval}
+
+    def history(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Série temporal das últimas amostras (mais antiga primeiro)"""
+        with self._lock:
+            points = list(self._history)
+        return points[-limit:] if limit else points
+
+# Limites (segundos) dos buckets dos histogramas de latência
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+# Etapas de um job com histograma próprio
+STAGES = ("queue_wait", "load", "generate", "denoise", "decode", "encode", "total")
+
+
+class Histogram:
+    """Histograma de buckets fixos: observe() e quantile() não dependem do histórico"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # último = +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimativa por interpolação linear dentro do bucket (como histogram_quantile)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def summary(self) -> Dict[str, Any]:
+        def rounded(value):
+            return round(value, 2) if value is not None else None
+        return {
+            "count": self.count,
+            "avg": round(self.sum / self.count, 2) if self.count else None,
+            "p50": rounded(self.quantile(0.5)),
+            "p90": rounded(self.quantile(0.9)),
+            "p99": rounded(self.quantile(0.99))
+        }
+
+
+def _labels(**labels) -> str:
+    """Labels Prometheus com valores escapados"""
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{key}="{escape(value)}"' for key, value in labels.items())
+
+
 class MetricsCollector:
-    """Coleta métricas de inferência"""
+    """
+    Coleta métricas de inferência: janela das últimas inferências (ring buffer)
+    e histogramas por etapa, modelo e resolução acumulados desde o início
+    """
+
+    def __init__(self, window: int = 100):
+        """
+        Args:
+            window: Inferências recentes mantidas para avg/min/max e last_10
+        """
+        self.metrics: Deque[Dict[str, Any]] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        # (etapa, modelo, resolução) -> Histogram
+        self._histograms: Dict[Tuple[str, str, str], Histogram] = {}
+        # (modelo, resolução, status) -> inferências
+        self._counters: Dict[Tuple[str, str, str], int] = {}
 
-    def __init__(self):
-        self.metrics = []
+    def observe(self, stage: str, seconds: float, model: str = "", resolution: str = ""):
+        """Registra a duração de uma etapa (queue_wait, load, generate, encode...)"""
+        key = (stage, model, resolution)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
 
     def record_inference(self, duration: float, prompt_length: int,
-                        success: bool, error: str = None):
+                        success: bool, error: str = None,
+                        model: str = "", resolution: str = ""):
         """Registra métrica de inferência"""
         metric = {
             "timestamp": datetime.now().isoformat(),
             "duration_seconds": round(duration, 2),
             "prompt_length": prompt_length,
+            "model": model,
+            "resolution": resolution,
             "success": success,
-            "error": error,
-            "gpu_memory": get_gpu_memory_info()
+            "error": error
         }
-        self.metrics.append(metric)
-
-        # Manter apenas últimas 100 métricas
-        if len(self.metrics) > 100:
-            self.metrics = self.metrics[-100:]
+        key = (model, resolution, "success" if success else "error")
+        with self._lock:
+            self.metrics.append(metric)
+            self._counters[key] = self._counters.get(key, 0) + 1
+        if success:
+            self.observe("total", duration, model, resolution)
 
     def get_stats(self) -> Dict[str, Any]:
-        """Retorna estatísticas agregadas"""
-        if not self.metrics:
-            return {"total_inferences": 0}
+        """Retorna estatísticas agregadas (janela recente + percentis por etapa)"""
+        with self._lock:
+            metrics = list(self.metrics)
+            histograms = [
+                {"stage": stage, "model": model, "resolution": resolution, **histogram.summary()}
+                for (stage, model, resolution), histogram in sorted(self._histograms.items())
+            ]
+        if not metrics:
+            return {"total_inferences": 0, "stages": histograms}
 
-        successful = [m for m in self.metrics if m["success"]]
+        successful = [m for m in metrics if m["success"]]
         durations = [m["duration_seconds"] for m in successful]
 
         return {
-            "total_inferences": len(self.metrics),
+            "total_inferences": len(metrics),
             "successful": len(successful),
-            "failed": len(self.metrics) - len(successful),
+            "failed": len(metrics) - len(successful),
             "avg_duration_seconds": round(sum(durations) / len(durations), 2) if durations else 0,
             "min_duration_seconds": round(min(durations), 2) if durations else 0,
             "max_duration_seconds": round(max(durations), 2) if durations else 0,
-            "last_10": self.metrics[-10:]
+            "stages": histograms,
+            "last_10": metrics[-10:]
         }
 
+    def prometheus(self, prefix: str = "video") -> str:
+        """Contadores e histogramas no formato texto do Prometheus"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = [(key, list(h.counts), h.count, h.sum)
+                          for key, h in sorted(self._histograms.items())]
+
+        lines = [
+            f"# HELP {prefix}_inferences_total Inferências concluídas",
+            f"# TYPE {prefix}_inferences_total counter"
+        ]
+        for (model, resolution, status), count in counters:
+            lines.append(f"{prefix}_inferences_total{{{_labels(model=model, resolution=resolution, status=status)}}} {count}")
+
+        name = f"{prefix}_stage_seconds"
+        lines += [f"# HELP {name} Duração por etapa do job", f"# TYPE {name} histogram"]
+        for (stage, model, resolution), counts, count, total in histograms:
+            labels = _labels(stage=stage, model=model, resolution=resolution)
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {total:.3f}")
+            lines.append(f"{name}_count{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
 def validate_video_params(duration: int, fps: int, resolution: str) -> bool:
     """Valida parâmetros de vídeo"""
     try:
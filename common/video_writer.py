@@ -0,0 +1,450 @@
+"""
+Escrita de vídeo em streaming via ffmpeg
+
+Substitui `imageio.mimwrite`, que precisa do array (frames, H, W, 3) uint8
+inteiro em memória: os frames são convertidos para uint8 em blocos e
+enviados ao stdin do ffmpeg (rawvideo rgb24) à medida que ficam prontos.
+Geradores de blocos são codificados enquanto ainda estão gerando:
+- MAGI-1 (autoregressivo) gera bloco a bloco;
+- LTX-2 e Wan 2.1 pedem latentes ao pipeline (output_type="latent") e
+  `decode_latent_chunks()` decodifica a VAE em blocos temporais; o vídeo
+  decodificado inteiro nunca existe em memória, o pico é um bloco;
+- Waver (pipeline genérico, VAE desconhecida) usa output_type="pt": o vídeo
+  decodificado inteiro fica no device (na memória unificada, a mesma RAM) e
+  só a conversão para uint8 e a cópia ao host são por bloco.
+Esses geradores são consumidos na thread do worker (`stream_video`), pois
+decodificam na GPU; o EncodePool recebe só saídas já decodificadas.
+
+O arquivo é escrito num temporário e renomeado ao final: um vídeo
+interrompido nunca aparece como concluído.
+
+Perfis de codificação (PROFILES): "preview" (rápido, bitrate baixo),
+"archive" (CRF baixo, preset lento) e "web" (faststart + MP4 fragmentado).
+Com NVENC funcional (listado pelo ffmpeg e aprovado num encode de teste),
+preview e web usam o encoder da GPU; senão, libx264.
+
+EncodePool: a codificação (processos ffmpeg alimentados por threads) roda
+fora do worker; dentro de `deferred_encoding()`, `encode_video()` só agenda
+e o worker já pode começar o denoising do próximo job.
+"""
+import functools
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from utils import get_logger
+from tracing import Trace, current_trace, span
+
+logger = get_logger(__name__)
+
+CHUNK_FRAMES = 16
+CHUNK_LATENTS = 4       # latentes por bloco em decode_latent_chunks
+LATENT_CONTEXT = 2      # latentes vizinhos decodificados de cada lado (contra costuras)
+DEFAULT_PROFILE = "web"
+
+# Keyframe a cada 2s (independe do fps): seek e fragmentos regulares
+_KEYFRAMES = ["-force_key_frames", "expr:gte(t,n_forced*2)"]
+
+# Perfil -> argumentos de saída por encoder (o primeiro disponível é usado)
+PROFILES: Dict[str, Dict[str, List[str]]] = {
+    "preview": {
+        "h264_nvenc": ["-c:v", "h264_nvenc", "-preset", "p1", "-b:v", "2M", "-maxrate", "2M",
+                       "-bufsize", "4M", "-movflags", "+faststart"],
+        "libx264": ["-c:v", "libx264", "-preset", "veryfast", "-b:v", "2M", "-maxrate", "2M",
+                    "-bufsize", "4M", "-movflags", "+faststart"],
+    },
+    "archive": {
+        # Qualidade acima de velocidade: sempre x264
+        "libx264": ["-c:v", "libx264", "-preset", "slow", "-crf", "16", "-movflags", "+faststart"],
+    },
+    "web": {
+        "h264_nvenc": ["-c:v", "h264_nvenc", "-preset", "p4", "-rc", "vbr", "-cq", "23", "-b:v", "0",
+                       *_KEYFRAMES, "-movflags", "+faststart+frag_keyframe+empty_moov+default_base_moof"],
+        "libx264": ["-c:v", "libx264", "-preset", "medium", "-crf", "20",
+                    *_KEYFRAMES, "-movflags", "+faststart+frag_keyframe+empty_moov+default_base_moof"],
+    },
+}
+
+
+def ffmpeg_binary() -> str:
+    """ffmpeg do sistema; sem ele, o binário empacotado pelo imageio-ffmpeg"""
+    path = shutil.which("ffmpeg")
+    if path:
+        return path
+    import imageio_ffmpeg
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def _nvenc_works() -> bool:
+    """
+    Encode de teste de 1 frame: o ffmpeg do apt sempre lista h264_nvenc, mas
+    sem libnvidia-encode no container (NVIDIA_DRIVER_CAPABILITIES sem "video")
+    todo encode falharia
+    """
+    command = [ffmpeg_binary(), "-hide_banner", "-loglevel", "error",
+               "-f", "lavfi", "-i", "nullsrc=s=256x256:d=1", "-frames:v", "1",
+               "-c:v", "h264_nvenc", "-f", "null", "-"]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=30)
+    except Exception as e:
+        logger.warning(f"Teste do NVENC falhou, usando libx264: {e}")
+        return False
+    if result.returncode != 0:
+        logger.warning(f"NVENC indisponível, usando libx264: {result.stderr.strip()[-200:]}")
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def available_encoders() -> frozenset:
+    """Encoders H.264 utilizáveis no ffmpeg instalado (consultado e testado uma vez)"""
+    try:
+        output = subprocess.run([ffmpeg_binary(), "-hide_banner", "-encoders"],
+                                capture_output=True, text=True, timeout=10).stdout
+    except Exception as e:
+        logger.warning(f"Não foi possível listar encoders do ffmpeg: {e}")
+        return frozenset({"libx264"})
+    encoders = {name for name in ("h264_nvenc", "libx264") if f" {name} " in output}
+    if "h264_nvenc" in encoders and not _nvenc_works():
+        encoders.discard("h264_nvenc")
+    return frozenset(encoders)
+
+
+def profile_args(profile: Optional[str] = None) -> List[str]:
+    """Argumentos de saída do ffmpeg para o perfil, preferindo NVENC quando disponível"""
+    encoders = PROFILES[profile or DEFAULT_PROFILE]
+    available = available_encoders()
+    for encoder, args in encoders.items():
+        if encoder in available:
+            return args
+    return encoders["libx264"]
+
+
+class FfmpegWriter:
+    """Codifica frames RGB uint8 recebidos em blocos (o tamanho vem do primeiro bloco)"""
+
+    def __init__(self, output_path: Path, fps: int, profile: Optional[str] = None):
+        """
+        Args:
+            output_path: Arquivo MP4 de saída
+            fps: Frames por segundo
+            profile: Perfil de codificação (PROFILES); None = DEFAULT_PROFILE
+        """
+        self.output_path = Path(output_path)
+        self.fps = fps
+        self.output_args = profile_args(profile)
+        self.frames = 0
+        self._process: Optional[subprocess.Popen] = None
+        self._tmp_path = self.output_path.with_name(f".{self.output_path.stem}.part.mp4")
+        self._stderr = None
+
+    def _start(self, width: int, height: int):
+        self._stderr = tempfile.TemporaryFile()
+        command = [
+            ffmpeg_binary(), "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}",
+            "-r", str(self.fps), "-i", "-",
+            # yuv420p exige largura e altura pares
+            "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+            *self.output_args, "-pix_fmt", "yuv420p",
+            "-f", "mp4", str(self._tmp_path)
+        ]
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self._stderr)
+
+    def write(self, chunk: np.ndarray):
+        """Envia um bloco (N, H, W, 3) uint8 ao encoder"""
+        if self._process is None:
+            self._start(chunk.shape[2], chunk.shape[1])
+        try:
+            self._process.stdin.write(np.ascontiguousarray(chunk).tobytes())
+        except BrokenPipeError:
+            raise RuntimeError(f"ffmpeg encerrou durante a escrita: {self._error()}")
+        self.frames += len(chunk)
+
+    def close(self):
+        """Finaliza o arquivo; erro se o ffmpeg falhou ou nenhum frame foi escrito"""
+        if self._process is None:
+            raise ValueError("Nenhum frame para salvar")
+        self._process.stdin.close()
+        code = self._process.wait()
+        if code != 0:
+            self._tmp_path.unlink(missing_ok=True)
+            raise RuntimeError(f"ffmpeg falhou (código {code}): {self._error()}")
+        os.replace(self._tmp_path, self.output_path)
+
+    def abort(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+        self._tmp_path.unlink(missing_ok=True)
+
+    def _error(self) -> str:
+        self._stderr.seek(0)
+        return self._stderr.read().decode(errors="replace").strip()[-500:]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.close()
+            else:
+                self.abort()
+        finally:
+            if self._stderr is not None:
+                self._stderr.close()
+
+
+def _to_uint8(chunk: Any) -> np.ndarray:
+    """Bloco de frames (tensor em [-1, 1], array float em [0, 1], uint8 ou PIL) -> (N, H, W, 3) uint8"""
+    if isinstance(chunk, torch.Tensor):
+        chunk = chunk.detach()
+        if chunk.ndim == 4 and chunk.shape[1] in (1, 3) and chunk.shape[-1] not in (1, 3):
+            chunk = chunk.permute(0, 2, 3, 1)       # (N, C, H, W) -> (N, H, W, C)
+        # Converter no device e trazer só o bloco uint8 para o host
+        chunk = ((chunk.float() + 1.0) * 127.5).clamp(0, 255).to(torch.uint8).cpu().numpy()
+    elif isinstance(chunk, (list, tuple)):
+        chunk = np.stack([np.asarray(frame) for frame in chunk])
+
+    chunk = np.asarray(chunk)
+    if chunk.dtype != np.uint8:
+        chunk = (np.clip(chunk, 0.0, 1.0) * 255).round().astype(np.uint8)
+    if chunk.ndim == 3:
+        chunk = chunk[..., None]
+    if chunk.shape[-1] == 1:
+        chunk = np.repeat(chunk, 3, axis=-1)
+    elif chunk.shape[-1] == 4:
+        chunk = chunk[..., :3]
+    return chunk
+
+
+def iter_chunks(frames: Any, chunk_frames: int = CHUNK_FRAMES) -> Iterator[np.ndarray]:
+    """
+    Divide a saída do pipeline em blocos uint8
+    Args:
+        frames: Tensor/array com todos os frames (lote de 1 vídeo aceito),
+                lista de frames PIL/arrays, ou iterável de blocos já prontos
+    """
+    if isinstance(frames, (torch.Tensor, np.ndarray)):
+        if frames.ndim == 5:
+            frames = frames[0]                      # (1, F, ...) -> (F, ...)
+        for start in range(0, len(frames), chunk_frames):
+            yield _to_uint8(frames[start:start + chunk_frames])
+    elif isinstance(frames, list):
+        if frames and isinstance(frames[0], list):
+            frames = frames[0]                      # lista de vídeos PIL (lote de 1)
+        for start in range(0, len(frames), chunk_frames):
+            yield _to_uint8(frames[start:start + chunk_frames])
+    else:
+        for chunk in frames:
+            yield _to_uint8(chunk)
+
+
+def write_video(frames: Any, output_path: Path, fps: int, profile: Optional[str] = None,
+                chunk_frames: int = CHUNK_FRAMES) -> int:
+    """
+    Salva frames como MP4 em streaming
+    Args:
+        frames: Ver iter_chunks
+        output_path: Arquivo de saída
+        fps: Frames por segundo
+        profile: Perfil de codificação (PROFILES); None = DEFAULT_PROFILE
+    Returns:
+        Número de frames escritos
+    """
+    with FfmpegWriter(output_path, fps, profile) as writer:
+        for chunk in iter_chunks(frames, chunk_frames):
+            writer.write(chunk)
+    return writer.frames
+
+
+def decode_latent_chunks(decode: Callable[[torch.Tensor], torch.Tensor], latents: torch.Tensor,
+                         temporal_ratio: int, chunk_latents: int = CHUNK_LATENTS,
+                         context: int = LATENT_CONTEXT) -> Iterator[torch.Tensor]:
+    """
+    Decodifica latentes de vídeo (1, C, F, H, W) em blocos temporais. Cada bloco
+    é decodificado com `context` latentes vizinhos de cada lado, descartados na
+    saída: evita costuras, mas o resultado aproxima (não reproduz bit a bit) o
+    decode do vídeo inteiro.
+    Args:
+        decode: Latentes (1, C, f, H, W) -> vídeo (1, C, frames, H, W) em [-1, 1]
+        temporal_ratio: Frames por latente (o primeiro latente vira 1 frame)
+    Yields:
+        Blocos (frames, C, H, W) em [-1, 1], no device da VAE
+    """
+    context = max(context, 1)
+    total = latents.shape[2]
+    for start in range(0, total, chunk_latents):
+        end = min(start + chunk_latents, total)
+        first = max(start - context, 0)
+        # O latente k > 0 cobre os frames 1+(k-1)*r .. k*r; decodificando a partir
+        # de `first`, o frame global g está no índice g - first*r
+        frame_start = 0 if start == 0 else 1 + (start - 1) * temporal_ratio
+        frame_end = 1 + (end - 1) * temporal_ratio
+        offset = first * temporal_ratio
+        with torch.no_grad():
+            video = decode(latents[:, :, first:min(end + context, total)])
+        yield video[0, :, frame_start - offset:frame_end - offset].permute(1, 0, 2, 3)
+        del video
+
+
+def pixel_chunks(video: torch.Tensor, chunk_frames: int = CHUNK_FRAMES) -> Iterator[torch.Tensor]:
+    """Saída output_type="pt" do diffusers ((1, F, C, H, W) em [0, 1]) -> blocos em [-1, 1]"""
+    if video.ndim == 5:
+        video = video[0]
+    for start in range(0, len(video), chunk_frames):
+        yield video[start:start + chunk_frames] * 2 - 1
+
+
+def stream_video(chunks: Iterator[Any], output_path: Path, fps: int,
+                 profile: Optional[str] = None) -> Optional[Future]:
+    """
+    Codifica blocos produzidos sob demanda (ex: decode_latent_chunks) na thread
+    atual: a GPU decodifica o próximo bloco enquanto o processo ffmpeg codifica
+    o anterior. Dentro de deferred_encoding(), só a espera final do ffmpeg vai
+    para o EncodePool
+    Returns:
+        Future da finalização agendada (resultado: frames, segundos), ou None se já foi escrito
+    """
+    writer = FfmpegWriter(output_path, fps, profile)
+    try:
+        with span("decode_and_encode", output=Path(output_path).name):
+            for chunk in iter_chunks(chunks):
+                writer.write(chunk)
+    except BaseException as e:
+        writer.__exit__(type(e), e, e.__traceback__)
+        raise
+
+    state = getattr(_deferred, "state", None)
+    if state is None:
+        writer.__exit__(None, None, None)
+        return None
+    pool, scheduled = state
+    future = pool.finish(writer, trace=current_trace())
+    scheduled.append((Path(output_path), future))
+    return future
+
+
+class EncodePool:
+    """
+    Codificação fora do worker de inferência. Cada tarefa alimenta um processo
+    ffmpeg; `max_pending` limita os vídeos decodificados aguardando codificação
+    (submit bloqueia quando a fila enche).
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 4):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="encode")
+        # Listar e testar os encoders (até um encode NVENC) aqui, não no primeiro /info
+        self._executor.submit(available_encoders)
+        self._slots = threading.Semaphore(max_pending)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, frames: Any, output_path: Path, fps: int, profile: Optional[str] = None,
+               trace: Optional[Trace] = None) -> Future:
+        self._slots.acquire()
+        with self._lock:
+            self.pending += 1
+        future = self._executor.submit(self._encode, frames, output_path, fps, profile, trace)
+        future.add_done_callback(self._done)
+        return future
+
+    @staticmethod
+    def _encode(frames: Any, output_path: Path, fps: int, profile: Optional[str],
+                trace: Optional[Trace]) -> Tuple[int, float]:
+        """write_video medido: (frames escritos, segundos codificando)"""
+        start = time.monotonic()
+        with trace.span("encode", output=output_path.name) if trace else nullcontext():
+            written = write_video(frames, output_path, fps, profile)
+        return written, time.monotonic() - start
+
+    def finish(self, writer: FfmpegWriter, trace: Optional[Trace] = None) -> Future:
+        """Aguarda, fora do worker, o ffmpeg de um vídeo cujos frames já foram enviados"""
+        self._slots.acquire()
+        with self._lock:
+            self.pending += 1
+        future = self._executor.submit(self._finish, writer, trace)
+        future.add_done_callback(self._done)
+        return future
+
+    @staticmethod
+    def _finish(writer: FfmpegWriter, trace: Optional[Trace]) -> Tuple[int, float]:
+        start = time.monotonic()
+        with trace.span("encode", output=writer.output_path.name) if trace else nullcontext():
+            writer.__exit__(None, None, None)
+        return writer.frames, time.monotonic() - start
+
+    def _done(self, future: Future):
+        self._slots.release()
+        with self._lock:
+            self.pending -= 1
+            if future.exception() is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "encoders": sorted(available_encoders()),
+                "default_profile": DEFAULT_PROFILE,
+                "profiles": sorted(PROFILES)
+            }
+
+
+_deferred = threading.local()
+
+
+@contextmanager
+def deferred_encoding(pool: EncodePool):
+    """
+    Na thread atual, encode_video() agenda no pool em vez de codificar
+    Yields:
+        Lista de (output_path, Future) agendados dentro do bloco
+    """
+    previous = getattr(_deferred, "state", None)
+    scheduled: List[Tuple[Path, Future]] = []
+    _deferred.state = (pool, scheduled)
+    try:
+        yield scheduled
+    finally:
+        _deferred.state = previous
+
+
+def encode_video(frames: Any, output_path: Path, fps: int, profile: Optional[str] = None) -> Optional[Future]:
+    """
+    Ponto de saída das funções generate_video_*: codifica agora ou, dentro de
+    deferred_encoding(), agenda no EncodePool
+    Returns:
+        Future da codificação agendada (resultado: frames, segundos), ou None se já foi escrita
+    """
+    state = getattr(_deferred, "state", None)
+    if state is None:
+        with span("encode", output=Path(output_path).name):
+            write_video(frames, output_path, fps, profile)
+        return None
+    pool, scheduled = state
+    # O span "encode" vai para o trace do job, mesmo rodando na thread do pool
+    future = pool.submit(frames, output_path, fps, profile, trace=current_trace())
+    scheduled.append((Path(output_path), future))
+    return future
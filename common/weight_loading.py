@@ -0,0 +1,165 @@
+"""
+Carregamento de pesos e perfil da carga por fase
+
+Modo "standard": from_pretrained na CPU, .to(device) e
+enable_model_cpu_offload() (comportamento original).
+
+Modo "mmap": os shards safetensors são mapeados em memória (mmap) e cada
+tensor é materializado direto no device final (device_map), sem cópia
+intermediária na RAM do host. Na memória unificada do DGX Spark, o
+offload para CPU só copiaria os pesos de novo e é omitido. Exige um
+diffusers com device_map de pipeline por device (ver mmap_supported); em
+versões antigas, resolve_load_mode() volta ao modo "standard".
+
+LoadProfile mede tempo e RSS (inicial, final e pico) de cada fase da carga;
+as funções de carga marcam as fases com `load_phase(nome)`.
+"""
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List, Optional
+
+import psutil
+
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+LOAD_MODES = ("standard", "mmap")
+
+_active = threading.local()
+
+
+def _rss_gb() -> float:
+    return psutil.Process().memory_info().rss / 1024**3
+
+
+class LoadProfile:
+    """Tempo e RSS por fase de uma carga (amostragem do RSS em thread própria)"""
+
+    def __init__(self, interval: float = 0.05):
+        """
+        Args:
+            interval: Segundos entre amostras de RSS
+        """
+        self.interval = interval
+        self.phases: List[Dict[str, Any]] = []
+        self._current: Optional[Dict[str, Any]] = None
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    @contextmanager
+    def activate(self):
+        """Torna este perfil o destino de `load_phase()` na thread atual"""
+        previous = getattr(_active, "profile", None)
+        _active.profile = self
+        self._sampler = threading.Thread(target=self._sample, name="load-profile", daemon=True)
+        self._sampler.start()
+        try:
+            yield self
+        finally:
+            self._stop.set()
+            self._sampler.join()
+            _active.profile = previous
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            current = self._current
+            if current is not None:
+                current["peak_rss_gb"] = max(current["peak_rss_gb"], _rss_gb())
+
+    @contextmanager
+    def phase(self, name: str):
+        rss = _rss_gb()
+        parent = self._current
+        start = time.time()
+        entry = {"phase": name, "start": start, "rss_start_gb": rss, "peak_rss_gb": rss}
+        self._current = entry
+        try:
+            yield
+        finally:
+            rss = _rss_gb()
+            entry["seconds"] = time.time() - start
+            entry["rss_end_gb"] = rss
+            entry["peak_rss_gb"] = max(entry["peak_rss_gb"], rss)
+            self.phases.append(entry)
+            # Fases aninhadas também contam no pico da fase externa
+            if parent is not None:
+                parent["peak_rss_gb"] = max(parent["peak_rss_gb"], entry["peak_rss_gb"])
+            self._current = parent
+
+    def result(self) -> List[Dict[str, Any]]:
+        """Fases em ordem de início (fases aninhadas logo após a externa)"""
+        return [
+            {
+                "phase": p["phase"],
+                "seconds": round(p["seconds"], 2),
+                "rss_start_gb": round(p["rss_start_gb"], 2),
+                "rss_end_gb": round(p["rss_end_gb"], 2),
+                "peak_rss_gb": round(p["peak_rss_gb"], 2)
+            }
+            for p in sorted(self.phases, key=lambda p: p["start"])
+        ]
+
+
+def load_phase(name: str):
+    """Marca uma fase da carga no perfil ativo (sem perfil ativo, não faz nada)"""
+    profile = getattr(_active, "profile", None)
+    return profile.phase(name) if profile else nullcontext()
+
+
+def mmap_supported() -> bool:
+    """O diffusers instalado aceita device_map="cuda" em pipelines (versões antigas só "balanced")"""
+    for module in ("diffusers.pipelines.pipeline_loading_utils", "diffusers.pipelines.pipeline_utils"):
+        try:
+            supported = getattr(__import__(module, fromlist=["SUPPORTED_DEVICE_MAP"]),
+                                "SUPPORTED_DEVICE_MAP", None)
+        except ImportError:
+            continue
+        if supported is not None:
+            return "cuda" in supported
+    return False
+
+
+def resolve_load_mode(load_mode: str) -> str:
+    """
+    Modo de carga efetivo: "mmap" sem suporte no diffusers vira "standard"
+    (com aviso) em vez de falhar no from_pretrained
+    """
+    if load_mode not in LOAD_MODES:
+        raise ValueError(f"LOAD_MODE inválido: {load_mode} (use {', '.join(LOAD_MODES)})")
+    if load_mode == "mmap" and not mmap_supported():
+        logger.warning("LOAD_MODE=mmap exige diffusers com device_map=\"cuda\" em pipelines; "
+                       "usando \"standard\"")
+        return "standard"
+    return load_mode
+
+
+def from_pretrained(pipeline_class: Any, model_id: str, device: str, load_mode: str = "standard",
+                    **kwargs) -> Any:
+    """
+    Carrega um pipeline diffusers no modo escolhido
+    Args:
+        pipeline_class: Classe com from_pretrained (ex: LTXPipeline, DiffusionPipeline)
+        model_id: Diretório local ou ID do HuggingFace
+        device: Device final (ex: "cuda", "cuda:1", "cpu")
+        load_mode: "standard" (carga na CPU) ou "mmap" (direto no device)
+        **kwargs: Repassados ao from_pretrained (torch_dtype, variant...)
+    Returns:
+        Pipeline; no modo "mmap" já está no device
+    """
+    if load_mode not in LOAD_MODES:
+        raise ValueError(f"LOAD_MODE inválido: {load_mode} (use {', '.join(LOAD_MODES)})")
+
+    kwargs.setdefault("use_safetensors", True)
+    if load_mode == "standard":
+        with load_phase("from_pretrained"):
+            return pipeline_class.from_pretrained(model_id, **kwargs)
+
+    # device_map de pipeline aceita o tipo do device ("cuda"); o índice vem do
+    # device corrente, que o ModelLoader define com device_context()
+    kwargs["low_cpu_mem_usage"] = True
+    if device.startswith("cuda"):
+        kwargs["device_map"] = "cuda"
+    with load_phase("from_pretrained_mmap"):
+        return pipeline_class.from_pretrained(model_id, **kwargs)
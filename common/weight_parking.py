@@ -0,0 +1,160 @@
+"""
+Estacionamento de pesos em memória do host (tier "parked")
+
+Ao descarregar um modelo da GPU, os módulos do pipeline (transformer, VAE,
+text encoder...) vão para a RAM em memória page-locked (pinned) em vez de
+serem descartados. A próxima carga só os copia de volta ao device (DMA
+assíncrono), sem reler dezenas de GB do volume de modelos nem refazer o
+from_pretrained.
+
+Tiers de um modelo: "gpu" (carregado), "parked" (pesos na RAM) e "disk".
+O orçamento de RAM é do processo; ao estourá-lo, o estacionado há mais
+tempo (LRU) é descartado. Na memória unificada do DGX Spark a RAM do host é
+a mesma da GPU: sob pressão o reaper também descarta os estacionados.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+
+def _modules(model: Any, pipeline: Any) -> Dict[str, torch.nn.Module]:
+    """Módulos com pesos: componentes do pipeline diffusers ou o próprio modelo"""
+    components = getattr(pipeline, "components", None) or {}
+    modules = {name: m for name, m in components.items() if isinstance(m, torch.nn.Module)}
+    if not modules and isinstance(model, torch.nn.Module):
+        modules["model"] = model
+    return modules
+
+
+def _tensors(module: torch.nn.Module):
+    return itertools.chain(module.parameters(), module.buffers())
+
+
+class WeightParking:
+    """Pesos estacionados em RAM pinned, com orçamento e descarte LRU"""
+
+    def __init__(self, budget_gb: float, pin: bool = True):
+        """
+        Args:
+            budget_gb: RAM máxima ocupada por pesos estacionados (todos os loaders)
+            pin: Usar memória page-locked (cópia para a GPU mais rápida, requer CUDA)
+        """
+        self.budget_gb = budget_gb
+        self.pin = pin and torch.cuda.is_available()
+        self._lock = threading.Lock()
+        # id(loader) -> {"loader", "model", "pipeline", "devices", "size_gb", "parked_at"}
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        self.parks = 0
+        self.restores = 0
+        self.evictions = 0
+
+    def used_gb(self) -> float:
+        with self._lock:
+            return sum(entry["size_gb"] for entry in self._entries.values())
+
+    def has(self, loader: Any) -> bool:
+        with self._lock:
+            return id(loader) in self._entries
+
+    def park(self, loader: Any, model: Any, pipeline: Any) -> bool:
+        """
+        Move os módulos do pipeline para a RAM (pinned) e guarda as referências
+        Returns:
+            False se não há módulos ou o modelo não cabe no orçamento (descartar)
+        """
+        modules = _modules(model, pipeline)
+        if not modules:
+            return False
+        size_gb = sum(t.numel() * t.element_size() for m in modules.values() for t in _tensors(m)) / 1024**3
+        if size_gb > self.budget_gb:
+            logger.info(f"{loader.model_name}: {size_gb:.1f}GB não cabem no orçamento de "
+                        f"estacionamento ({self.budget_gb}GB), descartando")
+            return False
+
+        # Abrir espaço descartando os estacionados há mais tempo
+        while self.used_gb() + size_gb > self.budget_gb and self.evict_lru():
+            pass
+
+        start = time.time()
+        devices = {}
+        for name, module in modules.items():
+            first = next(_tensors(module), None)
+            devices[name] = str(first.device) if first is not None else "cpu"
+            module.to("cpu")
+            if self.pin:
+                for tensor in _tensors(module):
+                    if not tensor.is_pinned():
+                        tensor.data = tensor.data.pin_memory()
+
+        with self._lock:
+            self._entries[id(loader)] = {
+                "loader": loader, "model": model, "pipeline": pipeline,
+                "devices": devices, "size_gb": size_gb, "parked_at": time.time()
+            }
+            self.parks += 1
+        logger.info(f"{loader.model_name}: {size_gb:.1f}GB estacionados na RAM em {time.time() - start:.1f}s")
+        return True
+
+    def restore(self, loader: Any) -> Optional[Tuple[Any, Any]]:
+        """
+        Devolve os módulos estacionados aos devices de origem
+        Returns:
+            (model, pipeline), ou None se o loader não tem pesos estacionados
+        """
+        with self._lock:
+            entry = self._entries.pop(id(loader), None)
+        if entry is None:
+            return None
+
+        pipeline, model = entry["pipeline"], entry["model"]
+        for name, module in _modules(model, pipeline).items():
+            device = entry["devices"].get(name, "cpu")
+            # Módulos sob cpu offload já ficavam na CPU; continuam lá (agora pinned)
+            if device != "cpu":
+                module.to(device, non_blocking=self.pin)
+        if self.pin:
+            torch.cuda.synchronize()
+
+        with self._lock:
+            self.restores += 1
+        return model, pipeline
+
+    def drop(self, loader: Any):
+        with self._lock:
+            self._entries.pop(id(loader), None)
+
+    def evict_lru(self) -> bool:
+        """Descarta os pesos estacionados há mais tempo; False se não há nenhum"""
+        with self._lock:
+            if not self._entries:
+                return False
+            _, entry = self._entries.popitem(last=False)
+            self.evictions += 1
+        logger.info(f"{entry['loader'].model_name}: Pesos estacionados descartados "
+                    f"({entry['size_gb']:.1f}GB, LRU)")
+        return True
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "budget_gb": self.budget_gb,
+                "used_gb": round(sum(e["size_gb"] for e in self._entries.values()), 2),
+                "pinned": self.pin,
+                "parked": [
+                    {"model": e["loader"].model_name, "device": e["loader"].device,
+                     "size_gb": round(e["size_gb"], 2),
+                     "parked_seconds": round(time.time() - e["parked_at"])}
+                    for e in self._entries.values()
+                ],
+                "parks": self.parks,
+                "restores": self.restores,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,177 @@
+"""
+Modelo de custo aprendido dos jobs concluídos (interface web v4.2+)
+
+Cada job concluído vira uma amostra com modelo, resolução, frames, steps,
+tempo total e pico de memória. Por modelo, é ajustada uma regressão linear
+sobre a carga (megapixels x frames):
+
+    segundos por step = a + b * carga      (jobs com modelo já carregado)
+    pico de memória   = c + d * carga      (jobs que rodaram sozinhos no device)
+
+Jobs "frios" (checkpoints carregados no início) alimentam um custo fixo de
+carga por modelo. Sem amostras suficientes, valem as estimativas estáticas
+(priors) passadas no construtor.
+"""
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+MIN_SAMPLES = 3     # amostras por modelo antes de confiar na regressão
+WINDOW      = 200   # amostras mais recentes mantidas por modelo
+
+
+def _fit_line(points: List[Tuple[float, float]]) -> Optional[Tuple[float, float]]:
+    """Mínimos quadrados y = a + b*x; com x constante, b = 0 e a = média."""
+    if not points:
+        return None
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if var_x < 1e-9:
+        return mean_y, 0.0
+    b = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+    return mean_y - b * mean_x, b
+
+
+class CostModel:
+    """Estimativas de tempo e memória por modelo, refinadas a cada job concluído"""
+
+    def __init__(self, prior_seconds_per_frame: Dict[str, float], prior_memory_gb: Dict[str, float],
+                 reference_workload: float, activation_share: float):
+        """
+        Args:
+            prior_seconds_per_frame: segundos por frame usados sem amostras
+            prior_memory_gb: memória por modelo medida em `reference_workload`
+            reference_workload: largura * altura * frames da medição dos priors
+            activation_share: fração da memória que escala com a carga
+        """
+        self.prior_seconds_per_frame = prior_seconds_per_frame
+        self.prior_memory_gb = prior_memory_gb
+        self.reference_workload = reference_workload
+        self.activation_share = activation_share
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+        self._fits: Dict[str, dict] = {}
+
+    @staticmethod
+    def workload(width: int, height: int, frames: int) -> float:
+        """Carga em megapixels x frames"""
+        return width * height * frames / 1e6
+
+    # ------------------------------------------------------------------
+    # Estimativas
+    # ------------------------------------------------------------------
+
+    def estimate_seconds(self, model: str, width: int, height: int, frames: int, steps: int,
+                         warm: Optional[bool] = None) -> float:
+        """
+        Tempo total estimado do job
+        Args:
+            warm: True se o modelo já está carregado; None = desconhecido
+                  (soma o custo de carga, estimativa conservadora)
+        """
+        with self._lock:
+            fit = self._fits.get(model, {})
+        time_fit = fit.get("seconds_per_step")
+        if not time_fit:
+            return frames * self.prior_seconds_per_frame.get(model, 4)
+
+        a, b = time_fit
+        per_step = max(a + b * self.workload(width, height, frames), 0.1)
+        seconds = per_step * max(steps, 1)
+        if not warm:
+            seconds += fit.get("load_seconds", 0.0)
+        return seconds
+
+    def estimate_memory_gb(self, model: str, width: int, height: int, frames: int) -> float:
+        """Pico de memória estimado do job (pesos + ativações)"""
+        with self._lock:
+            mem_fit = self._fits.get(model, {}).get("peak_gb")
+        load = self.workload(width, height, frames)
+        if mem_fit:
+            c, d = mem_fit
+            return round(max(c + max(d, 0.0) * load, 1.0), 1)
+
+        base = self.prior_memory_gb.get(model, max(self.prior_memory_gb.values()))
+        scale = load * 1e6 / self.reference_workload
+        return round(base * (1 - self.activation_share + self.activation_share * scale), 1)
+
+    # ------------------------------------------------------------------
+    # Aprendizado
+    # ------------------------------------------------------------------
+
+    def observe(self, sample: dict):
+        """
+        Registra um job concluído e reajusta o modelo dele
+        Args:
+            sample: model, width, height, frames, steps, seconds, warm e,
+                    opcionalmente, peak_gb/exclusive (pico medido com o job sozinho)
+        """
+        model = sample["model"]
+        predicted = self.estimate_seconds(model, sample["width"], sample["height"],
+                                          sample["frames"], sample["steps"], sample.get("warm"))
+        sample = dict(sample, error_pct=abs(predicted - sample["seconds"]) / max(sample["seconds"], 1) * 100)
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=WINDOW)).append(sample)
+            self._refit(model)
+
+    def _refit(self, model: str):
+        """Reajusta as regressões de um modelo (chamado com o lock adquirido)."""
+        samples = self._samples[model]
+        warm = [s for s in samples if s.get("warm")]
+        cold = [s for s in samples if not s.get("warm")]
+        fit: Dict[str, object] = {}
+
+        # Tempo por step: amostras quentes; sem elas, todas (a carga dilui no tempo por step)
+        basis = warm if len(warm) >= MIN_SAMPLES else list(samples)
+        if len(basis) >= MIN_SAMPLES:
+            fit["seconds_per_step"] = _fit_line([
+                (self.workload(s["width"], s["height"], s["frames"]), s["seconds"] / max(s["steps"], 1))
+                for s in basis])
+
+            # Custo de carga: excedente médio dos jobs frios sobre a previsão quente
+            if basis is warm and cold:
+                a, b = fit["seconds_per_step"]
+                extra = [s["seconds"] - max(s["steps"], 1) *
+                         (a + b * self.workload(s["width"], s["height"], s["frames"]))
+                         for s in cold]
+                fit["load_seconds"] = max(0.0, sum(extra) / len(extra))
+
+        exclusive = [s for s in samples if s.get("peak_gb") and s.get("exclusive")]
+        if len(exclusive) >= MIN_SAMPLES:
+            fit["peak_gb"] = _fit_line([
+                (self.workload(s["width"], s["height"], s["frames"]), s["peak_gb"]) for s in exclusive])
+
+        self._fits[model] = fit
+
+    def info(self) -> dict:
+        """Estado dos ajustes por modelo (coeficientes e erro das previsões recentes)"""
+        with self._lock:
+            result = {}
+            for model, samples in self._samples.items():
+                fit = self._fits.get(model, {})
+                recent = list(samples)[-20:]
+                result[model] = {
+                    "samples":            len(samples),
+                    "warm_samples":       sum(1 for s in samples if s.get("warm")),
+                    "memory_samples":     sum(1 for s in samples if s.get("peak_gb") and s.get("exclusive")),
+                    "seconds_per_step":   (None if "seconds_per_step" not in fit else
+                                           {"intercept": round(fit["seconds_per_step"][0], 3),
+                                            "per_mpx_frame": round(fit["seconds_per_step"][1], 5)}),
+                    "load_seconds":       round(fit["load_seconds"], 1) if "load_seconds" in fit else None,
+                    "peak_gb":            (None if "peak_gb" not in fit else
+                                           {"intercept": round(fit["peak_gb"][0], 2),
+                                            "per_mpx_frame": round(fit["peak_gb"][1], 4)}),
+                    "recent_error_pct":   (round(sum(s["error_pct"] for s in recent) / len(recent), 1)
+                                           if recent else None),
+                }
+            return {
+                "min_samples": MIN_SAMPLES,
+                "window":      WINDOW,
+                "priors": {
+                    "seconds_per_frame": self.prior_seconds_per_frame,
+                    "memory_gb":         self.prior_memory_gb,
+                },
+                "models": result,
+            }
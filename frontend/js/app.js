@@ -11,6 +11,9 @@ let jobs = [];
 let completedJobs = [];
 let statusInterval = null;
 let jobsInterval = null;
+let eventSources = {};       // modelo -> EventSource de /events
+let eventsConnected = {};    // modelo -> stream ativo (sem polling dos jobs dele)
+let renderPending = false;
 
 // Inicialização
 document.addEventListener('DOMContentLoaded', () => {
@@ -28,8 +31,8 @@ function initializeApp() {
     checkModelsStatus();
     statusInterval = setInterval(checkModelsStatus, 10000); // A cada 10s
 
-    // Verificar jobs
-    jobsInterval = setInterval(updateJobs, 3000); // A cada 3s
+    // Jobs: eventos (SSE) dos modelos com jobs ativos; polling só para modelos sem stream
+    jobsInterval = setInterval(() => updateJobs(true), 3000); // A cada 3s
 
     // Carregar jobs salvos do localStorage
     loadSavedJobs();
@@ -74,9 +77,18 @@ function updateStatusCard(card, modelKey, data, status) {
     if (status === 'online' && data) {
         const modelLoaded = data.model?.loaded || false;
         const gpuMem = data.system?.gpu_memory;
+        const ready = data.ready || { ready: true };
 
-        statusText.textContent = modelLoaded ? '✓ Modelo carregado' : '○ Modelo não carregado';
-        statusText.style.color = modelLoaded ? 'var(--success)' : 'var(--warning)';
+        if (!ready.ready) {
+            // Preload em andamento, ou falhou e será tentado de novo
+            statusText.textContent = ready.phase === 'failed' ? '⚠ Falha no preload (nova tentativa)' : '⏳ Preparando modelo';
+            statusText.style.color = ready.phase === 'failed' ? 'var(--danger)' : 'var(--warning)';
+            statusText.title = ready.error || '';
+        } else {
+            statusText.textContent = modelLoaded ? '✓ Modelo carregado' : '○ Modelo não carregado';
+            statusText.style.color = modelLoaded ? 'var(--success)' : 'var(--warning)';
+            statusText.title = '';
+        }
 
         if (gpuMem && gpuMem.available) {
             memoryText.textContent = `GPU: ${gpuMem.allocated_gb || 0}GB / ${gpuMem.total_gb || 0}GB`;
@@ -164,43 +176,109 @@ async function handleGenerate(e) {
     }
 }
 
-// Atualizar status dos jobs
-async function updateJobs() {
-    const updatedJobs = [];
+function isActiveJob(job) {
+    return ['queued', 'processing'].includes(job.status || 'queued');
+}
+
+// Eventos (SSE): um stream por modelo só enquanto ele tem jobs na fila ou gerando.
+// Cada stream ocupa uma das ~6 conexões HTTP/1.1 por origem do navegador; com
+// quatro abertas sempre, polling, downloads e outra aba ficariam sem conexão.
+function syncEventStreams() {
+    if (!window.EventSource) return;
+
+    for (const modelKey of Object.keys(MODELS)) {
+        const active = jobs.some(j => j.model === modelKey && isActiveJob(j));
+        if (active && !eventSources[modelKey]) {
+            openEvents(modelKey);
+        } else if (!active && eventSources[modelKey]) {
+            eventSources[modelKey].close();
+            delete eventSources[modelKey];
+            eventsConnected[modelKey] = false;
+        }
+    }
+}
+
+// Estado e progresso por step dos jobs de um modelo, sem polling
+function openEvents(modelKey) {
+    const model = MODELS[modelKey];
+    const es = new EventSource(`${model.apiPath}/events`);
+    // hello chega a cada (re)conexão: buscar o que mudou enquanto estava desconectado
+    es.addEventListener('hello', () => {
+        eventsConnected[modelKey] = true;
+        updateJobs();
+    });
+    es.addEventListener('job', e => {
+        const data = JSON.parse(e.data).job;
+        const job = jobs.find(j => j.job_id === data.job_id);
+        if (!job) return;
+        applyJobUpdate(job, data);
+        saveJobs();
+        scheduleRender();
+    });
+    es.addEventListener('progress', e => {
+        const p = JSON.parse(e.data);
+        const job = jobs.find(j => j.job_id === p.job_id);
+        if (!job) return;
+        Object.assign(job, {
+            progress: p.progress,
+            step: p.step,
+            total_steps: p.total_steps,
+            eta_seconds: p.eta_seconds
+        });
+        scheduleRender();
+    });
+    es.onerror = () => { eventsConnected[modelKey] = false; };  // EventSource reconecta sozinho
+    eventSources[modelKey] = es;
+}
+
+function scheduleRender() {
+    if (renderPending) return;
+    renderPending = true;
+    requestAnimationFrame(() => {
+        renderPending = false;
+        renderJobs();
+        renderCompletedJobs();
+    });
+}
+
+// Aplica o estado recebido da API; concluídos vão para a lista de concluídos
+function applyJobUpdate(job, data) {
+    // Preservar informações originais do modelo
+    const updatedJob = {
+        ...data,
+        model: job.model,
+        modelName: job.modelName
+    };
 
-    for (const job of jobs) {
+    if (data.status === 'completed') {
+        // Mover para concluídos
+        if (!completedJobs.find(j => j.job_id === job.job_id)) {
+            completedJobs.unshift(updatedJob);
+        }
+        jobs = jobs.filter(j => j.job_id !== job.job_id);
+    } else {
+        Object.assign(job, updatedJob);
+    }
+}
+
+// Atualizar status dos jobs (onlyDisconnected: só modelos sem stream de eventos)
+async function updateJobs(onlyDisconnected = false) {
+    for (const job of [...jobs]) {
+        // falhos/cancelados não mudam mais; sem stream, não há por que consultá-los
+        if (onlyDisconnected && (eventsConnected[job.model] || !isActiveJob(job))) continue;
         const model = MODELS[job.model];
 
         try {
             const response = await fetch(`${model.apiPath}/jobs/${job.job_id}`);
 
             if (response.ok) {
-                const data = await response.json();
-                // Preservar informações originais do modelo
-                const updatedJob = {
-                    ...data,
-                    model: job.model,
-                    modelName: job.modelName
-                };
-
-                if (data.status === 'completed') {
-                    // Mover para concluídos
-                    if (!completedJobs.find(j => j.job_id === job.job_id)) {
-                        completedJobs.unshift(updatedJob);
-                    }
-                } else {
-                    updatedJobs.push(updatedJob);
-                }
-            } else {
-                updatedJobs.push(job);
+                applyJobUpdate(job, await response.json());
             }
         } catch (error) {
             console.error(`Erro ao verificar job ${job.job_id}:`, error);
-            updatedJobs.push(job);
         }
     }
 
-    jobs = updatedJobs;
     saveJobs();
     renderJobs();
     renderCompletedJobs();
@@ -231,7 +309,9 @@ function renderJobs() {
                 <div class="progress-bar">
                     <div class="progress-fill" style="width: ${job.progress}%"></div>
                 </div>
-                <small style="color: var(--text-muted);">Progresso: ${job.progress}%</small>
+                <small style="color: var(--text-muted);">
+                    Progresso: ${job.progress}%${job.total_steps ? ` · step ${job.step}/${job.total_steps}` : ''}${job.eta_seconds ? ` · ~${formatEta(job.eta_seconds)} restantes` : ''}
+                </small>
             ` : ''}
             ${job.error ? `
                 <div style="color: var(--danger); margin-top: 0.5rem; font-size: 0.9rem;">
@@ -239,6 +319,11 @@ function renderJobs() {
                 </div>
             ` : ''}
             <div class="job-actions">
+                ${['queued', 'processing'].includes(job.status || 'queued') ? `
+                    <button class="btn-small" onclick="cancelJob('${job.job_id}')">
+                        Cancelar
+                    </button>
+                ` : ''}
                 <button class="btn-small btn-danger" onclick="removeJob('${job.job_id}')">
                     Remover
                 </button>
@@ -297,11 +382,37 @@ function getStatusText(status) {
         'queued': '⏳ Na fila',
         'processing': '⚙️ Processando',
         'completed': '✓ Concluído',
-        'failed': '✗ Falhou'
+        'failed': '✗ Falhou',
+        'cancelled': '✕ Cancelado'
     };
     return statusMap[status] || status;
 }
 
+function formatEta(seconds) {
+    const total = Math.ceil(seconds);
+    if (total < 60) return `${total}s`;
+    return `${Math.floor(total / 60)}min ${total % 60}s`;
+}
+
+// Interrompe a geração no servidor (libera a GPU); o estado chega pelos eventos
+async function cancelJob(jobId) {
+    const job = jobs.find(j => j.job_id === jobId);
+    if (!job || !confirm('Cancelar a geração deste vídeo?')) return;
+
+    try {
+        const response = await fetch(`${MODELS[job.model].apiPath}/jobs/${jobId}/cancel`, { method: 'POST' });
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.detail || 'Erro ao cancelar');
+        }
+        applyJobUpdate(job, { ...job, status: 'cancelled' });
+        saveJobs();
+        renderJobs();
+    } catch (error) {
+        alert(`Erro: ${error.message}`);
+    }
+}
+
 function removeJob(jobId) {
     if (confirm('Remover este job da lista?')) {
         jobs = jobs.filter(j => j.job_id !== jobId);
@@ -322,6 +433,7 @@ function removeCompleted(jobId) {
 function saveJobs() {
     localStorage.setItem('videosdgx_jobs', JSON.stringify(jobs));
     localStorage.setItem('videosdgx_completed', JSON.stringify(completedJobs));
+    syncEventStreams();  // jobs mudaram: abrir/fechar streams de eventos
 }
 
 function loadSavedJobs() {
@@ -341,12 +453,15 @@ function loadSavedJobs() {
     } catch (error) {
         console.error('Erro ao carregar jobs salvos:', error);
     }
+
+    syncEventStreams();
 }
 
 // Cleanup ao sair
 window.addEventListener('beforeunload', () => {
     if (statusInterval) clearInterval(statusInterval);
     if (jobsInterval) clearInterval(jobsInterval);
+    Object.values(eventSources).forEach(es => es.close());
 });
 
 // =============================================================================
@@ -5,6 +5,8 @@ Arquitetura: Dual-Sampler (High Noise Expert + Low Noise Expert)
 Uso: ./gerar_video_wan22_14b.py "seu prompt aqui" [opções]
 """
 
+import copy
+import functools
 import json
 import uuid
 import sys
@@ -19,10 +21,15 @@ OUTPUT_DIR = Path(__file__).parent / "ComfyUI" / "output"
 # Prompt negativo oficial do Wan 2.2 (em chinês - recomendado pelo time)
 NEGATIVE_DEFAULT = "色调艳丽，过曝，静态，细节模糊不清，字幕，风格，作品，画作，画面，静止，整体发灰，最差质量，低质量，JPEG压缩残留，丑陋的，残缺的，多余的手指，画得不好的手部，画得不好的脸部，畸形的，毁容的，形态畸形的肢体，手指融合，静止不动的画面，杂乱的背景，三条腿，背景人很多，倒着走"
 
-def load_workflow_template():
+@functools.lru_cache(maxsize=1)
+def _read_workflow_template():
     with open(WORKFLOW_TEMPLATE) as f:
         return json.load(f)
 
+def load_workflow_template():
+    # Lido do disco uma vez por processo; cada job recebe uma cópia
+    return copy.deepcopy(_read_workflow_template())
+
 def create_workflow(prompt, negative=None, width=1280, height=704, frames=57,
                     fps=24, cfg=3.5, seed=-1, steps=20, split_step=10,
                     output_prefix="wan22_14b_video"):
@@ -5,6 +5,8 @@ Modelo: Text-to-Video + Image-to-Video em um único modelo leve
 Uso: ./gerar_video_wan22_5b.py "seu prompt aqui" [opções]
 """
 
+import copy
+import functools
 import json
 import uuid
 import sys
@@ -18,11 +20,15 @@ COMFYUI_URL = "http://127.0.0.1:8188"
 WORKFLOW_TEMPLATE = Path(__file__).parent / "workflow_wan22_5b_t2v.json"
 OUTPUT_DIR = Path(__file__).parent / "ComfyUI" / "output"
 
-def load_workflow_template():
-    """Carrega template do workflow"""
+@functools.lru_cache(maxsize=1)
+def _read_workflow_template():
     with open(WORKFLOW_TEMPLATE) as f:
         return json.load(f)
 
+def load_workflow_template():
+    """Carrega template do workflow (lido do disco uma vez por processo)"""
+    return copy.deepcopy(_read_workflow_template())
+
 def create_workflow(prompt, negative="", width=720, height=480, frames=33, fps=24, cfg=6.0, seed=42, output_prefix="wan22_5b_video"):
     """Cria workflow personalizado"""
     workflow = load_workflow_template()
@@ -0,0 +1,191 @@
+"""
+Escalonador de jobs com afinidade por modelo (interface web v4.2+)
+
+Em vez de FIFO estrito, o worker pede o próximo job preferindo os modelos que
+já estão carregados no ComfyUI: jobs do mesmo modelo são agrupados e a troca
+de checkpoints (ex: 90 GB do Wan 14B vs 45 GB do LTX-2) acontece menos vezes.
+
+Justiça: um job pode ser ultrapassado no máximo `max_skips` vezes e esperar no
+máximo `max_wait_seconds`; ao atingir um dos limites ele é o próximo a rodar.
+
+MemoryAdmission limita a soma das estimativas de memória dos jobs em execução;
+com mais de um worker, o escalonador só entrega jobs que cabem no orçamento.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+class AffinityScheduler:
+    """Fila thread-safe de job_ids com preferência por modelo carregado"""
+
+    def __init__(self, max_skips: int = 3, max_wait_seconds: float = 1800):
+        self.max_skips = max_skips
+        self.max_wait_seconds = max_wait_seconds
+        self._cond = threading.Condition()
+        # job_id -> {"model", "cost_gb", "enqueued_at", "skips"} em ordem de chegada
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._dispatched: Dict[str, int] = {}
+        self._affinity_hits = 0
+
+    def put(self, job_id: str, model: str, cost_gb: float = 0.0):
+        with self._cond:
+            self._entries[job_id] = {"model": model, "cost_gb": cost_gb,
+                                     "enqueued_at": time.time(), "skips": 0}
+            self._cond.notify_all()
+
+    def wake(self):
+        """Acorda workers bloqueados (ex: memória liberada por um job que terminou)."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def remove(self, job_id: str) -> bool:
+        """Remove um job ainda na fila (cancelamento). Retorna True se estava na fila."""
+        with self._cond:
+            return self._entries.pop(job_id, None) is not None
+
+    def qsize(self) -> int:
+        with self._cond:
+            return len(self._entries)
+
+    def get(self, preferred: Iterable[str] = (), timeout: Optional[float] = None,
+            admit: Optional[Callable[[str, dict], bool]] = None) -> Optional[str]:
+        """
+        Retira o próximo job, bloqueando até haver trabalho
+        Args:
+            preferred: modelos já carregados (afinidade)
+            timeout: segundos máximos de espera (None = indefinido)
+            admit: admit(job_id, entry) -> bool; reserva recursos para o job
+                   escolhido (chamado com o lock da fila, ver MemoryAdmission)
+        Returns:
+            job_id, ou None se o timeout expirou
+        """
+        preferred = set(preferred)
+        with self._cond:
+            chosen = []
+
+            def ready():
+                chosen[:] = [self._pick(preferred, time.time(), admit)] if self._entries else []
+                return chosen and chosen[0] is not None
+
+            if not self._cond.wait_for(ready, timeout=timeout):
+                return None
+            job_id = chosen[0]
+            entry = self._entries.pop(job_id)
+
+            # Jobs mais antigos que foram ultrapassados acumulam um skip
+            for other in self._entries.values():
+                if other["enqueued_at"] < entry["enqueued_at"]:
+                    other["skips"] += 1
+
+            model = entry["model"]
+            self._dispatched[model] = self._dispatched.get(model, 0) + 1
+            if model in preferred:
+                self._affinity_hits += 1
+            return job_id
+
+    def _pick(self, preferred: set, now: float, admit=None) -> Optional[str]:
+        """Escolhe o próximo job (chamado com o lock adquirido); None se nenhum é admitido."""
+        # 1. Job em inanição (ultrapassado demais ou esperando demais) tem prioridade;
+        #    se ainda não cabe, os demais esperam por ele
+        for job_id, entry in self._entries.items():
+            if self._starving(entry, now):
+                return job_id if admit is None or admit(job_id, entry) else None
+        # 2. Afinidade: o mais antigo entre os modelos já carregados
+        # 3. FIFO
+        candidates = sorted(self._entries.items(),
+                            key=lambda kv: kv[1]["model"] not in preferred)
+        for job_id, entry in candidates:
+            if admit is None or admit(job_id, entry):
+                return job_id
+        return None
+
+    def _starving(self, entry: dict, now: float) -> bool:
+        return (entry["skips"] >= self.max_skips
+                or now - entry["enqueued_at"] >= self.max_wait_seconds)
+
+    def order(self, preferred: Iterable[str] = ()) -> List[str]:
+        """
+        Ordem prevista de execução dos jobs na fila (para posições na fila),
+        simulando as escolhas do worker a partir dos modelos carregados.
+        """
+        with self._cond:
+            entries = OrderedDict((k, dict(v)) for k, v in self._entries.items())
+        preferred = set(preferred)
+        now = time.time()
+        result = []
+
+        while entries:
+            job_id = next((k for k, e in entries.items() if self._starving(e, now)), None)
+            if job_id is None:
+                job_id = next((k for k, e in entries.items() if e["model"] in preferred),
+                              next(iter(entries)))
+            entry = entries.pop(job_id)
+            for other in entries.values():
+                if other["enqueued_at"] < entry["enqueued_at"]:
+                    other["skips"] += 1
+            # Depois de rodar, só o último modelo é considerado carregado
+            preferred = {entry["model"]}
+            result.append(job_id)
+        return result
+
+    def stats(self) -> dict:
+        """Profundidade da fila por modelo, espera mais longa e contadores de despacho"""
+        now = time.time()
+        with self._cond:
+            per_model: Dict[str, dict] = {}
+            for entry in self._entries.values():
+                m = per_model.setdefault(entry["model"], {"queued": 0, "oldest_wait_seconds": 0})
+                m["queued"] += 1
+                m["oldest_wait_seconds"] = max(m["oldest_wait_seconds"],
+                                               round(now - entry["enqueued_at"]))
+            for model, count in self._dispatched.items():
+                per_model.setdefault(model, {"queued": 0, "oldest_wait_seconds": 0})["dispatched"] = count
+
+            return {
+                "queued":           len(self._entries),
+                "max_skips":        self.max_skips,
+                "max_wait_seconds": self.max_wait_seconds,
+                "affinity_hits":    self._affinity_hits,
+                "models":           per_model,
+            }
+
+
+class MemoryAdmission:
+    """
+    Controle de admissão por orçamento de memória: um job só começa se a soma
+    das estimativas dos jobs em execução e dos modelos mantidos quentes pelas
+    instâncias (mesma memória unificada), mais a dele, couber em `ceiling_gb`.
+    Com nada em execução qualquer job é admitido: jobs maiores que o teto rodam
+    sozinhos, e a política de memória libera os modelos quentes antes de carregar.
+    """
+
+    def __init__(self, ceiling_gb: float):
+        self.ceiling_gb = ceiling_gb
+        self._lock = threading.Lock()
+        self._running: Dict[str, float] = {}   # job_id -> GB reservados
+
+    def try_admit(self, job_id: str, gb: float, resident_gb: float = 0.0) -> bool:
+        """resident_gb: modelos quentes que nenhum job em execução reservou"""
+        with self._lock:
+            if self._running and sum(self._running.values()) + resident_gb + gb > self.ceiling_gb:
+                return False
+            self._running[job_id] = gb
+            return True
+
+    def release(self, job_id: str):
+        with self._lock:
+            self._running.pop(job_id, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._running)
+
+    def info(self) -> dict:
+        with self._lock:
+            return {
+                "ceiling_gb":  self.ceiling_gb,
+                "reserved_gb": round(sum(self._running.values()), 1),
+                "running":     {k: round(v, 1) for k, v in self._running.items()},
+            }
@@ -0,0 +1,284 @@
+"""
+Persistência de jobs da interface web (v4.2+)
+
+Backends:
+  - sqlite: SQLite em modo WAL, uma linha por job (padrão). Cada mudança de
+            estado grava apenas a linha do job alterado: O(1) por escrita,
+            independente do tamanho do histórico.
+  - json:   arquivo JSON único reescrito a cada mudança (comportamento legado).
+
+Cada gravação recebe uma revisão monotônica (`job["revision"]`). A revisão
+global do store serve de cursor (`since`) e de ETag para a listagem de jobs.
+Remoções também: o job vira uma lápide (`{"job_id", "deleted": True, "revision"}`),
+omitida das listagens normais e devolvida só em consultas com `since`, para que
+clientes incrementais saibam que o job sumiu.
+
+`job["request_hash"]` (hash canônico do pedido) é indexado para encontrar um
+vídeo já gerado com os mesmos parâmetros e seed.
+
+Na primeira abertura do backend SQLite, o arquivo JSON legado (se existir) é
+importado e renomeado para `<nome>.migrated`.
+"""
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+TOMBSTONE = "deleted"   # status das lápides de jobs removidos
+
+
+def tombstone(job_id: str, revision: int) -> dict:
+    return {"job_id": job_id, "status": TOMBSTONE, "deleted": True, "revision": revision}
+
+
+class JobStore:
+    """Interface comum dos backends de persistência de jobs"""
+
+    revision: int = 0
+
+    def load_all(self) -> Dict[str, dict]:
+        """Retorna todos os jobs persistidos (job_id -> job)"""
+        raise NotImplementedError
+
+    def put(self, job: dict) -> None:
+        """Insere ou atualiza um único job (atribui job["revision"])"""
+        raise NotImplementedError
+
+    def query(self, statuses: Optional[Sequence[str]] = None, since: Optional[int] = None,
+              limit: int = 50, offset: int = 0) -> Tuple[List[dict], int]:
+        """
+        Lista jobs do mais recente para o mais antigo; com `since`, em ordem
+        crescente de revisão (a última da página serve de cursor), incluindo
+        as lápides de jobs removidos
+        Args:
+            statuses: filtra por status (None = todos)
+            since: apenas jobs com revisão > since
+            limit/offset: paginação
+        Returns:
+            (página de jobs, total que satisfaz os filtros; None com `since`,
+            que não conta: pedir limit+1 para saber se há outra página)
+        """
+        raise NotImplementedError
+
+    def find_completed(self, request_hash: str) -> Optional[dict]:
+        """Job concluído mais recente com o hash de pedido informado (None se não há)"""
+        raise NotImplementedError
+
+    def delete(self, job_id: str) -> None:
+        """Remove um job, deixando uma lápide com nova revisão"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class JsonJobStore(JobStore):
+    """Backend legado: reescreve o arquivo inteiro a cada mudança (O(N))"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._jobs: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def load_all(self) -> Dict[str, dict]:
+        if self.path.exists():
+            try:
+                with open(self.path) as f:
+                    self._jobs = json.load(f)
+            except Exception:
+                self._jobs = {}
+        self.revision = max((j.get("revision", 0) for j in self._jobs.values()), default=0)
+        return {job_id: j for job_id, j in self._jobs.items() if not j.get("deleted")}
+
+    def put(self, job: dict) -> None:
+        with self._lock:
+            self.revision += 1
+            job["revision"] = self.revision
+            self._jobs[job["job_id"]] = job
+            self._flush()
+
+    def query(self, statuses=None, since=None, limit=50, offset=0):
+        with self._lock:
+            if since is None:
+                selected = [j for j in self._jobs.values() if not j.get("deleted")
+                            and (not statuses or j.get("status") in statuses)]
+            else:
+                selected = [j for j in self._jobs.values() if j.get("revision", 0) > since
+                            and (not statuses or j.get("status") in statuses or j.get("deleted"))]
+        if since is None:
+            selected.sort(key=lambda j: j.get("created_at", ""), reverse=True)
+            return selected[offset:offset + limit], len(selected)
+        selected.sort(key=lambda j: j.get("revision", 0))
+        return selected[offset:offset + limit], None
+
+    def find_completed(self, request_hash: str) -> Optional[dict]:
+        with self._lock:
+            matches = [j for j in self._jobs.values()
+                       if j.get("request_hash") == request_hash and j.get("status") == "completed"]
+        return max(matches, key=lambda j: j.get("created_at", ""), default=None)
+
+    def delete(self, job_id: str) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.get("deleted"):
+                return
+            self.revision += 1
+            self._jobs[job_id] = tombstone(job_id, self.revision)
+            self._flush()
+
+    def _flush(self):
+        with open(self.path, 'w') as f:
+            json.dump(self._jobs, f, indent=2)
+
+
+class SQLiteJobStore(JobStore):
+    """Backend SQLite/WAL com uma linha por job e índices por status e data"""
+
+    def __init__(self, path: Path, legacy_json: Optional[Path] = None):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        # Uma conexão compartilhada entre a thread worker e o event loop,
+        # serializada pelo lock
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        if legacy_json is not None:
+            self._import_json(Path(legacy_json))
+
+    def _migrate(self):
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            with self._conn:
+                self._conn.execute("""
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        job_id     TEXT PRIMARY KEY,
+                        status     TEXT NOT NULL,
+                        created_at TEXT NOT NULL,
+                        data       TEXT NOT NULL
+                    )""")
+                self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+                self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs(created_at)")
+                self._conn.execute("PRAGMA user_version = 1")
+        if version < 2:
+            with self._conn:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+                self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_revision ON jobs(revision)")
+                self._conn.execute("PRAGMA user_version = 2")
+        if version < 3:
+            with self._conn:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN request_hash TEXT")
+                self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_request_hash "
+                                   "ON jobs(request_hash, status)")
+                self._conn.execute("PRAGMA user_version = 3")
+        self.revision = self._conn.execute(
+            "SELECT COALESCE(MAX(revision), 0) FROM jobs").fetchone()[0]
+
+    def _import_json(self, json_path: Path):
+        """Importa o arquivo JSON legado uma única vez"""
+        if not json_path.exists():
+            return
+        try:
+            with open(json_path) as f:
+                legacy = json.load(f)
+        except Exception:
+            return
+
+        with self._lock, self._conn:
+            for job_id, job in legacy.items():
+                job.setdefault("job_id", job_id)
+                self.revision += 1
+                job["revision"] = self.revision
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO jobs (job_id, status, created_at, revision, request_hash, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    self._row(job),
+                )
+        json_path.rename(json_path.with_name(json_path.name + ".migrated"))
+        print(f"  [info] {len(legacy)} jobs importados de {json_path}")
+
+    @staticmethod
+    def _row(job: dict):
+        return (job["job_id"], job.get("status", ""), job.get("created_at", ""),
+                job.get("revision", 0), job.get("request_hash"), json.dumps(job))
+
+    def load_all(self) -> Dict[str, dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, data FROM jobs WHERE status != ? ORDER BY created_at",
+                (TOMBSTONE,)).fetchall()
+        return {job_id: json.loads(data) for job_id, data in rows}
+
+    def put(self, job: dict) -> None:
+        with self._lock, self._conn:
+            self.revision += 1
+            job["revision"] = self.revision
+            self._conn.execute(
+                """INSERT INTO jobs (job_id, status, created_at, revision, request_hash, data)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(job_id) DO UPDATE SET
+                       status = excluded.status,
+                       created_at = excluded.created_at,
+                       revision = excluded.revision,
+                       request_hash = excluded.request_hash,
+                       data = excluded.data""",
+                self._row(job),
+            )
+
+    def query(self, statuses=None, since=None, limit=50, offset=0):
+        where, params = [], []
+        if statuses:
+            # Com `since`, lápides passam pelo filtro de status
+            either = " OR status = ?" if since is not None else ""
+            where.append(f"(status IN ({','.join('?' * len(statuses))}){either})")
+            params.extend(statuses)
+            if either:
+                params.append(TOMBSTONE)
+        if since is None:
+            where.append("status != ?")
+            params.append(TOMBSTONE)
+        else:
+            where.append("revision > ?")
+            params.append(since)
+        clause = f"WHERE {' AND '.join(where)}"
+        order = "created_at DESC" if since is None else "revision ASC"
+
+        with self._lock:
+            # Polls com `since` só querem o delta: sem COUNT(*)
+            total = None if since is not None else self._conn.execute(
+                f"SELECT COUNT(*) FROM jobs {clause}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT data FROM jobs {clause} ORDER BY {order} LIMIT ? OFFSET ?",
+                params + [limit, offset]).fetchall()
+        return [json.loads(data) for (data,) in rows], total
+
+    def find_completed(self, request_hash: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM jobs WHERE request_hash = ? AND status = 'completed' "
+                "ORDER BY created_at DESC LIMIT 1", (request_hash,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, job_id: str) -> None:
+        with self._lock, self._conn:
+            revision = self.revision + 1
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = ?, revision = ?, request_hash = NULL, data = ? "
+                "WHERE job_id = ? AND status != ?",
+                (TOMBSTONE, revision, json.dumps(tombstone(job_id, revision)), job_id, TOMBSTONE))
+            if cur.rowcount:
+                self.revision = revision
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_job_store(backend: str, db_path: Path, json_path: Path) -> JobStore:
+    """Cria o backend configurado ("sqlite" ou "json")"""
+    if backend == "json":
+        return JsonJobStore(json_path)
+    if backend == "sqlite":
+        return SQLiteJobStore(db_path, legacy_json=json_path)
+    raise ValueError(f"Backend de jobs desconhecido: {backend}")
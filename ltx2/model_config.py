@@ -4,20 +4,27 @@ LTX-2: Modelo de geração de vídeo + áudio da Lightricks
 """
 import torch
 from pathlib import Path
-from typing import Tuple, Any
-import os
+from typing import Tuple, Any, Optional, List
 
 from utils import get_logger
+from weight_loading import from_pretrained, load_phase
+from video_writer import decode_latent_chunks, stream_video
+from tracing import Trace
 
 logger = get_logger(__name__)
 
-def load_ltx2_model(model_path: str, quantization: str = "fp4") -> Tuple[Any, Any]:
+DEFAULT_STEPS = 50
+
+def load_ltx2_model(model_path: str, quantization: str = "fp4",
+                    device: Optional[str] = None, load_mode: str = "standard") -> Tuple[Any, Any]:
     """
     Carrega modelo LTX-2 com configurações otimizadas
 
     Args:
         model_path: Caminho para os arquivos do modelo
         quantization: Tipo de quantização (fp4, fp8, fp16)
+        device: Device (ex: "cuda:1"); None = "cuda" se disponível
+        load_mode: "standard" (CPU, .to e offload) ou "mmap" (safetensors direto no device)
 
     Returns:
         Tupla (model, pipeline)
@@ -30,11 +37,10 @@ def load_ltx2_model(model_path: str, quantization: str = "fp4") -> Tuple[Any, An
         logger.info("Usando LTXPipeline do diffusers")
 
         # Configurações de quantização e device
-        device = "cuda" if torch.cuda.is_available() else "cpu"
+        device = device or ("cuda" if torch.cuda.is_available() else "cpu")
 
         # Por enquanto, usar FP16 até configurar quantização específica do LTX-2
         torch_dtype = torch.float16
-        quantization_config = None
         logger.info(f"Usando FP16 (quantização {quantization} não implementada ainda para DiffusionPipeline)")
 
         # Verificar se modelo existe
@@ -58,25 +64,29 @@ def load_ltx2_model(model_path: str, quantization: str = "fp4") -> Tuple[Any, An
             model_id = str(model_path_obj)
 
         # Carregar pipeline LTX
-        pipeline = LTXPipeline.from_pretrained(
+        pipeline = from_pretrained(
+            LTXPipeline,
             model_id,
-            torch_dtype=torch_dtype,
-            use_safetensors=True
+            device,
+            load_mode,
+            torch_dtype=torch_dtype
         )
 
-        # Mover para GPU
-        pipeline = pipeline.to(device)
+        if load_mode == "standard":
+            # Mover para GPU
+            with load_phase("to_device"):
+                pipeline = pipeline.to(device)
 
         # Otimizações específicas
         pipeline.enable_attention_slicing()
 
-        if torch.cuda.is_available():
+        if torch.cuda.is_available() and load_mode == "standard":
             # Otimizações para Blackwell
-            pipeline.enable_model_cpu_offload()  # Aproveitar memória unificada
+            with load_phase("cpu_offload"):
+                pipeline.enable_model_cpu_offload(device=device)  # Aproveitar memória unificada
 
         # Patch para compatibilidade: transformer não aceita rope_interpolation_scale
         # Fazer monkey-patch da classe do transformer para aceitar e ignorar esse parâmetro
-        import types
         transformer_class = pipeline.transformer.__class__
         original_forward = transformer_class.forward
 
@@ -95,7 +105,35 @@ def load_ltx2_model(model_path: str, quantization: str = "fp4") -> Tuple[Any, An
         raise
 
 
-def generate_video_ltx2(pipeline: Any, request: Any, output_path: Path) -> None:
+def _decoded_chunks(pipeline: Any, latents: torch.Tensor, num_frames: int, height: int, width: int):
+    """
+    Latentes empacotados do LTXPipeline (output_type="latent") -> blocos de
+    frames (ver decode_latent_chunks), com o mesmo preparo do pipeline
+    """
+    vae = pipeline.vae
+    spatial = pipeline.vae_spatial_compression_ratio
+    latents = pipeline._unpack_latents(
+        latents,
+        (num_frames - 1) // pipeline.vae_temporal_compression_ratio + 1,
+        height // spatial,
+        width // spatial,
+        pipeline.transformer_spatial_patch_size,
+        pipeline.transformer_temporal_patch_size
+    )
+    latents = pipeline._denormalize_latents(
+        latents, vae.latents_mean, vae.latents_std, vae.config.scaling_factor
+    ).to(vae.dtype)
+    # decode_timestep padrão do pipeline (0): sem ruído no decode
+    timestep = None
+    if vae.config.timestep_conditioning:
+        timestep = torch.zeros(latents.shape[0], device=latents.device, dtype=latents.dtype)
+    return decode_latent_chunks(lambda z: vae.decode(z, timestep, return_dict=False)[0], latents,
+                                pipeline.vae_temporal_compression_ratio)
+
+
+def generate_video_ltx2(pipeline: Any, request: Any, output_path: Path,
+                        trace: Optional[Trace] = None,
+                        num_inference_steps: Optional[int] = None) -> None:
     """
     Gera vídeo usando LTX-2
 
@@ -103,6 +141,8 @@ def generate_video_ltx2(pipeline: Any, request: Any, output_path: Path) -> None:
         pipeline: Pipeline do modelo
         request: Objeto GenerateRequest com parâmetros
         output_path: Caminho para salvar o vídeo
+        trace: Spans e steps do denoising (ver tracing); None = não registrar
+        num_inference_steps: Steps do denoising (None = o do request ou DEFAULT_STEPS; o warmup usa poucos)
     """
     logger.info(f"Gerando vídeo: {request.prompt[:50]}...")
 
@@ -121,47 +161,89 @@ def generate_video_ltx2(pipeline: Any, request: Any, output_path: Path) -> None:
 
         # Gerar vídeo
         # NOTA: Interface pode variar dependendo da implementação real do LTX-2
-        output = pipeline(
-            prompt=request.prompt,
-            negative_prompt=request.negative_prompt,
-            num_frames=num_frames,
-            height=height,
-            width=width,
-            guidance_scale=request.guidance_scale,
-            generator=generator,
-            num_inference_steps=50,  # Ajustar conforme necessário
-        )
-
-        # Salvar vídeo
-        # O output pode ser frames, tensor, ou já um arquivo
-        # Este é um exemplo genérico
-        if hasattr(output, 'frames'):
-            frames = output.frames
-        elif isinstance(output, dict) and 'frames' in output:
-            frames = output['frames']
-        else:
-            frames = output
-
-        # Salvar usando imageio ou similar
-        import imageio
-
-        # Se frames é tensor, converter para numpy
-        if isinstance(frames, torch.Tensor):
-            frames = frames.cpu().numpy()
-            # Normalizar de [-1, 1] para [0, 255]
-            frames = ((frames + 1.0) * 127.5).astype('uint8')
-
-        # Salvar como MP4
-        imageio.mimwrite(
-            str(output_path),
-            frames,
-            fps=request.fps,
-            codec='libx264',
-            quality=8
-        )
+        num_inference_steps = num_inference_steps or request.num_inference_steps or DEFAULT_STEPS
+        trace = trace or Trace()
+        with trace.span("pipeline", num_inference_steps=num_inference_steps):
+            output = pipeline(
+                prompt=request.prompt,
+                negative_prompt=request.negative_prompt,
+                num_frames=num_frames,
+                height=height,
+                width=width,
+                guidance_scale=request.guidance_scale,
+                generator=generator,
+                num_inference_steps=num_inference_steps,
+                output_type="latent",
+                **trace.callback_kwargs(pipeline)
+            )
+
+        # Decodificar em blocos e codificar cada um assim que sai da VAE
+        chunks = _decoded_chunks(pipeline, output.frames, num_frames, height, width)
+        stream_video(chunks, output_path, request.fps, request.encode_profile)
 
         logger.info(f"Vídeo salvo em {output_path}")
 
     except Exception as e:
         logger.error(f"Erro ao gerar vídeo: {str(e)}")
         raise
+
+
+def generate_video_ltx2_batch(pipeline: Any, requests: List[Any], output_paths: List[Path],
+                              trace: Optional[Trace] = None) -> None:
+    """
+    Gera vários vídeos numa única chamada do pipeline (micro-batching)
+
+    Args:
+        pipeline: Pipeline do modelo
+        requests: GenerateRequests compatíveis (mesma resolução, duração, fps, guidance e steps)
+        output_paths: Caminho de saída de cada request
+        trace: Spans e steps do denoising (ver tracing); None = não registrar
+    """
+    logger.info(f"Gerando lote de {len(requests)} vídeos com LTX-2")
+
+    try:
+        first = requests[0]
+        width, height = map(int, first.resolution.split('x'))
+        num_frames = first.duration * first.fps
+
+        # Um gerador por vídeo: cada job mantém sua seed
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        generators = []
+        for request in requests:
+            generator = torch.Generator(device=device)
+            if request.seed is not None:
+                generator.manual_seed(request.seed)
+            else:
+                generator.seed()
+            generators.append(generator)
+
+        negative = None
+        if any(request.negative_prompt for request in requests):
+            negative = [request.negative_prompt or "" for request in requests]
+
+        # batch_key garante o mesmo número de steps em todo o lote
+        num_inference_steps = first.num_inference_steps or DEFAULT_STEPS
+        trace = trace or Trace()
+        with trace.span("pipeline", num_inference_steps=num_inference_steps):
+            output = pipeline(
+                prompt=[request.prompt for request in requests],
+                negative_prompt=negative,
+                num_frames=num_frames,
+                height=height,
+                width=width,
+                guidance_scale=first.guidance_scale,
+                generator=generators,
+                num_inference_steps=num_inference_steps,
+                output_type="latent",
+                **trace.callback_kwargs(pipeline)
+            )
+
+        # Um arquivo por job, cada vídeo decodificado em blocos
+        for index, (output_path, request) in enumerate(zip(output_paths, requests)):
+            chunks = _decoded_chunks(pipeline, output.frames[index:index + 1], num_frames, height, width)
+            stream_video(chunks, output_path, first.fps, request.encode_profile)
+            logger.info(f"Vídeo salvo em {output_path}")
+
+    except Exception as e:
+        logger.error(f"Erro ao gerar lote: {str(e)}")
+        raise
@@ -4,19 +4,23 @@ MAGI-1: Modelo autoregressive para geração de vídeos longos
 """
 import torch
 from pathlib import Path
-from typing import Tuple, Any
+from typing import Tuple, Any, Optional
 
 from utils import get_logger
+from video_writer import write_video, CHUNK_FRAMES
+from tracing import Trace
 
 logger = get_logger(__name__)
 
-def load_magi1_model(model_path: str, quantization: str = "fp4") -> Tuple[Any, Any]:
+def load_magi1_model(model_path: str, quantization: str = "fp4",
+                     device: Optional[str] = None) -> Tuple[Any, Any]:
     """
     Carrega modelo MAGI-1 com configurações otimizadas
 
     Args:
         model_path: Caminho para os arquivos do modelo
         quantization: Tipo de quantização (fp4, fp8, fp16)
+        device: Device (ex: "cuda:1"); None = "cuda" se disponível
 
     Returns:
         Tupla (model, pipeline)
@@ -58,7 +62,7 @@ def load_magi1_model(model_path: str, quantization: str = "fp4") -> Tuple[Any, A
             model_id = str(model_path_obj)
 
         # Determinar device
-        device = "cuda" if torch.cuda.is_available() else "cpu"
+        device = device or ("cuda" if torch.cuda.is_available() else "cpu")
 
         # Carregar modelo autoregressive
         model = AutoModelForCausalLM.from_pretrained(
@@ -104,7 +108,9 @@ def load_magi1_model(model_path: str, quantization: str = "fp4") -> Tuple[Any, A
         raise
 
 
-def generate_video_magi1(pipeline: Any, request: Any, output_path: Path) -> None:
+def generate_video_magi1(pipeline: Any, request: Any, output_path: Path,
+                         trace: Optional[Trace] = None,
+                         num_inference_steps: Optional[int] = None) -> None:
     """
     Gera vídeo usando MAGI-1
 
@@ -112,6 +118,8 @@ def generate_video_magi1(pipeline: Any, request: Any, output_path: Path) -> None
         pipeline: Pipeline do modelo
         request: Objeto GenerateRequest
         output_path: Caminho para salvar o vídeo
+        trace: Spans e blocos gerados (ver tracing); None = não registrar
+        num_inference_steps: Sem efeito (a geração é por blocos autoregressivos)
     """
     logger.info(f"Gerando vídeo com MAGI-1: {request.prompt[:50]}...")
 
@@ -129,26 +137,23 @@ def generate_video_magi1(pipeline: Any, request: Any, output_path: Path) -> None
 
         # Gerar frames de forma autoregressive
         # NOTA: Interface real depende da implementação do MAGI-1
-        frames = []
-
-        # Placeholder: em produção, isso geraria frames iterativamente
-        # mantendo contexto temporal
         logger.info(f"Gerando {num_frames} frames com contexto temporal...")
 
-        # Por enquanto, criar um placeholder
-        import numpy as np
-        frames = np.random.randint(0, 255, (num_frames, height, width, 3), dtype=np.uint8)
-
-        # Salvar vídeo
-        import imageio
-
-        imageio.mimwrite(
-            str(output_path),
-            frames,
-            fps=request.fps,
-            codec='libx264',
-            quality=8
-        )
+        def frame_chunks():
+            # Placeholder: em produção, isso geraria blocos iterativamente
+            # mantendo contexto temporal
+            import numpy as np
+            chunks = -(-num_frames // CHUNK_FRAMES)
+            for index, start in enumerate(range(0, num_frames, CHUNK_FRAMES)):
+                count = min(CHUNK_FRAMES, num_frames - start)
+                yield np.random.randint(0, 255, (count, height, width, 3), dtype=np.uint8)
+                # Cada bloco autoregressivo conta como um step
+                trace.step(index, chunks)
+
+        # Salvar vídeo: cada bloco é codificado assim que gerado
+        trace = trace or Trace()
+        with trace.span("generate_and_encode"):
+            write_video(frame_chunks(), output_path, request.fps, request.encode_profile)
 
         logger.info(f"Vídeo salvo em {output_path}")
 
@@ -20,7 +20,9 @@ echo ""
 echo "3️⃣ Reiniciando ComfyUI..."
 cd /home/nmaldaner/projetos/VideosDGX/ComfyUI
 source ../comfyui-env/bin/activate
-nohup python main.py --listen 0.0.0.0 --port 8188 --highvram > ../comfyui_server.log 2>&1 &
+# COMFYUI_CACHE_LRU>0: mantém N saídas de nós entre prompts (ex: encodings do
+# prompt/negative), mesmo alternando modelos; 0 = cache clássico (último prompt)
+nohup python main.py --listen 0.0.0.0 --port 8188 --highvram --cache-lru "${COMFYUI_CACHE_LRU:-0}" > ../comfyui_server.log 2>&1 &
 COMFYUI_PID=$!
 
 sleep 3
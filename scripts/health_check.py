@@ -44,7 +44,8 @@ def check_ready(endpoint: str) -> Dict[str, Any]:
     """Verifica se modelo está carregado"""
     try:
         response = requests.get(f"{endpoint}/ready", timeout=5)
-        if response.status_code == 200:
+        if response.status_code in (200, 503):
+            # 503: preload (carga/aquecimento) ainda em andamento
             return response.json()
         else:
             return {"ready": False, "error": f"HTTP {response.status_code}"}
@@ -121,7 +122,7 @@ def main():
             all_healthy = False
 
         # Model loaded
-        model_loaded = ready.get("ready", False)
+        model_loaded = ready.get("loaded", False)
         loaded_text = f"{Colors.GREEN}Carregado{Colors.END}" if model_loaded else f"{Colors.YELLOW}Não carregado{Colors.END}"
 
         # Memory usage
@@ -0,0 +1,116 @@
+"""
+Biblioteca de workflows ComfyUI usada pela interface web (v4.2+)
+
+Reaproveita os construtores dos scripts CLI (criar_workflow/create_workflow em
+gerar_video_*.py) sem criar processos: a interface monta o workflow em memória
+e o submete pelo ComfyUIClient.
+"""
+import hashlib
+import json
+import random
+from typing import Optional
+
+import gerar_video_ltx2
+import gerar_video_ltx2_i2v
+import gerar_video_wan22_5b
+import gerar_video_wan22_5b_i2v
+import gerar_video_wan22_14b
+
+# Modelos com variante Image-to-Video
+I2V_MODELS = ("ltx2", "wan22_5b")
+
+# Incrementar ao mudar templates ou construtores de workflow: pedidos idênticos
+# passam a gerar um vídeo novo em vez de reaproveitar o anterior
+WORKFLOW_VERSION = 1
+
+
+def resolve_model_key(req) -> str:
+    """Retorna a variante usada (ex: ltx2 -> ltx2_i2v quando há imagem)."""
+    if getattr(req, "image_name", None) and req.model in I2V_MODELS:
+        return f"{req.model}_i2v"
+    return req.model
+
+
+def build_workflow(job_id: str, req) -> dict:
+    """
+    Monta o workflow (formato API) de um VideoRequest
+    Returns:
+        Dict com model_key, workflow, seed (efetivamente usado) e prefix
+    """
+    model_key = resolve_model_key(req)
+    prefix = f"web_{model_key}_{job_id}"
+    # Seed -1 = aleatório para todos os modelos (os scripts T2V não sorteiam)
+    seed = random.randint(0, 2**32 - 1) if req.seed == -1 else req.seed
+
+    if model_key == "ltx2":
+        workflow = gerar_video_ltx2.criar_workflow(
+            prompt=req.prompt, negative_prompt=req.negative,
+            width=req.width, height=req.height, frames=req.frames,
+            fps=req.fps, cfg=req.cfg, seed=seed, filename_prefix=prefix)
+
+    elif model_key == "ltx2_i2v":
+        workflow, seed = gerar_video_ltx2_i2v.criar_workflow(
+            req.prompt, req.image_name, req.negative,
+            req.width, req.height, req.frames, req.fps, req.cfg, seed, prefix)
+
+    elif model_key == "wan22_5b":
+        workflow = gerar_video_wan22_5b.create_workflow(
+            prompt=req.prompt, negative=req.negative,
+            width=req.width, height=req.height, frames=req.frames,
+            fps=req.fps, cfg=req.cfg, seed=seed, output_prefix=prefix)
+
+    elif model_key == "wan22_5b_i2v":
+        workflow, seed = gerar_video_wan22_5b_i2v.criar_workflow(
+            req.prompt, req.image_name, req.negative,
+            req.width, req.height, req.frames, req.fps, req.cfg, seed, prefix)
+
+    elif model_key == "wan22_14b":
+        # negative vazio = NEGATIVE_DEFAULT oficial do Wan (como no CLI)
+        workflow, seed = gerar_video_wan22_14b.create_workflow(
+            prompt=req.prompt, negative=req.negative or None,
+            width=req.width, height=req.height, frames=req.frames,
+            fps=req.fps, cfg=req.cfg, seed=seed,
+            steps=req.steps, split_step=req.split_step, output_prefix=prefix)
+
+    else:
+        raise ValueError(f"Modelo desconhecido: {req.model}")
+
+    return {"model_key": model_key, "workflow": workflow, "seed": seed, "prefix": prefix}
+
+
+def request_hash(req, image_digest: str = "") -> Optional[str]:
+    """
+    Hash canônico de um VideoRequest: mesmo hash = mesmo vídeo. Inclui apenas
+    os parâmetros que o workflow do modelo usa (steps/split_step só no Wan 14B).
+    Args:
+        image_digest: sha256 do conteúdo da imagem de entrada (I2V)
+    Returns:
+        sha256 hex, ou None para seed aleatória (-1), que nunca se repete
+    """
+    if req.seed == -1:
+        return None
+
+    model_key = resolve_model_key(req)
+    negative = req.negative
+    if model_key == "wan22_14b":
+        negative = req.negative or gerar_video_wan22_14b.NEGATIVE_DEFAULT
+
+    canonical = {
+        "workflow_version": WORKFLOW_VERSION,
+        "model":    model_key,
+        "prompt":   req.prompt,
+        "negative": negative,
+        "width":    req.width,
+        "height":   req.height,
+        "frames":   req.frames,
+        "fps":      req.fps,
+        "cfg":      float(req.cfg),
+        "seed":     req.seed,
+    }
+    if model_key == "wan22_14b":
+        canonical.update(steps=req.steps, split_step=req.split_step)
+    if model_key.endswith("_i2v"):
+        canonical["image"] = image_digest
+
+    raw = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
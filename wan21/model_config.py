@@ -4,19 +4,27 @@ Wan 2.1: Modelo versátil de geração de vídeo
 """
 import torch
 from pathlib import Path
-from typing import Tuple, Any
+from typing import Tuple, Any, Optional, List
 
 from utils import get_logger
+from weight_loading import from_pretrained, load_phase
+from video_writer import decode_latent_chunks, stream_video
+from tracing import Trace
 
 logger = get_logger(__name__)
 
-def load_wan21_model(model_path: str, quantization: str = "fp8") -> Tuple[Any, Any]:
+DEFAULT_STEPS = 50
+
+def load_wan21_model(model_path: str, quantization: str = "fp8",
+                     device: Optional[str] = None, load_mode: str = "standard") -> Tuple[Any, Any]:
     """
     Carrega modelo Wan 2.1 com configurações otimizadas
 
     Args:
         model_path: Caminho para os arquivos do modelo
         quantization: Tipo de quantização (fp8, fp16)
+        device: Device (ex: "cuda:1"); None = "cuda" se disponível
+        load_mode: "standard" (CPU, .to e offload) ou "mmap" (safetensors direto no device)
 
     Returns:
         Tupla (model, pipeline)
@@ -43,25 +51,30 @@ def load_wan21_model(model_path: str, quantization: str = "fp8") -> Tuple[Any, A
             model_id = str(model_path_obj)
 
         # Determinar device
-        device = "cuda" if torch.cuda.is_available() else "cpu"
+        device = device or ("cuda" if torch.cuda.is_available() else "cpu")
 
         # Carregar pipeline
-        pipeline = DiffusionPipeline.from_pretrained(
+        pipeline = from_pretrained(
+            DiffusionPipeline,
             model_id,
+            device,
+            load_mode,
             torch_dtype=torch_dtype,
-            use_safetensors=True,
             variant="fp16" if quantization == "fp16" else None
         )
 
-        # Mover para GPU
-        pipeline = pipeline.to(device)
+        if load_mode == "standard":
+            # Mover para GPU
+            with load_phase("to_device"):
+                pipeline = pipeline.to(device)
 
         # Otimizações
         pipeline.enable_attention_slicing()
         pipeline.enable_vae_slicing()
 
-        if torch.cuda.is_available():
-            pipeline.enable_model_cpu_offload()
+        if torch.cuda.is_available() and load_mode == "standard":
+            with load_phase("cpu_offload"):
+                pipeline.enable_model_cpu_offload(device=device)
 
         logger.info("Wan 2.1 carregado com sucesso")
 
@@ -72,7 +85,22 @@ def load_wan21_model(model_path: str, quantization: str = "fp8") -> Tuple[Any, A
         raise
 
 
-def generate_video_wan21(pipeline: Any, request: Any, output_path: Path) -> None:
+def _decoded_chunks(pipeline: Any, latents: torch.Tensor):
+    """Latentes do WanPipeline (output_type="latent") -> blocos de frames (ver decode_latent_chunks)"""
+    vae = pipeline.vae
+    config = vae.config
+    latents = latents.to(vae.dtype)
+    # Mesma desnormalização do WanPipeline antes do vae.decode
+    mean = torch.tensor(config.latents_mean).view(1, config.z_dim, 1, 1, 1).to(latents)
+    std = torch.tensor(config.latents_std).view(1, config.z_dim, 1, 1, 1).to(latents)
+    latents = latents * std + mean
+    return decode_latent_chunks(lambda z: vae.decode(z, return_dict=False)[0], latents,
+                                pipeline.vae_scale_factor_temporal)
+
+
+def generate_video_wan21(pipeline: Any, request: Any, output_path: Path,
+                         trace: Optional[Trace] = None,
+                         num_inference_steps: Optional[int] = None) -> None:
     """
     Gera vídeo usando Wan 2.1
 
@@ -80,6 +108,8 @@ def generate_video_wan21(pipeline: Any, request: Any, output_path: Path) -> None
         pipeline: Pipeline do modelo
         request: Objeto GenerateRequest
         output_path: Caminho para salvar o vídeo
+        trace: Spans e steps do denoising (ver tracing); None = não registrar
+        num_inference_steps: Steps do denoising (None = o do request ou DEFAULT_STEPS; o warmup usa poucos)
     """
     logger.info(f"Gerando vídeo com Wan 2.1: {request.prompt[:50]}...")
 
@@ -93,35 +123,89 @@ def generate_video_wan21(pipeline: Any, request: Any, output_path: Path) -> None
             generator.manual_seed(request.seed)
 
         # Gerar vídeo
-        output = pipeline(
-            prompt=request.prompt,
-            negative_prompt=request.negative_prompt,
-            num_frames=num_frames,
-            height=height,
-            width=width,
-            guidance_scale=request.guidance_scale,
-            generator=generator,
-            num_inference_steps=50,
-        )
+        num_inference_steps = num_inference_steps or request.num_inference_steps or DEFAULT_STEPS
+        trace = trace or Trace()
+        with trace.span("pipeline", num_inference_steps=num_inference_steps):
+            output = pipeline(
+                prompt=request.prompt,
+                negative_prompt=request.negative_prompt,
+                num_frames=num_frames,
+                height=height,
+                width=width,
+                guidance_scale=request.guidance_scale,
+                generator=generator,
+                num_inference_steps=num_inference_steps,
+                output_type="latent",
+                **trace.callback_kwargs(pipeline)
+            )
+
+        # Decodificar em blocos e codificar cada um assim que sai da VAE
+        stream_video(_decoded_chunks(pipeline, output.frames), output_path,
+                     request.fps, request.encode_profile)
 
-        # Salvar vídeo
-        import imageio
+        logger.info(f"Vídeo salvo em {output_path}")
 
-        frames = output.frames if hasattr(output, 'frames') else output
-        if isinstance(frames, torch.Tensor):
-            frames = frames.cpu().numpy()
-            frames = ((frames + 1.0) * 127.5).astype('uint8')
+    except Exception as e:
+        logger.error(f"Erro ao gerar vídeo: {str(e)}")
+        raise
 
-        imageio.mimwrite(
-            str(output_path),
-            frames,
-            fps=request.fps,
-            codec='libx264',
-            quality=8
-        )
 
-        logger.info(f"Vídeo salvo em {output_path}")
+def generate_video_wan21_batch(pipeline: Any, requests: List[Any], output_paths: List[Path],
+                               trace: Optional[Trace] = None) -> None:
+    """
+    Gera vários vídeos numa única chamada do pipeline (micro-batching)
+
+    Args:
+        pipeline: Pipeline do modelo
+        requests: GenerateRequests compatíveis (mesma resolução, duração, fps, guidance e steps)
+        output_paths: Caminho de saída de cada request
+        trace: Spans e steps do denoising (ver tracing); None = não registrar
+    """
+    logger.info(f"Gerando lote de {len(requests)} vídeos com Wan 2.1")
+
+    try:
+        first = requests[0]
+        width, height = map(int, first.resolution.split('x'))
+        num_frames = first.duration * first.fps
+
+        # Um gerador por vídeo: cada job mantém sua seed
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        generators = []
+        for request in requests:
+            generator = torch.Generator(device=device)
+            if request.seed is not None:
+                generator.manual_seed(request.seed)
+            else:
+                generator.seed()
+            generators.append(generator)
+
+        negative = None
+        if any(request.negative_prompt for request in requests):
+            negative = [request.negative_prompt or "" for request in requests]
+
+        # batch_key garante o mesmo número de steps em todo o lote
+        num_inference_steps = first.num_inference_steps or DEFAULT_STEPS
+        trace = trace or Trace()
+        with trace.span("pipeline", num_inference_steps=num_inference_steps):
+            output = pipeline(
+                prompt=[request.prompt for request in requests],
+                negative_prompt=negative,
+                num_frames=num_frames,
+                height=height,
+                width=width,
+                guidance_scale=first.guidance_scale,
+                generator=generators,
+                num_inference_steps=num_inference_steps,
+                output_type="latent",
+                **trace.callback_kwargs(pipeline)
+            )
+
+        # Um arquivo por job, cada vídeo decodificado em blocos
+        for index, (output_path, request) in enumerate(zip(output_paths, requests)):
+            stream_video(_decoded_chunks(pipeline, output.frames[index:index + 1]), output_path,
+                         first.fps, request.encode_profile)
+            logger.info(f"Vídeo salvo em {output_path}")
 
     except Exception as e:
-        logger.error(f"Erro ao gerar vídeo: {str(e)}")
+        logger.error(f"Erro ao gerar lote: {str(e)}")
         raise
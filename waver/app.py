@@ -16,8 +16,11 @@ import sys
 
 sys.path.insert(0, str(Path(__file__).parent))
 
-from model_config import load_waver_model, generate_video_waver
+from model_config import load_waver_model, generate_video_waver, generate_video_waver_batch
 from model_loader import ModelLoader
+from embedding_cache import EmbeddingCache
+from model_reaper import ModelReaper, FileRegistry
+from weight_parking import WeightParking
 from api_base import VideoModelAPI
 
 MODEL_NAME = os.getenv("MODEL_NAME", "waver")
@@ -25,20 +28,60 @@ MODEL_PATH = os.getenv("MODEL_PATH", "/models/waver")
 QUANTIZATION = os.getenv("QUANTIZATION", "fp8")
 OUTPUT_DIR = os.getenv("OUTPUT_DIR", "/outputs")
 AUTO_UNLOAD_MINUTES = int(os.getenv("AUTO_UNLOAD_MINUTES", "0"))
+# Um worker por device (ex: "cuda:0,cuda:1"); vazio = um worker
+WORKER_DEVICES = [d.strip() for d in os.getenv("WORKER_DEVICES", "").split(",") if d.strip()]
+# Micro-batching: jobs compatíveis que chegam dentro da janela viram uma chamada do pipeline
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "4"))
+BATCH_WINDOW_MS = int(os.getenv("BATCH_WINDOW_MS", "200"))
+# Cache de embeddings de prompt (LRU em memória + diretório opcional em disco)
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "64"))
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR") or None
+# Reaper: libera o modelo LRU se a memória livre cair abaixo do mínimo (0 = desligado)
+MIN_FREE_MEMORY_GB = float(os.getenv("MIN_FREE_MEMORY_GB", "0"))
+# Registro compartilhado entre containers (ex: /models/.registry); vazio = desligado
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR") or None
+# Carregar e aquecer o modelo no startup (/ready responde 503 até terminar)
+PRELOAD = os.getenv("PRELOAD", "0") == "1"
+WARMUP = os.getenv("WARMUP", "1") == "1"
+# RAM para pesos descarregados da GPU (tier "parked"); 0 = descartar
+PARK_BUDGET_GB = float(os.getenv("PARK_BUDGET_GB", "0"))
+# Codificação: perfil padrão (preview, archive, web) e codificações simultâneas fora do worker
+ENCODE_PROFILE = os.getenv("ENCODE_PROFILE", "web")
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", "2"))
+# Intervalo da amostragem de CPU/RAM/GPU servida pelo /info e /info/history
+SYSTEM_SAMPLE_SECONDS = float(os.getenv("SYSTEM_SAMPLE_SECONDS", "5"))
+# "mmap": safetensors mapeados direto no device, sem cópia na RAM nem cpu offload
+LOAD_MODE = os.getenv("LOAD_MODE", "standard")
 
 model_loader = ModelLoader(
     model_name=MODEL_NAME,
     model_path=MODEL_PATH,
     load_function=load_waver_model,
     quantization=QUANTIZATION,
-    auto_unload_minutes=AUTO_UNLOAD_MINUTES if AUTO_UNLOAD_MINUTES > 0 else None
+    auto_unload_minutes=AUTO_UNLOAD_MINUTES if AUTO_UNLOAD_MINUTES > 0 else None,
+    embedding_cache=EmbeddingCache(EMBED_CACHE_SIZE, EMBED_CACHE_DIR) if EMBED_CACHE_SIZE > 0 else None,
+    reaper=ModelReaper(
+        min_free_gb=MIN_FREE_MEMORY_GB,
+        registry=FileRegistry(MODEL_REGISTRY_DIR, MODEL_NAME) if MODEL_REGISTRY_DIR else None
+    ),
+    load_mode=LOAD_MODE,
+    parking=WeightParking(PARK_BUDGET_GB) if PARK_BUDGET_GB > 0 else None
 )
 
 api = VideoModelAPI(
     model_name=MODEL_NAME,
     model_loader=model_loader,
     generate_function=generate_video_waver,
-    output_dir=OUTPUT_DIR
+    output_dir=OUTPUT_DIR,
+    devices=WORKER_DEVICES or None,
+    batch_function=generate_video_waver_batch,
+    max_batch_size=MAX_BATCH_SIZE,
+    batch_window_ms=BATCH_WINDOW_MS,
+    preload=PRELOAD,
+    warmup=WARMUP,
+    encode_profile=ENCODE_PROFILE,
+    encode_workers=ENCODE_WORKERS,
+    system_sample_seconds=SYSTEM_SAMPLE_SECONDS
 )
 
 app = api.app
@@ -6,102 +6,358 @@ I2V: LTX-2 (LTXVImgToVideoConditionOnly) | Wan 2.2 5B (WanImageToVideo)
 Acesse em: http://localhost:7862
 """
 
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
-import requests as _requests
+from fastapi import FastAPI, UploadFile, File, Request
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, Response, StreamingResponse
 import shutil
 import tempfile
+import hashlib
 from pydantic import BaseModel
 import uvicorn
 import json
+import os
 import subprocess
 import time
 import threading
-import queue as _queue
+import asyncio
 from pathlib import Path
 from datetime import datetime
+from typing import Optional
 import uuid
 
+from job_store import open_job_store
+from comfyui_client import ComfyUIClient, ComfyUIError, PromptTracker, video_outputs
+from video_workflows import build_workflow, request_hash
+from job_scheduler import AffinityScheduler, MemoryAdmission
+from cost_model import CostModel
+
 app = FastAPI(title="DGX Video Studio v4.2")
 
 OUTPUT_DIR     = Path("/home/nmaldaner/projetos/VideosDGX/ComfyUI/output")
+INPUT_DIR      = OUTPUT_DIR.parent / "input"   # imagens enviadas ao ComfyUI (I2V)
 BASE_DIR       = Path("/home/nmaldaner/projetos/VideosDGX")
 RESTART_SCRIPT = BASE_DIR / "reiniciar_comfyui.sh"
-JOBS_FILE      = Path("/tmp/dgx_jobs_v4_2.json")
+JOBS_FILE      = Path("/tmp/dgx_jobs_v4_2.json")   # legado (importado pelo backend sqlite)
+JOBS_DB        = Path(os.getenv("JOBS_DB", "/tmp/dgx_jobs_v4_2.db"))
+JOB_STORE      = os.getenv("JOB_STORE", "sqlite")   # sqlite | json
 JOB_TIMEOUT    = 7200  # 2 horas
+SWEEP_INTERVAL = 2     # segundos entre varreduras de timeout/progresso
+SSE_KEEPALIVE  = 15    # segundos entre comentários keep-alive no /api/events
+HISTORY_POLL   = 30    # consulta /history (rede de segurança) com WebSocket conectado
+HISTORY_POLL_NO_WS = 5 # ... e sem WebSocket
 COMFYUI_URL    = "http://127.0.0.1:8188"
+# Instâncias do ComfyUI (separadas por vírgula). Cada instância executa um
+# prompt por vez; jobs só rodam em paralelo com mais de uma instância (ex:
+# portas 8188 e 8189 sobre o mesmo diretório ComfyUI/, compartilhando input/output)
+COMFYUI_URLS   = [u.strip() for u in os.getenv("COMFYUI_URLS", COMFYUI_URL).split(",") if u.strip()]
 
-# Estimativa de VRAM por modelo (GB)
+# Estimativa de VRAM por modelo (GB), medida em 1280x704 com 57 frames
 VRAM_ESTIMATE = {
     "wan22_14b": 90,
     "wan22_5b":  25,
     "ltx2":      45,
 }
-
-SCRIPTS = {
-    "ltx2":          BASE_DIR / "gerar_video_ltx2.py",
-    "ltx2_i2v":      BASE_DIR / "gerar_video_ltx2_i2v.py",
-    "wan22_5b":      BASE_DIR / "gerar_video_wan22_5b.py",
-    "wan22_5b_i2v":  BASE_DIR / "gerar_video_wan22_5b_i2v.py",
-    "wan22_14b":     BASE_DIR / "gerar_video_wan22_14b.py",
+VRAM_REFERENCE_WORKLOAD = 1280 * 704 * 57
+VRAM_ACTIVATION_SHARE   = 0.25   # fração da estimativa que escala com resolução x frames
+
+# Segundos de geração por frame (prior do modelo de custo, antes de haver jobs concluídos)
+SECONDS_PER_FRAME = {
+    "wan22_14b": 6,
+    "wan22_5b":  2,
+    "ltx2":      3,
 }
 
+# Política de memória: modelos ficam carregados no ComfyUI entre jobs enquanto
+# a soma das estimativas couber no orçamento (GB10: 128 GB unificados)
+MEMORY_BUDGET_GB   = float(os.getenv("MEMORY_BUDGET_GB", "110"))
+MIN_FREE_GB        = float(os.getenv("MIN_FREE_GB", "12"))   # watermark após cada job
+RESTART_AFTER_FAILURES = 2                                   # falhas seguidas antes de reiniciar
+
+# Escalonamento: jobs do modelo já carregado furam a fila, até estes limites
+SCHED_MAX_SKIPS = int(os.getenv("SCHED_MAX_SKIPS", "3"))     # ultrapassagens por job
+SCHED_MAX_WAIT  = float(os.getenv("SCHED_MAX_WAIT", "1800")) # segundos na fila
+
+# Admissão: jobs rodam em paralelo (um por instância) enquanto a soma das
+# estimativas de memória couber no teto
+ADMISSION_CEILING_GB = float(os.getenv("ADMISSION_CEILING_GB", str(MEMORY_BUDGET_GB)))
+
+tracker = PromptTracker()
+cost = CostModel(SECONDS_PER_FRAME, VRAM_ESTIMATE, VRAM_REFERENCE_WORKLOAD, VRAM_ACTIVATION_SHARE)
+job_peaks = {}         # job_id -> {"peak_gb": float, "exclusive": bool} (amostrado pelo sweeper)
+
 jobs = {}
 comfyui_progress = {}  # prompt_id -> {"value": int, "max": int}
+prompt_jobs = {}       # prompt_id -> job_id
 
 # ---------------------------------------------------------------------------
 # Fila de execução
 # ---------------------------------------------------------------------------
 
-job_queue = _queue.Queue()      # fila de job_ids
+scheduler = AffinityScheduler(SCHED_MAX_SKIPS, SCHED_MAX_WAIT)  # fila de job_ids
+admission = MemoryAdmission(ADMISSION_CEILING_GB)
 cancelled_jobs = set()          # job_ids marcados para cancelamento
+
+# Deduplicação: pedidos idênticos (mesmo request_hash) reaproveitam o vídeo
+# de um job concluído ou acompanham o job em andamento
+dedup_lock = threading.Lock()
+inflight = {}                   # request_hash -> job_id primário (queued/processing)
+followers = {}                  # job_id primário -> [job_ids que aguardam o mesmo vídeo]
+image_digests = {}              # image_name -> sha256 do conteúdo enviado
 jobs_lock = threading.Lock()    # protege acesso ao dict `jobs`
+persist_lock = threading.Lock() # serializa gravações no store (ordem das revisões = ordem das mudanças)
+
+
+# ---------------------------------------------------------------------------
+# Eventos em tempo real (SSE)
+# ---------------------------------------------------------------------------
+
+class EventBroker:
+    """
+    Distribui eventos para os clientes conectados em /api/events.
+    publish() pode ser chamado de qualquer thread; a entrega acontece no event loop.
+    """
+
+    def __init__(self, max_pending: int = 256):
+        self.max_pending = max_pending
+        self._subscribers = set()
+        self._loop = None
+
+    def bind_loop(self, loop):
+        self._loop = loop
+
+    def subscribe(self) -> asyncio.Queue:
+        q = asyncio.Queue(maxsize=self.max_pending)
+        self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue):
+        self._subscribers.discard(q)
+
+    def publish(self, event: dict):
+        if self._loop is None or not self._subscribers:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._fanout, event)
+        except RuntimeError:
+            pass  # loop encerrado
+
+    def _fanout(self, event: dict):
+        for q in list(self._subscribers):
+            try:
+                q.put_nowait(event)
+            except asyncio.QueueFull:
+                # Cliente lento: descarta; ele ressincroniza via /api/jobs?since=
+                pass
+
+
+broker = EventBroker()
 
 
 # ---------------------------------------------------------------------------
 # Persistência
 # ---------------------------------------------------------------------------
 
+store = open_job_store(JOB_STORE, db_path=JOBS_DB, json_path=JOBS_FILE)
+
 def load_jobs():
     global jobs
-    if JOBS_FILE.exists():
-        try:
-            with open(JOBS_FILE) as f:
-                jobs = json.load(f)
-        except Exception:
-            jobs = {}
+    jobs = store.load_all()
+    for job_id, job in jobs.items():
+        job.setdefault("job_id", job_id)
+
+def persist_job(job_id: str, fields: Optional[dict] = None) -> bool:
+    """
+    Aplica `fields` ao job e grava um snapshot dele (uma linha no backend sqlite).
+    O I/O do store acontece fora de jobs_lock: leituras do dict `jobs` não esperam
+    o commit. Bloqueia; no event loop, chamar via asyncio.to_thread.
+    """
+    with persist_lock:
+        with jobs_lock:
+            job = jobs.get(job_id)
+            if job is None:
+                return False
+            if fields:
+                job.update(fields)
+            snapshot = dict(job)
+        store.put(snapshot)
+        with jobs_lock:
+            job["revision"] = snapshot["revision"]
+        broker.publish({"type": "job", "job": snapshot})
+    return True
+
+def save_job(job_id: str):
+    """Persiste apenas o job alterado."""
+    persist_job(job_id)
+
+def update_job(job_id: str, **fields):
+    """Atualiza campos de um job e persiste somente ele."""
+    if not persist_job(job_id, fields):
+        return
+
+    if fields.get("status") in ("completed", "error"):
+        settle_duplicates(job_id)
+    elif job_id in followers and fields.keys() & {"status", "progress_pct", "queue_position"}:
+        mirror_followers(job_id)
+
+def cost_sample(job: dict):
+    """Amostra do modelo de custo a partir de um job concluído (None se incompleto)."""
+    if job.get("status") != "completed" or not job.get("generation_seconds"):
+        return None
+    req = job.get("request", {})
+    return {
+        "model":     req.get("model"),
+        "width":     req.get("width", 1280),
+        "height":    req.get("height", 704),
+        "frames":    req.get("frames", 57),
+        "steps":     req.get("steps", 30),
+        "seconds":   job["generation_seconds"],
+        "warm":      job.get("memory_action") == "warm",
+        "peak_gb":   job.get("peak_memory_gb"),
+        "exclusive": job.get("peak_exclusive", False),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Deduplicação de pedidos idênticos
+# ---------------------------------------------------------------------------
+
+def file_sha256(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def image_digest(image_name: str) -> str:
+    """sha256 da imagem de entrada (registrado no upload; senão lido de ComfyUI/input)."""
+    if image_name in image_digests:
+        return image_digests[image_name]
+    path = INPUT_DIR / image_name
+    if path.is_file():
+        image_digests[image_name] = file_sha256(path)
+        return image_digests[image_name]
+    return hashlib.sha256(image_name.encode("utf-8")).hexdigest()
+
+
+def link_video(job_id: str, source: dict):
+    """
+    Vídeo do job `source` para `job_id`: hard link com o job_id no nome (sem
+    copiar bytes); se o link não for possível, aponta para o mesmo arquivo.
+    Returns:
+        Caminho relativo a OUTPUT_DIR, ou None se o vídeo original não existe mais
+    """
+    src = OUTPUT_DIR / source.get("video_file", "")
+    if not source.get("video_file") or not src.is_file():
+        return None
+    name = src.name.replace(source["job_id"], job_id)
+    dst = src.with_name(name if name != src.name else f"{job_id}_{src.name}")
+    try:
+        if not dst.exists():
+            os.link(src, dst)
+        return dst.relative_to(OUTPUT_DIR).as_posix()
+    except OSError:
+        return source["video_file"]
+
+
+def complete_from(job_id: str, source: dict) -> bool:
+    """Conclui `job_id` instantaneamente com o vídeo de um job idêntico já concluído."""
+    video_file = link_video(job_id, source)
+    if not video_file:
+        return False
+    update_job(job_id,
+               status="completed",
+               video_file=video_file,
+               completed_at=datetime.now().isoformat(),
+               generation_time="0s",
+               video_size_mb=source.get("video_size_mb"),
+               seed_used=source.get("seed_used"),
+               deduplicated_from=source["job_id"],
+               coalesced_into=None,
+               queue_position=None,
+               progress_pct=100)
+    return True
+
+
+def mirror_followers(primary_id: str):
+    """Replica status/progresso do job primário nos pedidos idênticos que o acompanham."""
+    primary = jobs.get(primary_id, {})
+    fields = {k: primary.get(k) for k in ("status", "progress_pct", "queue_position", "started_at")}
+    for job_id in list(followers.get(primary_id, [])):
+        job = jobs.get(job_id, {})
+        if any(job.get(k) != v for k, v in fields.items()):
+            update_job(job_id, **fields)
+
+
+def settle_duplicates(job_id: str):
+    """
+    Job terminou: conclui os seguidores com o mesmo vídeo ou propaga o erro.
+    Se o primário foi cancelado pelo usuário, o primeiro seguidor vira o novo primário.
+    """
+    job = jobs.get(job_id, {})
+    req_hash = job.get("request_hash")
+    with dedup_lock:
+        if req_hash and inflight.get(req_hash) == job_id:
+            del inflight[req_hash]
+        waiting = followers.pop(job_id, [])
+        if waiting and job["status"] == "error" and job.get("error") == "Cancelado pelo usuário":
+            new_primary, waiting = waiting[0], waiting[1:]
+            inflight[req_hash] = new_primary
+            followers[new_primary] = waiting
+        else:
+            new_primary = None
+
+    if new_primary:
+        update_job(new_primary, coalesced_into=None, status="queued")
+        for other in waiting:
+            update_job(other, coalesced_into=new_primary)
+        scheduler.put(new_primary, jobs[new_primary]["request"]["model"], jobs[new_primary].get("memory_gb", 0))
+        refresh_queue_positions()
+        return
+
+    for other in waiting:
+        if job["status"] == "completed" and complete_from(other, job):
+            continue
+        update_job(other, status="error", coalesced_into=None,
+                   error=job.get("error") or "Job idêntico terminou sem vídeo")
 
-def save_jobs():
-    with open(JOBS_FILE, 'w') as f:
-        json.dump(jobs, f, indent=2)
 
 load_jobs()
+# Histórico concluído alimenta o modelo de custo (ordem de criação)
+for _job in jobs.values():
+    _sample = cost_sample(_job)
+    if _sample:
+        cost.observe(_sample)
 
 
 # ---------------------------------------------------------------------------
 # WebSocket watcher para progresso real do ComfyUI
 # ---------------------------------------------------------------------------
 
-def start_progress_watcher():
+def start_progress_watcher(backend):
     try:
         import websocket
     except ImportError:
         print("  [info] websocket-client não instalado - progresso por estimativa de tempo")
         return
 
-    client_id = str(uuid.uuid4())
-
     def on_message(ws_app, message):
         try:
             data = json.loads(message)
+            tracker.handle_message(data)
             if data.get("type") == "progress":
                 pd = data.get("data", {})
                 pid = pd.get("prompt_id")
                 if pid:
-                    comfyui_progress[pid] = {
-                        "value": pd.get("value", 0),
-                        "max":   max(pd.get("max", 1), 1),
-                    }
+                    value, maximum = pd.get("value", 0), max(pd.get("max", 1), 1)
+                    comfyui_progress[pid] = {"value": value, "max": maximum}
+                    broker.publish({
+                        "type":      "progress",
+                        "prompt_id": pid,
+                        "job_id":    prompt_jobs.get(pid),
+                        "value":     value,
+                        "max":       maximum,
+                        "pct":       int(value / maximum * 100),
+                    })
         except Exception:
             pass
 
@@ -109,12 +365,15 @@ def start_progress_watcher():
         while True:
             try:
                 ws_app = websocket.WebSocketApp(
-                    f"ws://127.0.0.1:8188/ws?clientId={client_id}",
+                    backend.client.ws_url,
+                    on_open=lambda _ws: backend.ws_connected.set(),
+                    on_close=lambda _ws, *_: backend.ws_connected.clear(),
                     on_message=on_message,
                 )
                 ws_app.run_forever()
             except Exception:
                 pass
+            backend.ws_connected.clear()
             time.sleep(5)
 
     threading.Thread(target=run, daemon=True).start()
@@ -124,64 +383,167 @@ def start_progress_watcher():
 # Utilitários
 # ---------------------------------------------------------------------------
 
-def restart_comfyui():
+def restart_comfyui(backend=None):
+    """Reinicia a instância principal (o script só conhece a porta 8188)."""
+    backend = backend or backends[0]
+    if backend is not backends[0]:
+        return False
     try:
         result = subprocess.run([str(RESTART_SCRIPT)], capture_output=True, text=True, timeout=30)
-        return result.returncode == 0
+        ok = result.returncode == 0
     except Exception:
-        return False
+        ok = False
+    backend.policy.reset()
+    return ok and backend.client.wait_ready(timeout=60)
+
+
+class ComfyMemoryPolicy:
+    """
+    Decide entre manter modelos carregados, liberar memória (/free) ou reiniciar
+    o ComfyUI. Jobs seguidos do mesmo modelo não pagam recarga de checkpoints.
+    As instâncias dividem a mesma memória unificada: o orçamento é um só, somado
+    sobre todas, e as decisões são serializadas por `lock`.
+    """
+
+    lock = threading.Lock()
+
+    def __init__(self, backend, estimates: dict, budget_gb: float, min_free_gb: float):
+        self.backend = backend
+        self.estimates = estimates
+        self.budget_gb = budget_gb
+        self.min_free_gb = min_free_gb
+        self.resident = set()   # modelos que (provavelmente) estão carregados no ComfyUI
+        self.failures = 0
+
+    def estimate(self, model: str) -> float:
+        return self.estimates.get(model, max(self.estimates.values()))
+
+    def reset(self):
+        self.resident.clear()
+
+    def resident_gb(self, exclude: Optional[str] = None) -> float:
+        return sum(self.estimate(m) for m in list(self.resident) if m != exclude)
+
+    def before_job(self, model: str) -> str:
+        """Prepara a memória para o próximo job; retorna a ação tomada."""
+        if model in self.resident:
+            return "warm"
+
+        need = self.estimate(model)
+        with self.lock:
+            if self._fits(need):
+                self.resident.add(model)
+                return "coresident" if len(self.resident) > 1 else "cold"
+
+            # Não cabe: descarregar esta instância (mesmo sem modelos conhecidos,
+            # o ComfyUI pode manter cache de antes de um restart da interface) e,
+            # se ainda faltar, as instâncias ociosas
+            self._free()
+            for other in backends:
+                if self._fits(need):
+                    break
+                if other is not self.backend and other.job_id is None and other.policy.resident:
+                    other.policy._free()
+            self.resident.add(model)
+            return "freed"
+
+    def after_job(self, model: str, ok: bool):
+        """Libera memória só sob pressão; reinicia apenas se o ComfyUI não responde."""
+        if ok:
+            self.failures = 0
+            free_gb = self.backend.client.free_memory_gb()
+            if free_gb is not None and free_gb < self.min_free_gb:
+                self._free()
+            return
+
+        # Falha (OOM, erro de nó, timeout...): descarrega tudo por segurança
+        self.failures += 1
+        if self.failures >= RESTART_AFTER_FAILURES or not self._free():
+            self.failures = 0
+            restart_comfyui(self.backend)
+
+    def _fits(self, need: float) -> bool:
+        """Modelos quentes de todas as instâncias + `need` no orçamento e na memória livre"""
+        resident_gb = sum(b.policy.resident_gb() for b in backends)
+        free_gb = self.backend.client.free_memory_gb()
+        return resident_gb + need <= self.budget_gb and (free_gb is None or free_gb >= need)
+
+    def _free(self) -> bool:
+        self.resident.clear()
+        try:
+            self.backend.client.free()
+            return True
+        except ComfyUIError:
+            return False
+
+    def info(self) -> dict:
+        return {
+            "resident":         sorted(self.resident),
+            "resident_gb":      self.resident_gb(),
+            "budget_gb":        self.budget_gb,
+            "min_free_gb":      self.min_free_gb,
+            "failures":         self.failures,
+        }
+
+
+class ComfyBackend:
+    """
+    Uma instância do ComfyUI: sessão HTTP, estado do WebSocket e política de
+    memória próprios. O clientId da sessão é o mesmo do watcher WebSocket para
+    que o ComfyUI envie progress/executing dos nossos prompts a ele.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.client = ComfyUIClient(url)
+        self.ws_connected = threading.Event()
+        self.policy = ComfyMemoryPolicy(self, VRAM_ESTIMATE, MEMORY_BUDGET_GB, MIN_FREE_GB)
+        self.job_id = None   # job em execução nesta instância
+
+    def info(self) -> dict:
+        return {"url": self.url, "job_id": self.job_id,
+                "ws_connected": self.ws_connected.is_set(), **self.policy.info()}
+
+
+backends = [ComfyBackend(url) for url in COMFYUI_URLS]
+comfy = backends[0].client   # instância principal (uploads; input/ compartilhado)
+
+
+def resident_models() -> set:
+    """Modelos carregados em qualquer instância."""
+    return set().union(*(b.policy.resident for b in backends))
+
+
+def unreserved_resident_gb(exclude=None) -> float:
+    """
+    GB de modelos quentes que nenhum job em execução reservou, em todas as
+    instâncias exceto `exclude` (a que vai rodar o job reaproveita ou libera os seus).
+    """
+    total = 0.0
+    for b in backends:
+        if b is exclude:
+            continue
+        running = jobs.get(b.job_id, {}).get("request", {}).get("model") if b.job_id else None
+        total += b.policy.resident_gb(exclude=running)
+    return total
 
 
 def upload_image_to_comfyui(image_path: str) -> str:
     """Faz upload de uma imagem para o ComfyUI e retorna o nome do arquivo."""
-    p = Path(image_path)
-    with open(p, "rb") as f:
-        files = {"image": (p.name, f, "image/png")}
-        r = _requests.post(f"{COMFYUI_URL}/upload/image", files=files, timeout=30)
-    r.raise_for_status()
-    return r.json()["name"]
-
-
-def build_cmd(job_id: str, req):
-    # Determina se é I2V (tem imagem + modelo suporta)
-    has_image = bool(getattr(req, "image_name", None))
-    model_key = req.model
-    if has_image and req.model in ("ltx2", "wan22_5b"):
-        model_key = f"{req.model}_i2v"
-
-    script = str(SCRIPTS[model_key])
-    prefix = f"web_{model_key}_{job_id}"
-
-    base = ["python3", script, req.prompt,
-            "--width",  str(req.width),
-            "--height", str(req.height),
-            "--frames", str(req.frames),
-            "--fps",    str(req.fps),
-            "--cfg",    str(req.cfg),
-            "--seed",   str(req.seed),
-            "--output", prefix]
-
-    if req.model == "ltx2":
-        base += ["--negative", req.negative]
-        if has_image:
-            base += ["--image-name", req.image_name]
-        return base
-
-    elif req.model == "wan22_5b":
-        base += ["--negative", req.negative]
-        if has_image:
-            base += ["--image-name", req.image_name]
-        return base
-
-    elif req.model == "wan22_14b":
-        base += ["--steps", str(req.steps), "--split-step", str(req.split_step)]
-        return base
-
-
-def estimate_seconds(req) -> int:
-    """Estimativa grosseira de segundos de geração baseada em frames e modelo."""
-    factors = {"wan22_14b": 6, "wan22_5b": 2, "ltx2": 3}
-    return req.frames * factors.get(req.model, 4)
+    return comfy.upload_image(image_path)
+
+
+def estimate_seconds(req, warm=None) -> int:
+    """Segundos de geração previstos pelo modelo de custo (prior: frames x fator do modelo)."""
+    return int(cost.estimate_seconds(req.model, req.width, req.height, req.frames, req.steps, warm))
+
+
+def estimate_memory_gb(req) -> float:
+    """
+    Memória estimada do job pelo modelo de custo. Prior: pesos do modelo (fixos)
+    mais ativações, que escalam com resolução x frames (ver VRAM_ESTIMATE).
+    """
+    return cost.estimate_memory_gb(req.model, req.width, req.height, req.frames)
 
 
 def calc_progress_pct(job: dict) -> int:
@@ -204,110 +566,246 @@ def calc_progress_pct(job: dict) -> int:
 # Job runner
 # ---------------------------------------------------------------------------
 
-def run_job(job_id: str, req):
+def run_job(job_id: str, req, backend):
     # Verificar cancelamento antes de iniciar
     if job_id in cancelled_jobs:
         cancelled_jobs.discard(job_id)
-        jobs[job_id]["status"] = "error"
-        jobs[job_id]["error"]  = "Cancelado pelo usuário"
-        save_jobs()
+        update_job(job_id, status="error", error="Cancelado pelo usuário")
         return
 
+    ok = False
     try:
-        jobs[job_id]["status"]            = "processing"
-        jobs[job_id]["started_at"]        = datetime.now().isoformat()
-        jobs[job_id]["estimated_seconds"] = estimate_seconds(req)
-        save_jobs()
-
-        cmd    = build_cmd(job_id, req)
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=JOB_TIMEOUT)
-
-        # Capturar prompt_id do stdout
-        for line in result.stdout.splitlines():
-            if "Prompt ID:" in line:
-                jobs[job_id]["prompt_id"] = line.split("Prompt ID:")[-1].strip()
-                break
-
-        # Guardar stdout/stderr para diagnóstico
-        jobs[job_id]["stdout"] = result.stdout[-2000:] if result.stdout else ""
-        jobs[job_id]["stderr"] = result.stderr[-2000:] if result.stderr else ""
-
-        if result.returncode != 0 or "SUCESSO" not in result.stdout:
-            jobs[job_id]["status"] = "error"
-            jobs[job_id]["error"]  = (result.stderr or result.stdout or "Erro desconhecido")[:500]
-            save_jobs()
-            restart_comfyui()
+        update_job(job_id,
+                   status="processing",
+                   started_at=datetime.now().isoformat(),
+                   estimated_seconds=estimate_seconds(req),
+                   queue_position=None)
+
+        # Manter modelos quentes; liberar memória só se o próximo modelo não couber
+        memory_action = backend.policy.before_job(req.model)
+        update_job(job_id,
+                   backend=backend.url,
+                   memory_action=memory_action,
+                   estimated_seconds=estimate_seconds(req, warm=memory_action == "warm"))
+
+        # Montar workflow em memória e submeter pela sessão HTTP compartilhada
+        built = build_workflow(job_id, req)
+        try:
+            submitted = backend.client.submit(built["workflow"])
+        except ComfyUIError as e:
+            update_job(job_id, status="error", error=str(e)[:500])
             return
 
-        # Aguardar vídeo aparecer (com verificação de cancelamento)
-        start  = time.time()
-        # Usar job_id como critério (único e presente em qualquer variante T2V/I2V)
-        video_found = None
+        prompt_id = submitted["prompt_id"]
+        prompt_jobs[prompt_id] = job_id
+        tracker.register(prompt_id)
+        update_job(job_id, prompt_id=prompt_id, seed_used=built["seed"])
 
-        while time.time() - start < JOB_TIMEOUT:
-            # Verificar cancelamento durante polling
-            if job_id in cancelled_jobs:
+        start = time.time()
+        try:
+            finished = wait_prompt(job_id, prompt_id, backend)
+            if finished is None:   # cancelado
                 cancelled_jobs.discard(job_id)
-                jobs[job_id]["status"] = "error"
-                jobs[job_id]["error"]  = "Cancelado pelo usuário"
-                save_jobs()
+                # Sem isso o ComfyUI seguiria renderizando o workflow abandonado
+                cancel_prompt(backend, prompt_id)
+                update_job(job_id, status="error", error="Cancelado pelo usuário")
+                ok = True
                 return
-
-            videos = [f for f in OUTPUT_DIR.glob("*.mp4") if job_id in f.name]
-            if videos:
-                video_found = sorted(videos, key=lambda x: x.stat().st_mtime, reverse=True)[0]
-                break
-            time.sleep(5)
+            if not finished:
+                cancel_prompt(backend, prompt_id)
+            result = tracker.result(prompt_id)
+        finally:
+            tracker.discard(prompt_id)
 
         elapsed = time.time() - start
 
-        if video_found:
-            stat = video_found.stat()
-            jobs[job_id]["status"]          = "completed"
-            jobs[job_id]["video_file"]      = video_found.name
-            jobs[job_id]["completed_at"]    = datetime.now().isoformat()
-            jobs[job_id]["generation_time"] = f"{elapsed:.0f}s"
-            jobs[job_id]["video_size_mb"]   = round(stat.st_size / 1048576, 2)
+        if not finished:
+            update_job(job_id, status="error",
+                       error=f"Timeout: vídeo não encontrado após {elapsed:.0f}s")
+        elif result["error"]:
+            update_job(job_id, status="error", error=result["error"][:500])
         else:
-            jobs[job_id]["status"] = "error"
-            jobs[job_id]["error"]  = f"Timeout: vídeo não encontrado após {elapsed:.0f}s"
-
-        save_jobs()
-        restart_comfyui()
-        time.sleep(15)
+            video_found = locate_video(job_id, result["videos"] or history_videos(prompt_id, backend))
+            if video_found:
+                stat = video_found.stat()
+                peak = job_peaks.get(job_id, {})
+                update_job(job_id,
+                           status="completed",
+                           video_file=video_found.relative_to(OUTPUT_DIR).as_posix(),
+                           completed_at=datetime.now().isoformat(),
+                           generation_time=f"{elapsed:.0f}s",
+                           generation_seconds=round(elapsed, 1),
+                           seconds_per_step=round(elapsed / max(req.steps, 1), 2),
+                           peak_memory_gb=peak.get("peak_gb"),
+                           peak_exclusive=peak.get("exclusive", False),
+                           video_size_mb=round(stat.st_size / 1048576, 2),
+                           progress_pct=100)
+                sample = cost_sample(jobs[job_id])
+                if sample:   # None quando generation_seconds arredonda para 0
+                    cost.observe(sample)
+                ok = True
+            else:
+                update_job(job_id, status="error",
+                           error="Workflow terminou sem gerar vídeo")
 
     except Exception as e:
-        jobs[job_id]["status"] = "error"
-        jobs[job_id]["error"]  = str(e)
-        save_jobs()
-        restart_comfyui()
+        update_job(job_id, status="error", error=str(e))
+
+    finally:
+        job_peaks.pop(job_id, None)
+        backend.policy.after_job(req.model, ok)
+
+
+def cancel_prompt(backend, prompt_id: str):
+    """Tira o prompt da fila do ComfyUI ou interrompe sua execução (libera a GPU)."""
+    try:
+        action = backend.client.cancel(prompt_id)
+        print(f"  [cancel] prompt {prompt_id[:8]} em {backend.url}: {action}")
+    except ComfyUIError as e:
+        print(f"  [cancel] Falha ao cancelar prompt {prompt_id[:8]}: {e}")
+
+
+def wait_prompt(job_id: str, prompt_id: str, backend):
+    """
+    Aguarda o término do prompt via mensagens do WebSocket (latência < 1s).
+    /history/{prompt_id} é consultado periodicamente como rede de segurança.
+    Returns:
+        True (terminou), False (timeout) ou None (cancelado pelo usuário)
+    """
+    start = time.time()
+    last_history = start
+    while time.time() - start < JOB_TIMEOUT:
+        if job_id in cancelled_jobs:
+            return None
+        if tracker.wait(prompt_id, timeout=1.0):
+            return True
+
+        interval = HISTORY_POLL if backend.ws_connected.is_set() else HISTORY_POLL_NO_WS
+        if time.time() - last_history >= interval:
+            last_history = time.time()
+            try:
+                entry = backend.client.history(prompt_id)
+            except ComfyUIError:
+                entry = None
+            if entry and tracker.finish_from_history(prompt_id, entry):
+                return True
+    return False
+
+
+def history_videos(prompt_id: str, backend) -> list:
+    """Vídeos registrados em /history (quando o WebSocket não trouxe `executed`)."""
+    try:
+        entry = backend.client.history(prompt_id)
+    except ComfyUIError:
+        return []
+    return video_outputs(entry.get("outputs") or {}) if entry else []
+
+
+def locate_video(job_id: str, videos: list):
+    """
+    Caminho do vídeo gerado: nome exato informado pelo ComfyUI; varredura de
+    OUTPUT_DIR (pelo job_id no prefixo) apenas como fallback.
+    """
+    for rel in videos:
+        fp = OUTPUT_DIR / rel
+        if fp.is_file():
+            return fp
+
+    found = [f for f in OUTPUT_DIR.glob(f"*{job_id}*.mp4")]
+    if found:
+        return max(found, key=lambda x: x.stat().st_mtime)
+    return None
 
 
 # ---------------------------------------------------------------------------
-# Queue worker (thread única que processa jobs sequencialmente)
+# Queue workers (um por instância do ComfyUI, limitados pela admissão de memória)
 # ---------------------------------------------------------------------------
 
-def queue_worker():
-    """Thread única que processa jobs sequencialmente da fila."""
+def queue_worker(backend):
+    """Processa jobs da fila nesta instância, preferindo o modelo já carregado nela."""
+    def admit(job_id, entry):
+        return admission.try_admit(job_id, entry["cost_gb"],
+                                   resident_gb=unreserved_resident_gb(exclude=backend))
+
     while True:
-        job_id = job_queue.get()   # bloqueia até ter trabalho
+        # Bloqueia até haver um job que caiba no orçamento de memória
+        job_id = scheduler.get(preferred=backend.policy.resident, admit=admit)
+        try:
+            if job_id in cancelled_jobs:
+                cancelled_jobs.discard(job_id)
+                update_job(job_id, status="error", error="Cancelado pelo usuário")
+                continue
 
-        if job_id in cancelled_jobs:
-            cancelled_jobs.discard(job_id)
             if job_id in jobs:
-                jobs[job_id]["status"] = "error"
-                jobs[job_id]["error"]  = "Cancelado pelo usuário"
-                save_jobs()
-            job_queue.task_done()
+                # Reconstruir req a partir dos dados salvos
+                req_data = jobs[job_id].get("request", {})
+                req = VideoRequest(**req_data)
+                refresh_queue_positions()
+                backend.job_id = job_id
+                run_job(job_id, req, backend)
+        finally:
+            backend.job_id = None
+            admission.release(job_id)
+            scheduler.wake()
+
+
+# ---------------------------------------------------------------------------
+# Manutenção: posições na fila, timeouts e progresso (fora do caminho HTTP)
+# ---------------------------------------------------------------------------
+
+def refresh_queue_positions():
+    """
+    Recalcula posições na ordem prevista pelo escalonador (afinidade incluída);
+    grava apenas jobs cuja posição mudou.
+    """
+    order = scheduler.order(preferred=resident_models())
+    for pos, job_id in enumerate(order, 1):
+        job = jobs.get(job_id)
+        if job and job["status"] == "queued" and job.get("queue_position") != pos:
+            update_job(job_id, queue_position=pos)
+
+
+def sample_peak_memory():
+    """
+    Registra o pico de memória do device durante cada job em execução. O pico
+    só é atribuível ao job (`exclusive`) se ele rodou sozinho, sem outros modelos carregados.
+    """
+    for backend in backends:
+        job_id = backend.job_id
+        job = jobs.get(job_id) if job_id else None
+        if not job:
+            continue
+        mem = backend.client.device_memory_gb()
+        if not mem:
             continue
+        model = job.get("request", {}).get("model")
+        exclusive = len(admission) == 1 and resident_models() <= {model}
+        peak = job_peaks.setdefault(job_id, {"peak_gb": 0.0, "exclusive": True})
+        peak["peak_gb"] = round(max(peak["peak_gb"], mem["used"]), 1)
+        peak["exclusive"] = peak["exclusive"] and exclusive
 
-        if job_id in jobs:
-            # Reconstruir req a partir dos dados salvos
-            req_data = jobs[job_id].get("request", {})
-            req = VideoRequest(**req_data)
-            run_job(job_id, req)
 
-        job_queue.task_done()
+def job_sweeper():
+    """Thread de manutenção: marca timeouts, atualiza progress_pct e amostra memória dos jobs ativos."""
+    while True:
+        try:
+            sample_peak_memory()
+            with jobs_lock:
+                # Seguidores de um job idêntico recebem progresso do primário
+                processing = [j for j in jobs.values()
+                              if j["status"] == "processing" and not j.get("coalesced_into")]
+            now = datetime.now()
+            for job in processing:
+                started = datetime.fromisoformat(job.get("started_at") or job["created_at"])
+                if (now - started).total_seconds() > JOB_TIMEOUT:
+                    update_job(job["job_id"], status="error", error="Timeout")
+                    continue
+                pct = calc_progress_pct(job)
+                if pct != job.get("progress_pct"):
+                    update_job(job["job_id"], progress_pct=pct)
+        except Exception as e:
+            print(f"  [warn] sweeper: {e}")
+        time.sleep(SWEEP_INTERVAL)
 
 
 # ---------------------------------------------------------------------------
@@ -790,7 +1288,7 @@ function buildDetailGrid(req, job) {
     ['CFG',         req.cfg],
     ['Steps',       req.steps || '—'],
     ['Split Step',  req.split_step || '—'],
-    ['Seed',        req.seed],
+    ['Seed',        job.seed_used ?? req.seed],
     ['VRAM est.',   vram],
     ['Submetido',   fmt(job.created_at)],
     ['Iniciado',    fmt(job.started_at)],
@@ -806,6 +1304,27 @@ function buildDetailGrid(req, job) {
 
 let _lastJobsFingerprint = '';
 let _lastCompletedCount  = 0;
+const jobsById = {};
+let _jobsRevision = null;
+
+// Busca incremental: primeira carga paginada, depois só jobs alterados (since=revisão),
+// página a página até alcançar a revisão atual (has_more=false).
+// O navegador revalida com If-None-Match; sem mudanças o servidor responde 304.
+async function fetchJobs() {
+  let incremental, data;
+  do {
+    incremental = _jobsRevision !== null;
+    const url = incremental
+      ? `/api/jobs?since=${_jobsRevision}&limit=500`
+      : '/api/jobs?limit=100';
+    const res = await fetch(url);
+    data = await res.json();
+    // Lápides: job removido do servidor
+    data.jobs.forEach(j => { if (j.deleted) delete jobsById[j.job_id]; else jobsById[j.job_id] = j; });
+    _jobsRevision = data.revision;
+  } while (incremental && data.has_more && data.jobs.length);
+  return jobsById;
+}
 
 function jobsFingerprint(jobs) {
   // Representa o que realmente muda: status + progresso por job
@@ -816,8 +1335,12 @@ function jobsFingerprint(jobs) {
 
 async function loadJobs() {
   try {
-    const res  = await fetch('/api/jobs');
-    const jobs = await res.json();
+    renderJobs(await fetchJobs());
+  } catch(e) { console.error(e); }
+}
+
+function renderJobs(jobs) {
+  try {
     const container = document.getElementById('jobsList');
 
     // Só rebuilda o DOM se algo mudou
@@ -988,13 +1511,45 @@ applyPreset(MODEL_PRESETS['wan22_14b'][0]);
 document.getElementById('split-group').style.display = 'block';
 document.getElementById('i2v-section').style.display = 'none';  // 14B = T2V only
 
-// Refresh adaptativo: 4s com jobs ativos, 20s quando tudo parado
+// Eventos em tempo real via SSE (/api/events). Com o stream conectado o
+// polling vira só uma ressincronização lenta.
+let _eventsConnected = false;
+let _renderPending   = false;
+
+function scheduleRender() {
+  if (_renderPending) return;
+  _renderPending = true;
+  requestAnimationFrame(() => { _renderPending = false; renderJobs(jobsById); });
+}
+
+function connectEvents() {
+  if (!window.EventSource) return;
+  const es = new EventSource('/api/events');
+  // hello chega a cada (re)conexão: buscar o que mudou enquanto estava desconectado
+  es.addEventListener('hello', () => { _eventsConnected = true; loadJobs(); });
+  es.addEventListener('job', e => {
+    const job = JSON.parse(e.data).job;
+    jobsById[job.job_id] = job;
+    scheduleRender();
+  });
+  es.addEventListener('progress', e => {
+    const p   = JSON.parse(e.data);
+    const job = p.job_id && jobsById[p.job_id];
+    if (job && job.status === 'processing' && job.progress_pct !== p.pct) {
+      job.progress_pct = p.pct;
+      scheduleRender();
+    }
+  });
+  es.onerror = () => { _eventsConnected = false; };  // EventSource reconecta sozinho
+}
+
+// Refresh adaptativo: 4s com jobs ativos, 20s quando tudo parado, 60s com SSE ativo
 let _jobsTimer = null;
 function scheduleJobsRefresh(hasActive) {
   clearTimeout(_jobsTimer);
   _jobsTimer = setTimeout(async () => {
     await loadJobs();
-  }, hasActive ? 4000 : 20000);
+  }, _eventsConnected ? 60000 : (hasActive ? 4000 : 20000));
 }
 
 // Sobrescrever loadJobs para encadear o próximo refresh
@@ -1014,6 +1569,7 @@ switchTab = function(tab, el) {
 
 loadJobs();
 loadGallery();
+connectEvents();
 </script>
 </body>
 </html>"""
@@ -1042,16 +1598,46 @@ class VideoRequest(BaseModel):
 @app.post("/api/generate")
 async def generate(request: VideoRequest):
     job_id = str(uuid.uuid4())[:8]
-    jobs[job_id] = {
-        "job_id":     job_id,
-        "status":     "queued",
-        "request":    request.model_dump(),
-        "created_at": datetime.now().isoformat(),
-    }
-    save_jobs()
-    job_queue.put(job_id)
-    queue_pos = job_queue.qsize()
-    return {"job_id": job_id, "status": "queued", "queue_position": queue_pos}
+    queue_pos = scheduler.qsize() + 1
+    req_hash = request_hash(request, image_digest(request.image_name) if request.image_name else "")
+    with jobs_lock:
+        jobs[job_id] = {
+            "job_id":         job_id,
+            "status":         "queued",
+            "request":        request.model_dump(),
+            "request_hash":   req_hash,
+            "created_at":     datetime.now().isoformat(),
+            "queue_position": queue_pos,
+            "memory_gb":      estimate_memory_gb(request),
+        }
+    # Gravações no store (SQLite) fora do event loop
+    await asyncio.to_thread(save_job, job_id)
+
+    if req_hash:
+        # Mesmo pedido com seed fixa já renderizado: conclui na hora
+        done = await asyncio.to_thread(store.find_completed, req_hash)
+        if done and done["job_id"] != job_id and await asyncio.to_thread(complete_from, job_id, done):
+            return {"job_id": job_id, "status": "completed", "deduplicated_from": done["job_id"]}
+
+        # Mesmo pedido na fila ou em execução: acompanha o job existente
+        with dedup_lock:
+            primary = inflight.get(req_hash)
+            if primary and jobs.get(primary, {}).get("status") in ("queued", "processing"):
+                followers.setdefault(primary, []).append(job_id)
+            else:
+                inflight[req_hash] = job_id
+                primary = None
+        if primary:
+            await asyncio.to_thread(update_job, job_id, coalesced_into=primary)
+            await asyncio.to_thread(mirror_followers, primary)
+            return {"job_id": job_id, "status": jobs[job_id]["status"], "coalesced_into": primary,
+                    "queue_position": jobs[job_id].get("queue_position")}
+
+    scheduler.put(job_id, request.model, jobs[job_id]["memory_gb"])
+    # Com afinidade, o job pode furar a fila na frente de outros modelos
+    await asyncio.to_thread(refresh_queue_positions)
+    return {"job_id": job_id, "status": "queued",
+            "queue_position": jobs[job_id].get("queue_position", queue_pos)}
 
 
 @app.post("/api/cancel/{job_id}")
@@ -1060,16 +1646,28 @@ async def cancel_job(job_id: str):
     if not job:
         return JSONResponse(status_code=404, content={"error": "Job não encontrado"})
 
+    if job.get("coalesced_into") and job["status"] in ("queued", "processing"):
+        # Acompanhava um job idêntico: só se desliga dele
+        with dedup_lock:
+            waiting = followers.get(job["coalesced_into"], [])
+            if job_id in waiting:
+                waiting.remove(job_id)
+        await asyncio.to_thread(update_job, job_id, status="error", error="Cancelado pelo usuário",
+                                coalesced_into=None, queue_position=None)
+        return {"ok": True, "message": "Job cancelado"}
+
     if job["status"] == "queued":
-        # Cancelamento imediato: marcar para pular no worker
-        cancelled_jobs.add(job_id)
-        job["status"] = "error"
-        job["error"]  = "Cancelado pelo usuário"
-        save_jobs()
+        # Cancelamento imediato: retirar da fila (ou, se o worker já o
+        # retirou, marcar para ser pulado)
+        if not scheduler.remove(job_id):
+            cancelled_jobs.add(job_id)
+        await asyncio.to_thread(update_job, job_id, status="error", error="Cancelado pelo usuário",
+                                queue_position=None)
+        await asyncio.to_thread(refresh_queue_positions)
         return {"ok": True, "message": "Job cancelado"}
 
     elif job["status"] == "processing":
-        # Sinaliza cancelamento; run_job vai detectar no próximo ciclo de polling
+        # run_job detecta em até 1s e cancela o prompt no ComfyUI (/queue + /interrupt)
         cancelled_jobs.add(job_id)
         return {"ok": True, "message": "Cancelamento solicitado"}
 
@@ -1080,27 +1678,79 @@ async def cancel_job(job_id: str):
 
 
 @app.get("/api/jobs")
-async def get_jobs():
-    # Calcular posições na fila
-    queued_ids = [jid for jid, j in jobs.items() if j["status"] == "queued"]
-    for i, jid in enumerate(queued_ids):
-        jobs[jid]["queue_position"] = i + 1
-
-    for job in jobs.values():
-        # Marcar timeouts
-        if job["status"] == "processing":
-            started = datetime.fromisoformat(job.get("started_at", job["created_at"]))
-            if (datetime.now() - started).total_seconds() > JOB_TIMEOUT:
-                job["status"] = "error"
-                job["error"]  = "Timeout"
-            else:
-                # Injetar progresso ao retornar
-                job["progress_pct"] = calc_progress_pct(job)
-    save_jobs()
-    return jobs
+async def get_jobs(request: Request,
+                   status: Optional[str] = None,
+                   since: Optional[int] = None,
+                   limit: int = 50,
+                   offset: int = 0):
+    """
+    Lista jobs (somente leitura; posições, timeouts e progresso são mantidos
+    pelas threads worker/sweeper).
+      status: filtro separado por vírgula (ex: queued,processing)
+      since:  revisão retornada pela chamada anterior; devolve só jobs alterados,
+              em ordem de revisão, e lápides ({job_id, deleted: true}) dos removidos;
+              `total` vem null (o delta não é contado). Com `has_more`, `revision`
+              é a do último job da página: chamar de novo com since=revision até
+              has_more=false
+    Responde 304 quando o ETag enviado em If-None-Match ainda é válido.
+    """
+    limit = max(1, min(limit, 500))
+    offset = max(0, offset)
+    statuses = [s for s in status.split(",") if s] if status else None
+
+    # Revisão lida antes da consulta: no pior caso um job é reenviado na próxima chamada
+    revision = store.revision
+    etag = f'W/"{revision}:{status or ""}:{since}:{limit}:{offset}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    if since is None:
+        page, total = await asyncio.to_thread(store.query, statuses, None, limit, offset)
+        has_more = offset + len(page) < total
+    else:
+        # Uma linha a mais diz se há outra página, sem COUNT(*)
+        page, total = await asyncio.to_thread(store.query, statuses, since, limit + 1, offset)
+        has_more = len(page) > limit
+        page = page[:limit]
+        if has_more:
+            # Não pular os jobs alterados que ficaram para a próxima página
+            revision = page[-1]["revision"]
+    return JSONResponse(
+        content={"revision": revision, "total": total, "has_more": has_more, "jobs": page},
+        headers=headers,
+    )
+
+
+@app.get("/api/events")
+async def events(request: Request):
+    """
+    Server-Sent Events: transições de estado (`job`) e progresso por step (`progress`).
+    Cada (re)conexão recebe `hello` com a revisão atual para o cliente ressincronizar.
+    """
+    q = broker.subscribe()
+
+    async def stream():
+        try:
+            yield f"retry: 3000\nevent: hello\ndata: {json.dumps({'revision': store.revision})}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(q.get(), timeout=SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(q)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
-@app.get("/api/video/{filename}")
+@app.get("/api/video/{filename:path}")
 async def get_video(filename: str):
     # Confina a OUTPUT_DIR — previne path traversal (ex: ../../etc/passwd)
     fp = (OUTPUT_DIR / filename).resolve()
@@ -1137,7 +1787,9 @@ async def upload_image(file: UploadFile = File(...)):
         with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
             shutil.copyfileobj(file.file, tmp)
             tmp_path = tmp.name
+        digest = file_sha256(tmp_path)
         image_name = upload_image_to_comfyui(tmp_path)
+        image_digests[image_name] = digest   # entra no request_hash dos jobs I2V
         Path(tmp_path).unlink(missing_ok=True)
         return {"name": image_name}
     except Exception as e:
@@ -1146,14 +1798,40 @@ async def upload_image(file: UploadFile = File(...)):
 
 @app.post("/api/restart")
 async def restart():
-    ok = restart_comfyui()
+    ok = await asyncio.to_thread(restart_comfyui)
     return {"status": "ok" if ok else "error"}
 
 
+@app.get("/api/memory")
+async def memory_policy():
+    """Modelos mantidos carregados no ComfyUI e orçamento de memória."""
+    return {"admission": admission.info(), "backends": [b.info() for b in backends]}
+
+
+@app.get("/api/cost-model")
+async def cost_model_info():
+    """Modelo de custo aprendido: coeficientes por modelo e erro das previsões recentes."""
+    return cost.info()
+
+
+@app.get("/api/queue")
+async def queue_stats():
+    """Profundidade da fila por modelo e ordem prevista de execução."""
+    stats = scheduler.stats()
+    stats["resident"] = sorted(resident_models())
+    stats["order"] = scheduler.order(preferred=resident_models())
+    return stats
+
+
 # ---------------------------------------------------------------------------
 # Startup
 # ---------------------------------------------------------------------------
 
+@app.on_event("startup")
+async def bind_event_loop():
+    broker.bind_loop(asyncio.get_running_loop())
+
+
 if __name__ == "__main__":
     print("=" * 60)
     print("  DGX Video Studio v4.2 - Fila de Jobs + Cancelamento")
@@ -1170,7 +1848,9 @@ if __name__ == "__main__":
     print()
     print("  Acesse: http://localhost:7862")
     print()
-    # Iniciar thread worker da fila
-    threading.Thread(target=queue_worker, daemon=True).start()
-    start_progress_watcher()
+    # Um worker e um watcher WebSocket por instância do ComfyUI
+    for backend in backends:
+        threading.Thread(target=queue_worker, args=(backend,), daemon=True).start()
+        start_progress_watcher(backend)
+    threading.Thread(target=job_sweeper, daemon=True).start()
     uvicorn.run(app, host="0.0.0.0", port=7862, log_level="warning")